@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import numpy as np
+import tensorflow as tf
+
+# Full training state checkpoints, driven by the 'checkpoint' section of the
+# 'fit' section of the yaml config:
+#   every_epochs: save after every N epochs (0 for none)
+#   every_minutes: save after the first epoch ending N minutes after the last save (0 for none)
+#   keep: number of checkpoints kept
+# A checkpoint holds the model weights, the optimizer state (with the step count
+# the learning rate schedule depends on), the epoch and the state of the
+# EarlyStopping and ModelCheckpoint callbacks, so a resumed run continues with
+# the next epoch as if it was never stopped (only the shuffling and augmentation
+# draw other random numbers)
+
+# callback attributes saved with a checkpoint
+callback_state = {tf.keras.callbacks.EarlyStopping: ['wait', 'best', 'stopped_epoch', 'best_epoch'],
+                  tf.keras.callbacks.ModelCheckpoint: ['best', 'epochs_since_last_save']}
+
+class TrainingCheckpoint(tf.keras.callbacks.Callback):
+    # model must be compiled, callbacks are the callbacks whose state is saved
+    def __init__(self, model, checkpoint_dir, every_epochs=1, every_minutes=0, keep=2, callbacks=()):
+        super().__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.every_epochs = every_epochs
+        self.every_minutes = every_minutes
+        self.callbacks = [callback for callback in callbacks if type(callback) in callback_state]
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, epoch=self.epoch)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, checkpoint_dir, max_to_keep=keep)
+        self.state_file = os.path.join(checkpoint_dir, 'callbacks.json')
+        self.best_weights_file = os.path.join(checkpoint_dir, 'best_weights.npz')
+        self.last_save = time.time()
+        self.restored_state = None
+
+    def save(self, epoch):
+        self.epoch.assign(epoch)
+        path = self.manager.save(checkpoint_number=epoch)
+
+        # callback state, written after the checkpoint it belongs to
+        state = {'checkpoint': os.path.basename(path), 'callbacks': []}
+        for callback in self.callbacks:
+            state['callbacks'].append({name: float(getattr(callback, name)) for name in callback_state[type(callback)]
+                                       if getattr(callback, name, None) is not None})
+            if getattr(callback, 'best_weights', None) is not None:
+                np.savez(self.best_weights_file + '.tmp.npz', *callback.best_weights)
+                os.replace(self.best_weights_file + '.tmp.npz', self.best_weights_file)
+        with open(self.state_file + '.tmp', 'w') as stream:
+            json.dump(state, stream)
+        os.replace(self.state_file + '.tmp', self.state_file)
+        self.last_save = time.time()
+        print('Saved training checkpoint {} (epoch {})'.format(path, epoch))
+
+    # Restore the last checkpoint, returns the epoch to continue with (0 without checkpoint)
+    # The callback state is restored when training begins, after the callbacks reset it
+    def restore(self):
+        if not os.path.exists(self.state_file):
+            print('No training checkpoint in {}, starting from scratch'.format(self.checkpoint_dir))
+            return 0
+        with open(self.state_file) as stream:
+            state = json.load(stream)
+        self.checkpoint.restore(os.path.join(self.checkpoint_dir, state['checkpoint']))
+        self.restored_state = state
+        print('Resuming from training checkpoint {} (epoch {})'.format(state['checkpoint'], int(self.epoch.numpy())))
+        return int(self.epoch.numpy())
+
+    def on_train_begin(self, logs=None):
+        if self.restored_state is None:
+            return
+        for callback, values in zip(self.callbacks, self.restored_state['callbacks']):
+            for name, value in values.items():
+                current = getattr(callback, name, None)
+                setattr(callback, name, value if current is None else type(current)(value))
+            if getattr(callback, 'restore_best_weights', False) and os.path.exists(self.best_weights_file):
+                with np.load(self.best_weights_file) as weights:
+                    callback.best_weights = [weights['arr_%d' % i] for i in range(len(weights.files))]
+        self.restored_state = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.every_epochs and (epoch + 1) % self.every_epochs == 0:
+            self.save(epoch + 1)
+        elif self.every_minutes and time.time() - self.last_save >= 60 * self.every_minutes:
+            self.save(epoch + 1)
@@ -0,0 +1,121 @@
+import time
+import math
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tensorflow.keras.datasets import cifar10
+import yaml
+
+# Training augmentation, same for both pipelines
+rotation_range = 15
+width_shift_range = 0.1
+height_shift_range = 0.1
+horizontal_flip = True
+
+def make_datagen():
+    datagen = ImageDataGenerator(
+        rotation_range=rotation_range,
+        width_shift_range=width_shift_range,
+        height_shift_range=height_shift_range,
+        horizontal_flip=horizontal_flip,
+        #brightness_range=(0.9, 1.2),
+        #contrast_range=(0.9, 1.2)
+    )
+    return datagen
+
+# Single-threaded ImageDataGenerator pipeline
+def datagen_pipeline(X_train, y_train, batch_size):
+    datagen = make_datagen()
+    # run preprocessing on training dataset
+    datagen.fit(X_train)
+    return datagen.flow(X_train, y_train, batch_size=batch_size)
+
+# Random rotation, shifts and horizontal flips of a batch of images, matching
+# ImageDataGenerator (uniform angle and shifts, nearest fill, bilinear sampling)
+def augment(images, labels):
+    images = tf.cast(images, tf.float32)
+    batch = tf.shape(images)[0]
+    height = tf.cast(tf.shape(images)[1], tf.float32)
+    width = tf.cast(tf.shape(images)[2], tf.float32)
+
+    # One random transform per image
+    theta = tf.random.uniform([batch], -rotation_range, rotation_range) * math.pi / 180
+    tx = tf.random.uniform([batch], -width_shift_range, width_shift_range) * width
+    ty = tf.random.uniform([batch], -height_shift_range, height_shift_range) * height
+
+    # Projective transform mapping output pixels to input pixels:
+    # rotation around the image center followed by the shift
+    cx = (width - 1) / 2
+    cy = (height - 1) / 2
+    cos = tf.cos(theta)
+    sin = tf.sin(theta)
+    zeros = tf.zeros_like(theta)
+    transforms = tf.stack([cos, -sin, cx - cos*cx + sin*cy + tx,
+                           sin, cos, cy - sin*cx - cos*cy + ty,
+                           zeros, zeros], axis=1)
+    images = tf.raw_ops.ImageProjectiveTransformV2(images=images,
+                                                   transforms=transforms,
+                                                   output_shape=tf.shape(images)[1:3],
+                                                   interpolation='BILINEAR',
+                                                   fill_mode='NEAREST')
+
+    if horizontal_flip:
+        flip = tf.random.uniform([batch]) < 0.5
+        images = tf.where(flip[:, tf.newaxis, tf.newaxis, tf.newaxis], tf.reverse(images, axis=[2]), images)
+
+    return images, labels
+
+# Parallel tf.data pipeline, one epoch is X_train.shape[0] // batch_size batches
+# Augmentation runs on whole batches in parallel map calls
+def tfdata_pipeline(X_train, y_train, batch_size):
+    dataset = tf.data.Dataset.from_tensor_slices((X_train, y_train))
+    dataset = dataset.cache()
+    dataset = dataset.shuffle(X_train.shape[0], reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size, drop_remainder=True)
+    dataset = dataset.map(augment, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+    return dataset
+
+# Training input selected by the 'pipeline' entry of the config
+# ('datagen' for ImageDataGenerator, 'tfdata' for tf.data)
+def training_pipeline(pipeline, X_train, y_train, batch_size):
+    if pipeline == 'tfdata':
+        return tfdata_pipeline(X_train, y_train, batch_size)
+    elif pipeline == 'datagen':
+        return datagen_pipeline(X_train, y_train, batch_size)
+    raise ValueError('Unknown pipeline: {}'.format(pipeline))
+
+# Images per second produced by a pipeline, after one warmup batch
+def benchmark(pipeline, X_train, y_train, batch_size, num_batches):
+    iterator = iter(training_pipeline(pipeline, X_train, y_train, batch_size))
+    next(iterator)
+    start = time.time()
+    for _ in range(num_batches):
+        images, _ = next(iterator)
+    # make sure the last batch is actually computed
+    np.asarray(images)
+    return num_batches * batch_size / (time.time() - start)
+
+def main(args):
+    with open(args.config) as stream:
+        config = yaml.safe_load(stream)
+    batch_size = config['fit']['batch_size']
+    num_classes = 10
+
+    (X_train, y_train), _ = cifar10.load_data()
+    y_train = tf.keras.utils.to_categorical(y_train, num_classes)
+    num_batches = min(args.batches, X_train.shape[0] // batch_size - 1)
+
+    for pipeline in ['datagen', 'tfdata']:
+        images_per_second = benchmark(pipeline, X_train, y_train, batch_size, num_batches)
+        print('{}: {:.0f} images/sec'.format(pipeline, images_per_second))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, default = "baseline.yml", help="specify yaml config")
+    parser.add_argument('-b', '--batches', type=int, default = 100, help="number of batches to time")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,64 @@
+import gzip
+import numpy as np
+import tensorflow as tf
+import tensorflow_model_optimization as tfmot
+
+# Magnitude pruning of the Conv2D and Dense layers, driven by the 'pruning'
+# section of the yaml config:
+#   enabled: turn pruning on
+#   sparsity: final fraction of zero weights
+#   initial_sparsity: fraction of zero weights when pruning starts
+#   begin_epoch, end_epoch: epochs over which the polynomial schedule ramps up
+#   frequency: training steps between two pruning updates
+
+def prune_model(model, pruning_config, steps_per_epoch):
+    schedule = tfmot.sparsity.keras.PolynomialDecay(
+        initial_sparsity=float(pruning_config.get('initial_sparsity', 0.0)),
+        final_sparsity=float(pruning_config['sparsity']),
+        begin_step=int(pruning_config.get('begin_epoch', 0)) * steps_per_epoch,
+        end_step=int(pruning_config.get('end_epoch', 10)) * steps_per_epoch,
+        frequency=int(pruning_config.get('frequency', 100)))
+
+    # wrap only the weight layers, BatchNormalization etc. stay dense
+    def prune_layer(layer):
+        if isinstance(layer, (tf.keras.layers.Conv2D, tf.keras.layers.Dense)):
+            return tfmot.sparsity.keras.prune_low_magnitude(layer, pruning_schedule=schedule)
+        return layer
+
+    return tf.keras.models.clone_model(model, clone_function=prune_layer)
+
+# advances the pruning step, required while training a pruned model
+def pruning_callbacks():
+    return [tfmot.sparsity.keras.UpdatePruningStep()]
+
+# Remove the pruning wrappers, save the sparse model and report the actual
+# sparsity per layer and the compressed size compared with dense float32 weights
+def export_pruned_model(model, file_path):
+    model = tfmot.sparsity.keras.strip_pruning(model)
+    model.save(file_path)
+
+    print('###################')
+    print('# PRUNING SUMMARY #')
+    print('###################')
+    total_params = 0
+    total_zeros = 0
+    for layer in model.layers:
+        if not isinstance(layer, (tf.keras.layers.Conv2D, tf.keras.layers.Dense)):
+            continue
+        kernel = layer.get_weights()[0]
+        zeros = int(np.sum(kernel == 0))
+        total_params += kernel.size
+        total_zeros += zeros
+        print("layer:", layer.name, kernel.shape, " sparsity: %.3f" % (zeros / kernel.size))
+    print("Total kernel sparsity: %.3f (%d of %d weights are zero)" % (total_zeros / total_params, total_zeros, total_params))
+
+    # compressed size of all the weights, dense float32 size as the baseline
+    weights = np.concatenate([np.asarray(w, dtype=np.float32).ravel() for w in model.get_weights()])
+    dense_size = weights.nbytes
+    compressed_size = len(gzip.compress(weights.tobytes()))
+    with open(file_path, 'rb') as stream:
+        compressed_file_size = len(gzip.compress(stream.read()))
+    print("Dense weights: %d bytes, gzipped sparse weights: %d bytes (%.2fx smaller)" % (dense_size, compressed_size, dense_size / compressed_size))
+    print("Gzipped model file %s: %d bytes" % (file_path, compressed_file_size))
+
+    return model
@@ -6,168 +6,148 @@ from tensorflow.keras.layers import Input, Dense, Activation, Flatten, BatchNorm
 from tensorflow.keras.layers import Conv2D, AveragePooling2D, MaxPooling2D, Add
 from tensorflow.keras.regularizers import l1_l2
 
-#define model
-def resnet_v1_eembc(input_shape=[32, 32, 3], num_classes=10, num_filters=[16, 32, 64], 
-                    kernel_sizes=[3, 1], strides=[1, 2], l1p=1e-4, l2p=0):
-
-    # Input layer, change kernel size to 7x7 and strides to 2 for an official resnet
-    inputs = Input(shape=input_shape)
-    x = Conv2D(num_filters[0],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[0],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(inputs)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # First stack
-    # Weight layers
-    y = Conv2D(num_filters[0],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[0],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(x)
-    y = BatchNormalization()(y)
-    y = Activation('relu')(y)
-    y = Conv2D(num_filters[0],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[0],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(y)
-    y = BatchNormalization()(y)
-  
-    # Overall residual, connect weight layer and identity paths
-    x = Add()([x, y]) 
-    x = Activation('relu')(x)
-
-    # Second stack
+# Quantization aware training with QKeras
+# quantization is None for a float model, or the 'quantization' section of the
+# yaml config:
+#   bits: weight and activation bits of every layer
+#   integer: integer bits of the weight quantizers
+#   activation_integer: integer bits of the ReLU quantizers
+#   stacks: bits of the layers of one stack, overriding bits, by stack name
+#           ('input', 'stack1', 'stack2', 'stack3', 'output')
+def layer_bits(quantization, stack):
+    if quantization is None:
+        return None
+    return (quantization.get('stacks') or {}).get(stack, quantization['bits'])
+
+# Conv2D, or QConv2D with quantized kernel and bias
+def conv2d(num_filters, kernel_size, strides, l1p, l2p, quantization=None, stack=None):
+    bits = layer_bits(quantization, stack)
+    if bits is None:
+        return Conv2D(num_filters,
+                      kernel_size=kernel_size,
+                      strides=strides,
+                      padding='same',
+                      kernel_initializer='he_normal',
+                      kernel_regularizer=l1_l2(l1=l1p,l2=l2p))
+
+    from qkeras import QConv2D, quantized_bits
+    integer = quantization.get('integer', 0)
+    return QConv2D(num_filters,
+                   kernel_size=kernel_size,
+                   strides=strides,
+                   padding='same',
+                   kernel_quantizer=quantized_bits(bits, integer, alpha=1),
+                   bias_quantizer=quantized_bits(bits, integer, alpha=1),
+                   kernel_initializer='he_normal',
+                   kernel_regularizer=l1_l2(l1=l1p,l2=l2p))
+
+# ReLU, or quantized ReLU
+def relu(quantization=None, stack=None):
+    bits = layer_bits(quantization, stack)
+    if bits is None:
+        return Activation('relu')
+
+    from qkeras import QActivation, quantized_relu
+    return QActivation(quantized_relu(bits, quantization.get('activation_integer', 0)))
+
+# Dense classifier, with quantized kernel and bias before a float softmax
+def dense_softmax(num_classes, quantization=None):
+    bits = layer_bits(quantization, 'output')
+    if bits is None:
+        return Dense(num_classes,
+                     activation='softmax',
+                     kernel_initializer='he_normal')
+
+    from qkeras import QDense, quantized_bits
+    integer = quantization.get('integer', 0)
+    dense = QDense(num_classes,
+                   kernel_quantizer=quantized_bits(bits, integer, alpha=1),
+                   bias_quantizer=quantized_bits(bits, integer, alpha=1),
+                   kernel_initializer='he_normal')
+    return lambda x: Activation('softmax')(dense(x))
+
+# Residual block: two 3x3 weight layers, or 1x1-3x3-1x1 with a quarter of the
+# filters in the middle for a bottleneck block, added to the identity path
+# The identity path gets a 1x1 conv when the block strides or changes the filters
+def residual_block(x, num_filters, kernel_sizes, strides, stride, l1p, l2p, quantization, stack, bottleneck=False):
     # Weight layers
-    y = Conv2D(num_filters[1],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[1],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(x)
-    y = BatchNormalization()(y)
-    y = Activation('relu')(y)
-    y = Conv2D(num_filters[1],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[0],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(y)
-    y = BatchNormalization()(y)
-  
-    # Adjust for change in dimension due to stride in identity
-    x = Conv2D(num_filters[1],
-                  kernel_size=kernel_sizes[1],
-                  strides=strides[1],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(x)
-
-    # Overall residual, connect weight layer and identity paths
-    x = Add()([x, y])
-    x = Activation('relu')(x)
+    if bottleneck:
+        y = conv2d(max(1, num_filters // 4), kernel_sizes[1], stride, l1p, l2p, quantization, stack)(x)
+        y = BatchNormalization()(y)
+        y = relu(quantization, stack)(y)
+        y = conv2d(max(1, num_filters // 4), kernel_sizes[0], strides[0], l1p, l2p, quantization, stack)(y)
+        y = BatchNormalization()(y)
+        y = relu(quantization, stack)(y)
+        y = conv2d(num_filters, kernel_sizes[1], strides[0], l1p, l2p, quantization, stack)(y)
+        y = BatchNormalization()(y)
+    else:
+        y = conv2d(num_filters, kernel_sizes[0], stride, l1p, l2p, quantization, stack)(x)
+        y = BatchNormalization()(y)
+        y = relu(quantization, stack)(y)
+        y = conv2d(num_filters, kernel_sizes[0], strides[0], l1p, l2p, quantization, stack)(y)
+        y = BatchNormalization()(y)
 
-    # Third stack
-    # Weight layers
-    y = Conv2D(num_filters[2],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[1],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(x)
-    y = BatchNormalization()(y)
-    y = Activation('relu')(y)
-    y = Conv2D(num_filters[2],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[0],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(y)
-    y = BatchNormalization()(y)
-  
     # Adjust for change in dimension due to stride in identity
-    x = Conv2D(num_filters[2],
-                  kernel_size=kernel_sizes[1],
-                  strides=strides[1],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(x)
+    if stride != strides[0] or x.shape[-1] != num_filters:
+        x = conv2d(num_filters, kernel_sizes[1], stride, l1p, l2p, quantization, stack)(x)
 
     # Overall residual, connect weight layer and identity paths
     x = Add()([x, y])
-    x = Activation('relu')(x)
-
-    # Final classification layer.
-    pool_size = int(np.amin(x.shape[1:3]))
-    x = AveragePooling2D(pool_size=pool_size)(x)
-    y = Flatten()(x)
-    outputs = Dense(num_classes,
-                    activation='softmax',
-                    kernel_initializer='he_normal')(y)
+    x = relu(quantization, stack)(x)
+    return x
 
-    # Instantiate model.
-    model = Model(inputs=inputs, outputs=outputs)
-    return model
-
-
-def resnet_v1_eembc_tiny(input_shape=[32, 32, 3], num_classes=10, num_filters=[8], 
-                         kernel_sizes=[3, 1], strides=[1, 2], l1p=1e-4, l2p=0):
+#define model
+# Parametric ResNet v1: an input conv layer, one stack of residual blocks per
+# entry of num_filters, average pooling and a dense classifier
+#   kernel_sizes: [weight layer kernel, identity path kernel]
+#   strides: [stride without, stride with downsampling]
+#   blocks_per_stack: residual blocks of every stack, one number or one per stack
+#   stack_strides: stride of the first block of every stack, default no
+#                  downsampling in the first stack and downsampling in the others
+#   bottleneck: 1x1-3x3-1x1 blocks instead of 3x3-3x3
+def resnet_v1(input_shape=[32, 32, 3], num_classes=10, num_filters=[16, 32, 64],
+              kernel_sizes=[3, 1], strides=[1, 2], l1p=1e-4, l2p=0,
+              quantization=None, blocks_per_stack=1, stack_strides=None, bottleneck=False):
+    num_stacks = len(num_filters)
+    if isinstance(blocks_per_stack, int):
+        blocks_per_stack = [blocks_per_stack] * num_stacks
+    if stack_strides is None:
+        stack_strides = [strides[0]] + [strides[1]] * (num_stacks - 1)
 
     # Input layer, change kernel size to 7x7 and strides to 2 for an official resnet
     inputs = Input(shape=input_shape)
-    x = Conv2D(num_filters[0],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[0],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(inputs)
+    x = conv2d(num_filters[0], kernel_sizes[0], strides[0], l1p, l2p, quantization, 'input')(inputs)
     x = BatchNormalization()(x)
-    x = Activation('relu')(x)
+    x = relu(quantization, 'input')(x)
 
-    # First stack
-    # Weight layers
-    y = Conv2D(num_filters[0],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[1],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(x)
-    y = BatchNormalization()(y)
-    y = Activation('relu')(y)
-    y = Conv2D(num_filters[0],
-                  kernel_size=kernel_sizes[0],
-                  strides=strides[0],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(y)
-    y = BatchNormalization()(y)
-
-    # Adjust for change in dimension due to stride in identity
-    x = Conv2D(num_filters[0],
-                  kernel_size=kernel_sizes[1],
-                  strides=strides[1],
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l1_l2(l1=l1p,l2=l2p))(x)
-
-    # Overall residual, connect weight layer and identity paths
-    x = Add()([x, y]) 
-    x = Activation('relu')(x)
+    # Stacks, only the first block of a stack strides
+    for stack in range(num_stacks):
+        for block in range(blocks_per_stack[stack]):
+            stride = stack_strides[stack] if block == 0 else strides[0]
+            x = residual_block(x, num_filters[stack], kernel_sizes, strides, stride, l1p, l2p,
+                               quantization, 'stack%d' % (stack + 1), bottleneck)
 
     # Final classification layer.
     pool_size = int(np.amin(x.shape[1:3]))
     x = AveragePooling2D(pool_size=pool_size)(x)
     y = Flatten()(x)
-    outputs = Dense(num_classes,
-                    activation='softmax',
-                    kernel_initializer='he_normal')(y)
+    outputs = dense_softmax(num_classes, quantization)(y)
 
     # Instantiate model.
     model = Model(inputs=inputs, outputs=outputs)
     return model
+
+# Three stacks, the first one without downsampling
+def resnet_v1_eembc(input_shape=[32, 32, 3], num_classes=10, num_filters=[16, 32, 64], 
+                    kernel_sizes=[3, 1], strides=[1, 2], l1p=1e-4, l2p=0,
+                    quantization=None, **kwargs):
+    return resnet_v1(input_shape, num_classes, num_filters, kernel_sizes, strides, l1p, l2p,
+                     quantization, **kwargs)
+
+# One stack with downsampling
+def resnet_v1_eembc_tiny(input_shape=[32, 32, 3], num_classes=10, num_filters=[8], 
+                         kernel_sizes=[3, 1], strides=[1, 2], l1p=1e-4, l2p=0,
+                         quantization=None, **kwargs):
+    kwargs.setdefault('stack_strides', [strides[1]] * len(num_filters))
+    return resnet_v1(input_shape, num_classes, num_filters, kernel_sizes, strides, l1p, l2p,
+                     quantization, **kwargs)
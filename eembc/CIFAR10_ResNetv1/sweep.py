@@ -0,0 +1,210 @@
+import os
+import sys
+import csv
+import copy
+import json
+import math
+import time
+import random
+import argparse
+import itertools
+import statistics
+import multiprocessing
+import tensorflow as tf
+from tensorflow.keras.datasets import cifar10
+import yaml
+
+# Hyperparameter/architecture sweep of train.py configs (see sweep.yml)
+# The sweep spec gives a base config and the values of dotted config keys
+# (e.g. model.filters, fit.compile.lr_decay):
+#   search: grid for every combination, random for num_trials samples (lists
+#           are sampled uniformly, {min, max, log} ranges continuously)
+#   workers, threads_per_trial: trials running in parallel and the CPU threads
+#           of every trial, workers 0 fills all the cores
+#   early_stopping: stop trials with a val_accuracy below min_val_accuracy, or
+#           below the median of the other trials at the same epoch, after min_epoch
+# Every trial trains in its own process in <output_dir>/trial_<n> (config.yml,
+# train.log, model files) and results.csv collects accuracy, AUC, FLOPs and params
+
+def yaml_load(config):
+    with open(config) as stream:
+        param = yaml.safe_load(stream)
+    return param
+
+# Set a dotted key (e.g. fit.compile.lr_decay) of a nested config
+def set_value(config, key, value):
+    node = config
+    parts = key.split('.')
+    for part in parts[:-1]:
+        node = node.setdefault(part, {})
+    node[parts[-1]] = value
+
+def sample_value(values, rng):
+    if isinstance(values, dict):
+        if values.get('log', False):
+            return math.exp(rng.uniform(math.log(values['min']), math.log(values['max'])))
+        return rng.uniform(values['min'], values['max'])
+    return rng.choice(values)
+
+# Parameter values of every trial, a list of {dotted key: value}
+def expand_trials(spec):
+    parameters = spec['parameters']
+    search = spec.get('search', 'grid')
+    if search == 'grid':
+        keys = list(parameters)
+        return [dict(zip(keys, values)) for values in itertools.product(*[parameters[key] for key in keys])]
+    elif search == 'random':
+        rng = random.Random(spec.get('seed', 0))
+        return [{key: sample_value(values, rng) for key, values in parameters.items()} for _ in range(spec['num_trials'])]
+    raise ValueError('Unknown search: {}'.format(search))
+
+def trial_dir(output_dir, trial_id):
+    return os.path.join(output_dir, 'trial_%03d' % trial_id)
+
+# Write the config of every trial, the base config with the fixed overrides and
+# the trial values, returns the config file names
+# The history of an earlier sweep in the same directory is removed, so early
+# stopping only compares with the trials of this sweep
+def write_trial_configs(spec, trials, base_dir, output_dir):
+    base = yaml_load(os.path.join(base_dir, spec['base']))
+    config_files = []
+    for trial_id, values in enumerate(trials):
+        config = copy.deepcopy(base)
+        for key, value in list((spec.get('overrides') or {}).items()) + list(values.items()):
+            set_value(config, key, value)
+        config['save_dir'] = trial_dir(output_dir, trial_id)
+        os.makedirs(config['save_dir'], exist_ok=True)
+        history_file = os.path.join(config['save_dir'], 'history.json')
+        if os.path.exists(history_file):
+            os.remove(history_file)
+        config_file = os.path.join(config['save_dir'], 'config.yml')
+        with open(config_file, 'w') as stream:
+            yaml.safe_dump(config, stream, default_flow_style=None)
+        config_files.append(config_file)
+    return config_files
+
+# Stops a trial whose val_accuracy is too low or below the median of the other
+# trials of the sweep at the same epoch; every trial writes its history for the others
+class TrialStopper(tf.keras.callbacks.Callback):
+    def __init__(self, trial_id, output_dir, num_trials, min_epoch=5, min_val_accuracy=None, median=False, min_trials=3):
+        super().__init__()
+        self.trial_id = trial_id
+        self.history_file = os.path.join(trial_dir(output_dir, trial_id), 'history.json')
+        self.output_dir = output_dir
+        self.num_trials = num_trials
+        self.min_epoch = min_epoch
+        self.min_val_accuracy = min_val_accuracy
+        self.median = median
+        self.min_trials = min_trials
+        self.val_accuracy = []
+        self.stopped = False
+
+    def other_accuracies(self, epoch):
+        accuracies = []
+        for trial_id in range(self.num_trials):
+            history_file = os.path.join(trial_dir(self.output_dir, trial_id), 'history.json')
+            if trial_id == self.trial_id or not os.path.exists(history_file):
+                continue
+            try:
+                with open(history_file) as stream:
+                    history = json.load(stream)
+            except ValueError: # being written
+                continue
+            if len(history) > epoch:
+                accuracies.append(history[epoch])
+        return accuracies
+
+    def on_epoch_end(self, epoch, logs=None):
+        val_accuracy = float((logs or {}).get('val_accuracy', 0))
+        self.val_accuracy.append(val_accuracy)
+        with open(self.history_file + '.tmp', 'w') as stream:
+            json.dump(self.val_accuracy, stream)
+        os.replace(self.history_file + '.tmp', self.history_file)
+
+        if epoch + 1 < self.min_epoch:
+            return
+        if self.min_val_accuracy is not None and val_accuracy < self.min_val_accuracy:
+            self.stopped = True
+        if self.median:
+            others = self.other_accuracies(epoch)
+            if len(others) >= self.min_trials and val_accuracy < statistics.median(others):
+                self.stopped = True
+        if self.stopped:
+            print('Trial stopped early at epoch %d, val_accuracy %.3f' % (epoch + 1, val_accuracy))
+            self.model.stop_training = True
+
+# Train one trial, in a worker process with its own thread cap and log file
+def run_trial(trial):
+    trial_id, config_file, threads, early_stopping, output_dir, num_trials = trial
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    start = time.time()
+    with open(os.path.join(trial_dir(output_dir, trial_id), 'train.log'), 'w') as log:
+        sys.stdout = log
+        sys.stderr = log
+        stopper = TrialStopper(trial_id, output_dir, num_trials, **(early_stopping or {}))
+        try:
+            import train
+            results = train.main(argparse.Namespace(config=config_file, resume=False), [stopper])
+        except Exception as error:
+            print('Trial failed: {}'.format(error))
+            results = {'error': str(error)}
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+    results['stopped_early'] = stopper.stopped
+    results['seconds'] = time.time() - start
+    return trial_id, results
+
+def write_results(file_name, trials, results):
+    result_keys = ['accuracy', 'auc', 'loss', 'flops', 'macs', 'params', 'epochs', 'stopped_early', 'seconds', 'error']
+    parameter_keys = list(trials[0]) if trials else []
+    with open(file_name, 'w', newline='') as stream:
+        writer = csv.writer(stream)
+        writer.writerow(['trial'] + parameter_keys + result_keys)
+        for trial_id in sorted(results):
+            writer.writerow([trial_id]
+                            + [json.dumps(trials[trial_id][key]) for key in parameter_keys]
+                            + [results[trial_id].get(key, '') for key in result_keys])
+
+def main(args):
+    spec = yaml_load(args.sweep)
+    base_dir = os.path.dirname(os.path.abspath(args.sweep))
+    output_dir = os.path.abspath(args.output or spec.get('output_dir', 'sweep'))
+    threads = args.threads or spec.get('threads_per_trial', 1)
+    workers = args.workers or spec.get('workers', 0) or max(1, os.cpu_count() // threads)
+
+    trials = expand_trials(spec)
+    config_files = write_trial_configs(spec, trials, base_dir, output_dir)
+    print('{} trials, {} workers with {} threads each, results in {}'.format(len(trials), workers, threads, output_dir))
+
+    # download the dataset once, before the workers load it
+    cifar10.load_data()
+
+    results = {}
+    jobs = [(trial_id, config_file, threads, spec.get('early_stopping'), output_dir, len(config_files))
+            for trial_id, config_file in enumerate(config_files)]
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, maxtasksperchild=1) as pool:
+        for trial_id, trial_results in pool.imap_unordered(run_trial, jobs):
+            results[trial_id] = trial_results
+            write_results(os.path.join(output_dir, 'results.csv'), trials, results)
+            print('trial {:3d} {} accuracy={} auc={}{} ({}/{} done)'.format(
+                trial_id, json.dumps(trials[trial_id]), trial_results.get('accuracy'), trial_results.get('auc'),
+                ' stopped early' if trial_results['stopped_early'] else '', len(results), len(jobs)))
+
+    ranked = sorted((r.get('accuracy', 0), trial_id) for trial_id, r in results.items())[::-1]
+    print('Best trials:')
+    for accuracy, trial_id in ranked[:5]:
+        print('trial {:3d} accuracy {:.3f} {}'.format(trial_id, accuracy, json.dumps(trials[trial_id])))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sweep', type=str, default = "sweep.yml", help="specify sweep spec")
+    parser.add_argument('-o', '--output', type=str, default = None, help="output directory, overrides output_dir of the spec")
+    parser.add_argument('-w', '--workers', type=int, default = None, help="trials running in parallel")
+    parser.add_argument('-t', '--threads', type=int, default = None, help="CPU threads per trial")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -2,14 +2,16 @@ import os
 import glob
 import sys
 import argparse
+import numpy as np
 import tensorflow as tf
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from sklearn.metrics import roc_auc_score
 import resnet_v1_eembc
+import data_pipeline
 import yaml
 
-#from keras_flops import get_flops #(different flop calculation)
-import kerop
+# EEMBC methodology metrics
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Methodology'))
+import eval_functions_eembc
+import profile_eembc
 
 from tensorflow.keras.datasets import cifar10
 
@@ -18,7 +20,9 @@ def yaml_load(config):
         param = yaml.safe_load(stream)
     return param
 
-def main(args):
+# extra_callbacks are added to the training callbacks (e.g. by sweep.py)
+# returns the test results and the model cost
+def main(args, extra_callbacks=None):
 
     # parameters
     input_shape = [32,32,3]
@@ -32,11 +36,17 @@ def main(args):
     batch_size = config['fit']['batch_size']
     num_epochs = config['fit']['epochs']
     verbose = config['fit']['verbose']
+    pipeline = config['fit'].get('pipeline', 'datagen')
     patience = config['fit']['patience']
     save_dir = config['save_dir']
     model_name = config['model']['name']
     loss = config['fit']['compile']['loss']
     model_file_path = os.path.join(save_dir, 'model_best.h5')
+    pruning_config = config.get('pruning', {})
+    use_pruning = pruning_config.get('enabled', False)
+    quantization_config = config.get('quantization', {})
+    checkpoint_config = config['fit'].get('checkpoint', {})
+    use_quantization = quantization_config.get('enabled', False)
 
     # optimizer
     optimizer = getattr(tf.keras.optimizers,config['fit']['compile']['optimizer'])
@@ -49,18 +59,8 @@ def main(args):
     y_train = tf.keras.utils.to_categorical(y_train, num_classes)
     y_test = tf.keras.utils.to_categorical(y_test, num_classes)
 
-    # define data generator
-    datagen = ImageDataGenerator(
-        rotation_range=15,
-        width_shift_range=0.1,
-        height_shift_range=0.1,
-        horizontal_flip=True,
-        #brightness_range=(0.9, 1.2),
-        #contrast_range=(0.9, 1.2)
-    )
-
-    # run preprocessing on training dataset
-    datagen.fit(X_train)
+    # training input, ImageDataGenerator or tf.data (see data_pipeline.py)
+    train_data = data_pipeline.training_pipeline(pipeline, X_train, y_train, batch_size)
 
     kwargs = {'input_shape': input_shape,
               'num_classes': num_classes,
@@ -69,6 +69,13 @@ def main(args):
               'strides': strides,
               'l1p': l1p,
               'l2p': l2p}
+    # optional structure of resnet_v1 (blocks per stack, stack strides, bottleneck)
+    for key, arg in [('blocks', 'blocks_per_stack'), ('stack_strides', 'stack_strides'), ('bottleneck', 'bottleneck')]:
+        if key in config['model']:
+            kwargs[arg] = config['model'][key]
+    # quantization aware training with QKeras layers (see resnet_v1_eembc.py)
+    if use_quantization:
+        kwargs['quantization'] = quantization_config
 
     # define model
     model = getattr(resnet_v1_eembc,model_name)(**kwargs)
@@ -80,21 +87,18 @@ def main(args):
     print(model.summary())
     print('#################')
 
-    # analyze FLOPs (see https://github.com/kentaroy47/keras-Opcounter)
-    layer_name, layer_flops, inshape, weights = kerop.profile(model)
-
-    # visualize FLOPs results
-    total_flop = 0
-    for name, flop, shape in zip(layer_name, layer_flops, inshape):
-        print("layer:", name, shape, " MFLOPs:", flop/1e6)
-        total_flop += flop
-    print("Total FLOPs: {} GFLOPs".format(total_flop/1e9))
-
-    # Alternative FLOPs calculation (see https://github.com/tokusumi/keras-flops), ~same answer
-    #total_flop = get_flops(model, batch_size=1)
-    #print("FLOPS: {} GLOPs".format(total_flop/1e9))
+    # analyze MACs, parameters and activation memory (see Methodology/profile_eembc.py)
+    profile = profile_eembc.profile_model(model)
+    profile_eembc.print_profile(profile)
+    os.makedirs(save_dir, exist_ok=True)
+    profile_eembc.write_csv([profile], os.path.join(save_dir, 'profile.csv'))
 
     print(X_train.shape[0] // batch_size)
+
+    # wrap Conv2D/Dense layers for magnitude pruning (see pruning.py)
+    if use_pruning:
+        import pruning
+        model = pruning.prune_model(model, pruning_config, X_train.shape[0] // batch_size)
     lr_schedule = tf.keras.optimizers.schedules.ExponentialDecay(
         initial_lr,
         decay_steps=X_train.shape[0] // batch_size,
@@ -117,11 +121,26 @@ def main(args):
     callbacks = [ModelCheckpoint(model_file_path, monitor='val_loss', verbose=verbose, save_best_only=True),
                  EarlyStopping(monitor='val_loss', patience=patience, verbose=verbose, restore_best_weights=True)
     ]
+    if use_pruning:
+        callbacks += pruning.pruning_callbacks()
+    if extra_callbacks:
+        callbacks += extra_callbacks
+
+    # full training state checkpoints, --resume continues from the last one (see checkpointing.py)
+    initial_epoch = 0
+    if checkpoint_config or args.resume:
+        import checkpointing
+        training_checkpoint = checkpointing.TrainingCheckpoint(model, os.path.join(save_dir, 'checkpoints'),
+                                                               callbacks=callbacks, **checkpoint_config)
+        if args.resume:
+            initial_epoch = training_checkpoint.restore()
+        callbacks.append(training_checkpoint)
 
     # train
-    history = model.fit(datagen.flow(X_train, y_train, batch_size=batch_size),
+    history = model.fit(train_data,
                         steps_per_epoch=X_train.shape[0] // batch_size,
                         epochs=num_epochs,
+                        initial_epoch=initial_epoch,
                         validation_data=(X_test, y_test),
                         callbacks=callbacks,
                         verbose=verbose)
@@ -130,23 +149,39 @@ def main(args):
     # restore "best" model
     model.load_weights(model_file_path)
 
-    # get predictions
-    y_pred = model.predict(X_test)
-
-    # evaluate with test dataset and share same prediction results
-    evaluation = model.evaluate(datagen.flow(X_test, y_test, batch_size=batch_size),
-                                steps=X_test.shape[0] // batch_size)
-
-    
-    auc = roc_auc_score(y_test, y_pred, average='weighted', multi_class='ovr')
-
-    print('Model accuracy = %.3f' % evaluation[1])
-    print('Model weighted average AUC = %.3f' % auc)
+    # get predictions, single inference pass over the full test set
+    y_pred = model.predict(X_test, batch_size=batch_size)
+
+    # evaluate loss, accuracy and AUC from the same predictions
+    labels = np.argmax(y_test, axis=1)
+    test_loss = float(np.mean(tf.keras.losses.get(loss)(y_test, y_pred))) + float(sum(model.losses))
+    accuracy = eval_functions_eembc.calculate_accuracy(y_pred, labels) / 100
+    classes = [str(class_item) for class_item in range(num_classes)]
+    # EEMBC simplified AUC averaged over the classes (the test classes are
+    # balanced, so this is also the weighted average)
+    auc = float(np.mean(eval_functions_eembc.calculate_auc(y_pred, labels, classes, model_name, plot=False)))
+
+    print('Model loss = %.3f' % test_loss)
+    print('Model accuracy = %.3f' % accuracy)
+    print('Model average AUC = %.3f' % auc)
+
+    # strip the pruning wrappers and export the sparse model
+    if use_pruning:
+        pruning.export_pruned_model(model, os.path.join(save_dir, 'model_pruned.h5'))
+
+    return {'loss': test_loss,
+            'accuracy': accuracy,
+            'auc': auc,
+            'epochs': initial_epoch + len(history.history.get('loss', [])),
+            'macs': profile['totals']['macs'],
+            'flops': 2 * profile['totals']['macs'],
+            'params': profile['totals']['params']}
 
     
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str, default = "baseline.yml", help="specify yaml config")
+    parser.add_argument('-r', '--resume', action='store_true', help="continue from the last training checkpoint")
 
     args = parser.parse_args()
 
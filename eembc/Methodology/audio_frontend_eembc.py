@@ -0,0 +1,523 @@
+import os
+import wave
+import time
+import argparse
+import functools
+import multiprocessing
+import numpy as np
+
+# NumPy port of the TFLite Micro audio frontend
+# (tensorflow/lite/experimental/microfrontend), which computes the spectrograms
+# the keyword spotting models are trained on. Results are bit-exact with the
+# audio_microfrontend op and every step runs on all the frames of a batch of
+# clips at once:
+#   window: Hann window in Q12, a frame of window_size ms every window_step ms
+#   fft: 16-bit fixed point real FFT (kiss_fftr), each frame scaled to full range first
+#   filterbank: mel spaced triangular filters in Q12 over the FFT energy, square root
+#   noise reduction: noise estimate per channel subtracted down to a floor
+#   pcan: per channel gain control from the noise estimate
+#   log: fixed point log with a lookup table, scaled by 2^scale_shift
+# Only the noise estimate runs frame by frame (for all clips and channels at once).
+# The frontend tables (window, twiddles, filterbank weights, gain and log lookup
+# tables) are computed once per configuration.
+# Example, checking bit-exactness against the TF op and timing a batch:
+#   python audio_frontend_eembc.py --model micro_speech_eembc --check 64 --benchmark 2000
+
+# Microfrontend settings of the keyword spotting models
+# output_scale multiplies the uint16 frontend output, num_frames pads (with
+# zeros at the end) or cuts the clips to that many frames
+frontend_configs = {
+  # TFLite micro_speech training (input_data.py with preprocess='micro')
+  'micro_speech_eembc': dict(window_size=30, window_step=20, num_channels=40,
+                             upper_band_limit=7500.0, lower_band_limit=125.0,
+                             num_frames=49, output_scale=10.0/256.0),
+  # KWS10_ARM_DSConv README: window=30ms, stride=20ms, 10 bins, upper frequency
+  # limit 4kHz; one second gives 49 frames, the 50th one is zero padding
+  'dsconv_arm_eembc': dict(window_size=30, window_step=20, num_channels=10,
+                           upper_band_limit=4000.0, lower_band_limit=125.0,
+                           num_frames=50, output_scale=10.0/256.0),
+}
+
+# audio_microfrontend op defaults
+default_config = dict(sample_rate=16000, clip_samples=16000, window_size=25, window_step=10, num_channels=32,
+                      upper_band_limit=7500.0, lower_band_limit=125.0, smoothing_bits=10,
+                      even_smoothing=0.025, odd_smoothing=0.06, min_signal_remaining=0.05,
+                      enable_pcan=True, pcan_strength=0.95, pcan_offset=80.0, gain_bits=21,
+                      enable_log=True, scale_shift=6, num_frames=None, output_scale=1.0)
+
+window_bits = 12
+filterbank_bits = 12
+noise_reduction_bits = 14
+pcan_snr_bits = 12
+pcan_output_bits = 6
+wide_dynamic_function_bits = 32
+log_scale_log2 = 16
+log_segments_log2 = 7
+log_coeff = 45426
+
+# Full frontend configuration from a model name or a dict of settings
+def frontend_config(config):
+  if( isinstance(config, str) ):
+    config = frontend_configs[config]
+  return dict(default_config, **config)
+
+def window_samples(config):
+  size = config['window_size'] * config['sample_rate'] // 1000
+  step = config['window_step'] * config['sample_rate'] // 1000
+  return size, step
+
+# Number of bits needed for every value (MostSignificantBit32), 0 for 0
+def bit_length(x):
+  return np.frexp(np.asarray(x, dtype=np.float64))[1].astype(np.int64)
+
+# Store in an int16 like the C code does
+def wrap16(x):
+  return ((x + 32768) & 0xFFFF) - 32768
+
+def freq_to_mel(freq):
+  return np.float32(1127.0 * np.log1p(np.float64(np.float32(freq)) / 700.0))
+
+#
+# Frontend tables
+#
+
+def window_coefficients(size):
+  arg = np.float32(np.pi * 2.0 / np.float32(size))
+  value = (0.5 - 0.5 * np.cos(np.float64(arg) * (np.arange(size) + 0.5))).astype(np.float32)
+  return np.floor(value.astype(np.float64) * (1 << window_bits) + 0.5).astype(np.int32)
+
+def fixed_cexp(phase):
+  return (np.floor(0.5 + 32767 * np.cos(phase)).astype(np.int32),
+          np.floor(0.5 + 32767 * np.sin(phase)).astype(np.int32))
+
+# kiss_fft factors of a power of 2, radix 4 first
+def fft_factors(n):
+  factors = []
+  while( n > 1 ):
+    p = 4 if n % 4 == 0 else 2
+    if( n % p ):
+      raise ValueError("FFT size must be a power of 2")
+    n //= p
+    factors.append((p, n))
+  return factors
+
+# Filterbank weights and unweights of the num_channels+1 channels as dense
+# [spectrum_size, num_channels+1] matrices, with the first and last+1 FFT bin used
+def filterbank_weights(config, spectrum_size):
+  num_channels_plus_1 = config['num_channels'] + 1
+  mel_low = freq_to_mel(config['lower_band_limit'])
+  mel_high = freq_to_mel(config['upper_band_limit'])
+  mel_spacing = np.float32(np.float32(mel_high - mel_low) / np.float32(num_channels_plus_1))
+  center_mel_freqs = [np.float32(mel_low + mel_spacing * np.float32(i + 1)) for i in range(num_channels_plus_1)]
+
+  # Always exclude DC
+  hz_per_sbin = np.float32(0.5 * config['sample_rate'] / (np.float32(spectrum_size) - 1))
+  start_index = int(1.5 + np.float32(np.float32(config['lower_band_limit']) / hz_per_sbin))
+  end_index = 0
+
+  weights = np.zeros((spectrum_size, num_channels_plus_1))
+  unweights = np.zeros((spectrum_size, num_channels_plus_1))
+  frequency_start = start_index
+  for channel in range(num_channels_plus_1):
+    frequency = frequency_start
+    while( freq_to_mel(np.float32(frequency * hz_per_sbin)) <= center_mel_freqs[channel] ):
+      frequency += 1
+    denominator = mel_low if channel == 0 else center_mel_freqs[channel - 1]
+    for index in range(frequency_start, frequency):
+      weight = np.float32(np.float32(center_mel_freqs[channel] - freq_to_mel(np.float32(index * hz_per_sbin)))
+                          / np.float32(center_mel_freqs[channel] - denominator))
+      weights[index, channel] = np.floor(np.float64(np.float32(weight * (1 << filterbank_bits))) + 0.5)
+      unweights[index, channel] = np.floor((1.0 - np.float64(weight)) * (1 << filterbank_bits) + 0.5)
+    end_index = max(end_index, frequency)
+    frequency_start = frequency
+
+  if( end_index >= spectrum_size ):
+    raise ValueError("Filterbank end_index is above spectrum size")
+  return weights, unweights, start_index, end_index
+
+def pcan_gain(config, input_bits, x):
+  x_as_float = np.float32(np.float32(x) / np.float32(1 << input_bits))
+  gain = np.float32(np.float32(1 << config['gain_bits'])
+                    * np.power(np.float32(x_as_float + np.float32(config['pcan_offset'])), np.float32(-config['pcan_strength'])))
+  if( gain > 32767 ):
+    return 32767
+  return int(np.float32(gain + np.float32(0.5)))
+
+# Piecewise quadratic gain lookup table (WideDynamicFunction)
+def pcan_gain_lut(config, input_bits):
+  lut = np.zeros(4 * wide_dynamic_function_bits - 3, dtype=np.int64)
+  lut[0] = pcan_gain(config, input_bits, 0)
+  lut[1] = pcan_gain(config, input_bits, 1)
+  for interval in range(2, wide_dynamic_function_bits + 1):
+    x0 = 1 << (interval - 1)
+    x1 = x0 + (x0 >> 1)
+    x2 = x0 + (x0 - 1) if interval == wide_dynamic_function_bits else 2 * x0
+    y0, y1, y2 = [pcan_gain(config, input_bits, x) for x in (x0, x1, x2)]
+    a1 = 4 * (y1 - y0) - (y2 - y0)
+    a2 = (y2 - y0) - a1
+    lut[4*interval - 6:4*interval - 3] = [y0, wrap16(a1), wrap16(a2)]
+  return lut
+
+# Log lookup table, correction of log2(1 + x) over x in Q16, 128 segments
+def log_lut():
+  x = np.arange((1 << log_segments_log2) + 1) / (1 << log_segments_log2)
+  return np.round((np.log2(1 + x) - x) * (1 << log_scale_log2)).astype(np.int64)
+
+@functools.lru_cache(maxsize=None)
+def frontend_tables(config_items):
+  config = dict(config_items)
+  size, step = window_samples(config)
+  fft_size = 1
+  while( fft_size < size ):
+    fft_size <<= 1
+  ncfft = fft_size // 2
+  weights, unweights, start_index, end_index = filterbank_weights(config, ncfft + 1)
+  input_correction_bits = int(bit_length(fft_size)) - 1 - filterbank_bits // 2
+  return {'size': size,
+          'step': step,
+          'fft_size': fft_size,
+          'window': window_coefficients(size),
+          'factors': fft_factors(ncfft),
+          'fft_order': fft_input_order(np.arange(ncfft), fft_factors(ncfft)),
+          'twiddles': fixed_cexp(-2 * np.pi * np.arange(ncfft) / ncfft),
+          'super_twiddles': fixed_cexp(-np.pi * ((np.arange(ncfft // 2) + 1) / ncfft + 0.5)),
+          'weights': weights,
+          'unweights': unweights,
+          'start_index': start_index,
+          'end_index': end_index,
+          'correction_bits': input_correction_bits,
+          'snr_shift': config['gain_bits'] - input_correction_bits - pcan_snr_bits,
+          'gain_lut': pcan_gain_lut(config, config['smoothing_bits'] - input_correction_bits),
+          'log_lut': log_lut()}
+
+#
+# Fixed point FFT, kiss_fft with 16-bit samples, over the last axis
+# Samples are int16 arrays: sums wrap like the C int16 stores, products are
+# computed in int32
+#
+
+def sround(x):
+  return ((x + (1 << 14)) >> 15).astype(np.int16)
+
+def fixdiv(r, i, div):
+  scale = np.int32(32767 // div)
+  return sround(r * scale), sround(i * scale)
+
+def cmul(ar, ai, br, bi):
+  ar = ar.astype(np.int32)
+  ai = ai.astype(np.int32)
+  return sround(ar*br - ai*bi), sround(ar*bi + ai*br)
+
+def butterfly2(r, i, twiddles, fstride, m):
+  k = np.arange(m) * fstride
+  ar, ai = fixdiv(r[..., :m], i[..., :m], 2)
+  br, bi = fixdiv(r[..., m:], i[..., m:], 2)
+  tr, ti = cmul(br, bi, twiddles[0][k], twiddles[1][k])
+  return np.concatenate([ar + tr, ar - tr], axis=-1), np.concatenate([ai + ti, ai - ti], axis=-1)
+
+def butterfly4(r, i, twiddles, fstride, m):
+  k = np.arange(m) * fstride
+  f = [fixdiv(r[..., q*m:(q+1)*m], i[..., q*m:(q+1)*m], 4) for q in range(4)]
+  s0 = cmul(*f[1], twiddles[0][k], twiddles[1][k])
+  s1 = cmul(*f[2], twiddles[0][2*k], twiddles[1][2*k])
+  s2 = cmul(*f[3], twiddles[0][3*k], twiddles[1][3*k])
+  s5 = (f[0][0] - s1[0], f[0][1] - s1[1])
+  f0 = (f[0][0] + s1[0], f[0][1] + s1[1])
+  s3 = (s0[0] + s2[0], s0[1] + s2[1])
+  s4 = (s0[0] - s2[0], s0[1] - s2[1])
+  return (np.concatenate([f0[0] + s3[0], s5[0] + s4[1], f0[0] - s3[0], s5[0] - s4[1]], axis=-1),
+          np.concatenate([f0[1] + s3[1], s5[1] - s4[0], f0[1] - s3[1], s5[1] + s4[0]], axis=-1))
+
+# Input order of the deepest stage: kf_work splits its input in p interleaved
+# parts at every level (decimation in time)
+def fft_input_order(indices, factors):
+  p, m = factors[0]
+  if( m == 1 ):
+    return indices
+  return np.concatenate([fft_input_order(indices[q::p], factors[1:]) for q in range(p)])
+
+# kf_work without recursion: every stage, deepest first, runs the butterflies
+# of all its sub-FFTs at once
+def fixed_fft(r, i, factors, twiddles, order):
+  r = r[..., order]
+  i = i[..., order]
+  n = r.shape[-1]
+  for depth in reversed(range(len(factors))):
+    p, m = factors[depth]
+    fstride = n // (p * m)
+    shape = r.shape[:-1] + (fstride, p * m)
+    butterfly = butterfly4 if p == 4 else butterfly2
+    r, i = butterfly(r.reshape(shape), i.reshape(shape), twiddles, fstride, m)
+    r = r.reshape(shape[:-2] + (n,))
+    i = i.reshape(shape[:-2] + (n,))
+  return r, i
+
+# Real FFT of fft_size int16 samples as a complex FFT of half the size
+# (kiss_fftr), returns the real and imaginary parts of the fft_size/2+1 bins
+def fixed_rfft(x, tables):
+  ncfft = tables['fft_size'] // 2
+  tr, ti = fixed_fft(x[..., 0::2], x[..., 1::2], tables['factors'], tables['twiddles'], tables['fft_order'])
+  out_r = np.zeros(x.shape[:-1] + (ncfft + 1,), dtype=np.int16)
+  out_i = np.zeros_like(out_r)
+
+  dc_r, dc_i = fixdiv(tr[..., 0], ti[..., 0], 2)
+  out_r[..., 0] = dc_r + dc_i
+  out_r[..., ncfft] = dc_r - dc_i
+
+  # bins k = 1..ncfft/2 and ncfft-k, as slices
+  half = ncfft // 2
+  low = slice(1, half + 1)
+  high = slice(ncfft - 1, ncfft - half - 1, -1)
+  fpk = fixdiv(tr[..., low], ti[..., low], 2)
+  fpnk = fixdiv(tr[..., high], -ti[..., high], 2)
+  f1k = (fpk[0] + fpnk[0], fpk[1] + fpnk[1])
+  f2k = (fpk[0] - fpnk[0], fpk[1] - fpnk[1])
+  tw = cmul(f2k[0], f2k[1], *tables['super_twiddles'])
+  f1k = (f1k[0].astype(np.int32), f1k[1].astype(np.int32))
+  out_r[..., low] = (f1k[0] + tw[0]) >> 1
+  out_i[..., low] = (f1k[1] + tw[1]) >> 1
+  # the middle bin is written twice, the second value stays
+  out_r[..., high] = (f1k[0] - tw[0]) >> 1
+  out_i[..., high] = (tw[1] - f1k[1]) >> 1
+  return out_r, out_i
+
+#
+# Frontend steps
+#
+
+# Rounded square root (Sqrt32 below 2^32, Sqrt64 above)
+def rounded_sqrt(x):
+  root = np.sqrt(x.astype(np.float64)).astype(np.int64)
+  root = np.where(root * root > x, root - 1, root)
+  root = np.where((root + 1) * (root + 1) <= x, root + 1, root)
+  limit = np.where(x >> 32 == 0, 0xFFFF, 0xFFFFFFFF)
+  return np.where((x - root * root > root) & (root != limit), root + 1, root)
+
+def wide_dynamic_function(x, lut):
+  interval = bit_length(x)
+  base = np.maximum(4 * interval - 6, 0)
+  frac = np.where(interval < 11, x << np.maximum(11 - interval, 0), x >> np.maximum(interval - 11, 0)) & 0x3FF
+  result = (lut[base + 2] * frac) >> 5
+  result = result + lut[base + 1] * 32
+  result = result * frac
+  result = (result + (1 << 14)) >> 15
+  result = wrap16(result + lut[base])
+  return np.where(x <= 2, lut[np.minimum(x, 2)], result)
+
+def pcan_shrink(x):
+  return np.where(x < (2 << pcan_snr_bits),
+                  (x * x) >> (2 + 2*pcan_snr_bits - pcan_output_bits),
+                  (x >> (pcan_snr_bits - pcan_output_bits)) - (1 << pcan_output_bits))
+
+# Noise reduction and gain control, frame by frame over [clips, frames, channels]
+# estimate is the noise estimate [clips, channels] before the first frame
+# (None for zeros), returns the output and the estimate after the last frame
+def noise_reduction(signal, config, tables, estimate=None):
+  num_channels = signal.shape[-1]
+  smoothing_bits = config['smoothing_bits']
+  even_smoothing = int(np.float32(config['even_smoothing']) * (1 << noise_reduction_bits))
+  odd_smoothing = int(np.float32(config['odd_smoothing']) * (1 << noise_reduction_bits))
+  min_signal_remaining = int(np.float32(config['min_signal_remaining']) * (1 << noise_reduction_bits))
+  smoothing = np.where(np.arange(num_channels) % 2 == 0, even_smoothing, odd_smoothing)
+
+  if( estimate is None ):
+    estimate = np.zeros(signal.shape[:1] + signal.shape[2:], dtype=np.int64)
+  output = np.empty_like(signal)
+  for frame in range(signal.shape[1]):
+    value = signal[:, frame]
+    scaled_up = (value << smoothing_bits) & 0xFFFFFFFF
+    estimate = (scaled_up * smoothing + estimate * ((1 << noise_reduction_bits) - smoothing)) >> noise_reduction_bits
+    subtracted = (scaled_up - np.minimum(estimate, scaled_up)) >> smoothing_bits
+    value = np.maximum(subtracted, (value * min_signal_remaining) >> noise_reduction_bits)
+    if( config['enable_pcan'] ):
+      gain = wide_dynamic_function(estimate, tables['gain_lut']) & 0xFFFFFFFF
+      value = pcan_shrink(((value * gain) >> tables['snr_shift']) & 0xFFFFFFFF)
+    output[:, frame] = value
+  return output, estimate
+
+def log_scale(signal, config, tables):
+  value = (signal << tables['correction_bits']) & 0xFFFFFFFF
+  lut = tables['log_lut']
+  integer = np.maximum(bit_length(value) - 1, 0)
+  frac = value - (np.int64(1) << integer)
+  frac = np.where(integer < log_scale_log2, frac << np.maximum(log_scale_log2 - integer, 0),
+                  frac >> np.maximum(integer - log_scale_log2, 0))
+  base_seg = frac >> (log_scale_log2 - log_segments_log2)
+  c0 = lut[base_seg]
+  c1 = lut[base_seg + 1]
+  seg_base = (1 << (log_scale_log2 - log_segments_log2)) * base_seg
+  fraction = frac + c0 + (((c1 - c0) * (frac - seg_base)) >> log_scale_log2)
+  log2 = ((integer << log_scale_log2) + fraction) & 0xFFFFFFFF
+  half = 1 << (log_scale_log2 - 1)
+  loge = ((log_coeff * log2 + half) >> log_scale_log2) & 0xFFFFFFFF
+  loge_scaled = (((loge << config['scale_shift']) & 0xFFFFFFFF) + half) >> log_scale_log2
+  return np.minimum(np.where(value > 1, loge_scaled, 0), 0xFFFF)
+
+# Clip samples as int16, float audio in [-1, 1] is scaled by 32768 (as the
+# training scripts do before the frontend); clips are zero padded or cut to
+# the length of num_frames frames
+def clip_samples(audio, config):
+  audio = np.asarray(audio)
+  if( audio.dtype != np.int16 ):
+    audio = np.clip(np.trunc(audio.astype(np.float64) * 32768), -32768, 32767).astype(np.int16)
+  if( config['num_frames'] is not None ):
+    size, step = window_samples(config)
+    length = size + (config['num_frames'] - 1) * step
+    audio = audio[..., :length]
+    if( audio.shape[-1] < length ):
+      audio = np.pad(audio, [(0, 0)] * (audio.ndim - 1) + [(0, length - audio.shape[-1])])
+  return audio
+
+# Filterbank output (before noise reduction) of windows [..., window samples]
+def filterbank_signal(windows, tables):
+  size = tables['size']
+  windowed = (windows.astype(np.int32) * tables['window']) >> window_bits
+
+  # Scale to the full 16-bit range before the fixed point FFT (the int16
+  # magnitude of -32768 wraps to itself and does not count)
+  magnitude = np.abs(windowed)
+  input_shift = 15 - bit_length(np.max(np.where(magnitude > 32767, 0, magnitude), axis=-1))
+  fft_input = np.zeros(windowed.shape[:-1] + (tables['fft_size'],), dtype=np.int16)
+  fft_input[..., :size] = windowed << input_shift[..., np.newaxis]
+  real, imag = fixed_rfft(fft_input, tables)
+
+  # Filterbank, exact in float64 (energies below 2^31, weights below 2^13)
+  real = real.astype(np.int64)
+  imag = imag.astype(np.int64)
+  energy = (real * real + imag * imag).astype(np.float64)
+  energy[..., :tables['start_index']] = 0
+  energy[..., tables['end_index']:] = 0
+  accumulated = (energy @ tables['weights']).astype(np.int64)
+  accumulated[..., 1:] += (energy @ tables['unweights'])[..., :-1].astype(np.int64)
+  return rounded_sqrt(accumulated[..., 1:]) >> input_shift[..., np.newaxis]
+
+# Noise reduction, gain control and log of filterbank output [clips, frames, channels]
+def frontend_output(signal, config, tables, estimate=None):
+  signal, estimate = noise_reduction(signal, config, tables, estimate)
+  if( config['enable_log'] ):
+    signal = log_scale(signal, config, tables)
+  return np.minimum(signal, 0xFFFF).astype(np.uint16), estimate
+
+# uint16 frontend output [clips, frames, channels] of a batch of clips [clips, samples]
+def frontend(audio, config):
+  tables = frontend_tables(tuple(sorted(config.items())))
+  audio = clip_samples(audio, config)
+  # Windows of all the frames, without copying the samples
+  windows = np.lib.stride_tricks.sliding_window_view(audio, tables['size'], axis=-1)[:, ::tables['step']]
+  return frontend_output(filterbank_signal(windows, tables), config, tables)[0]
+
+# Model input features [clips, frames, channels, 1] of a batch of clips,
+# computed chunk_size clips at a time to bound the memory
+def compute_features(audio, config, chunk_size=256):
+  config = frontend_config(config)
+  audio = np.asarray(audio)
+  features = [frontend(audio[start:start+chunk_size], config) for start in range(0, len(audio), chunk_size)]
+  features = np.concatenate(features).astype(np.float32) * np.float32(config['output_scale'])
+  return features[..., np.newaxis]
+
+# Reference: the audio_microfrontend op, one clip at a time, uint16 output
+def reference_frontend(audio, config):
+  import tensorflow as tf
+  from tensorflow.lite.experimental.microfrontend.python.ops import audio_microfrontend_op
+  config = frontend_config(config)
+  audio = clip_samples(audio, config)
+  arguments = {key: config[key] for key in default_config if key not in ('clip_samples', 'num_frames', 'output_scale')}
+  return np.stack([audio_microfrontend_op.audio_microfrontend(tf.constant(clip), out_type=tf.uint16, **arguments).numpy()
+                   for clip in audio])
+
+#
+# Clips
+#
+
+# One clip of a 16-bit PCM wav file (first channel), zero padded or cut to
+# clip_samples (None for the whole file), checking the sample rate unless None
+def read_wav(file_name, clip_samples=16000, sample_rate=None):
+  with wave.open(file_name, 'rb') as stream:
+    if( stream.getsampwidth() != 2 ):
+      raise ValueError("%s is not 16-bit PCM" % file_name)
+    if( sample_rate is not None and stream.getframerate() != sample_rate ):
+      raise ValueError("%s has a sample rate of %d, not %d" % (file_name, stream.getframerate(), sample_rate))
+    audio = np.frombuffer(stream.readframes(stream.getnframes()), dtype='<i2')[::stream.getnchannels()]
+  if( clip_samples is None ):
+    return audio.astype(np.int16)
+  clip = np.zeros(clip_samples, dtype=np.int16)
+  clip[:min(len(audio), clip_samples)] = audio[:clip_samples]
+  return clip
+
+def features_from_files(file_names, config):
+  config = frontend_config(config)
+  return compute_features(np.stack([read_wav(f, config['clip_samples']) for f in file_names]), config)
+
+# Features of many wav files, chunk_size files per job of a pool of workers
+def features_from_file_list(file_names, config, num_workers=os.cpu_count(), chunk_size=256):
+  chunks = [file_names[start:start+chunk_size] for start in range(0, len(file_names), chunk_size)]
+  with multiprocessing.Pool(num_workers) as pool:
+    return np.concatenate(pool.starmap(features_from_files, [(chunk, config) for chunk in chunks]))
+
+# Test clips covering the frontend's corner cases: tones and chirps at many
+# levels, noise, silence, full scale and clipped signals, bursts after silence
+def test_clips(num_clips, clip_samples=16000, sample_rate=16000, seed=0):
+  rng = np.random.default_rng(seed)
+  t = np.arange(clip_samples) / sample_rate
+  clips = []
+  for index in range(num_clips):
+    kind = index % 6
+    level = 10 ** rng.uniform(-4, 0)
+    if( kind == 0 ):
+      clip = np.sin(2*np.pi*rng.uniform(50, 7900)*t)
+    elif( kind == 1 ):
+      f0, f1 = rng.uniform(20, 8000, 2)
+      clip = np.sin(2*np.pi*(f0*t + (f1 - f0)*t*t/2))
+    elif( kind == 2 ):
+      clip = rng.normal(0, 0.3, clip_samples)
+    elif( kind == 3 ):
+      clip = np.zeros(clip_samples)
+      start = rng.integers(0, clip_samples // 2)
+      clip[start:start + clip_samples // 4] = rng.normal(0, 1, clip_samples // 4)[:clip_samples - start] * np.hanning(clip_samples // 4)[:clip_samples - start]
+    elif( kind == 4 ):
+      clip = np.clip(4 * np.sin(2*np.pi*rng.uniform(100, 1000)*t), -1, 1)
+      level = 1
+    else:
+      clip = np.zeros(clip_samples) if index % 12 == 5 else rng.integers(-2, 3, clip_samples) / 32768
+      level = 1
+    clips.append(np.clip(level * clip, -1, 32767/32768))
+  return clip_samples_int16(np.array(clips))
+
+def clip_samples_int16(audio):
+  return np.clip(np.trunc(audio * 32768), -32768, 32767).astype(np.int16)
+
+# Number of values differing from the audio_microfrontend op
+def check_bit_exact(audio, config):
+  config = frontend_config(config)
+  features = frontend(audio, config)
+  reference = reference_frontend(audio, config)
+  if( features.shape != reference.shape ):
+    raise ValueError("Shape %s differs from the reference %s" % (features.shape, reference.shape))
+  return int(np.sum(features != reference)), features.size
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-m', '--model', type=str, nargs='+', default=list(frontend_configs), help="frontend configurations, default all of: " + ', '.join(frontend_configs))
+  parser.add_argument('-w', '--wav', type=str, nargs='*', default=[], help="wav files to check besides the test clips")
+  parser.add_argument('-c', '--check', type=int, default=60, help="number of test clips compared with the audio_microfrontend op (0 to skip)")
+  parser.add_argument('-b', '--benchmark', type=int, default=1000, help="number of clips to time (0 to skip)")
+  args = parser.parse_args()
+
+  failed = False
+  for name in args.model:
+    config = frontend_config(name)
+    if( args.check or args.wav ):
+      audio = test_clips(args.check, config['clip_samples'])
+      if( args.wav ):
+        audio = np.concatenate([audio, np.stack([read_wav(f, config['clip_samples']) for f in args.wav])])
+      mismatches, total = check_bit_exact(audio, config)
+      print(f"{name}: {mismatches} of {total} values differ from the audio_microfrontend op ({len(audio)} clips)")
+      failed = failed or mismatches > 0
+    if( args.benchmark ):
+      audio = test_clips(args.benchmark, config['clip_samples'], seed=1)
+      start = time.time()
+      features = compute_features(audio, config)
+      elapsed = time.time() - start
+      print(f"{name}: features {features.shape[1:]}, {len(audio)/elapsed:.0f} clips/s in one process")
+  if( failed ):
+    raise SystemExit("Features are not bit-exact")
@@ -0,0 +1,200 @@
+import os
+import csv
+import json
+import time
+import platform
+import argparse
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+
+import models_eembc
+import quantize_tflite_eembc
+
+# Latency and throughput benchmark of the EEMBC reference models
+# Every registered model runs on these backends:
+#   keras: eager model call
+#   function: model call compiled with tf.function (graph mode)
+#   tflite: float TFLite model converted from Keras
+#   tflite_int8: full-integer TFLite model (random calibration data)
+# and TFLite files (by default the shipped TFLite_micro_speech model) run on
+# the TFLite interpreter as they are
+# For every thread count, in a new process so TensorFlow starts with that many
+# intra-op threads, the benchmark reports percentiles of the single sample
+# latency and the throughput of batches, after warmup runs
+# Example, all the models with 1 and 4 threads, compared with a previous release:
+#   python benchmark_eembc.py --threads 1 4 --json bench.json --compare bench_previous.json
+
+backends = ['keras', 'function', 'tflite', 'tflite_int8']
+shipped_models = {'micro_speech_shipped': os.path.join(models_eembc.eembc_dir, 'TFLite_micro_speech', 'trained_models', 'model.tflite')}
+
+# Random model input, uniform in [0, 1) for float and over the whole range for integers
+def random_input(shape, dtype, rng):
+  if( np.issubdtype(dtype, np.integer) ):
+    info = np.iinfo(dtype)
+    return rng.integers(info.min, info.max, shape, endpoint=True).astype(dtype)
+  return rng.uniform(0, 1, shape).astype(dtype)
+
+def keras_runner(model):
+  return lambda x: np.asarray(model(x, training=False))
+
+def function_runner(model):
+  predict = tf.function(lambda x: model(x, training=False))
+  return lambda x: np.asarray(predict(x))
+
+# TFLite interpreter call, resizing the input when the batch size changes
+def tflite_runner(tflite_model, num_threads):
+  interpreter = tf.lite.Interpreter(model_content=tflite_model, num_threads=num_threads)
+  interpreter.allocate_tensors()
+  input_details = interpreter.get_input_details()[0]
+  output_index = interpreter.get_output_details()[0]['index']
+  shape = [tuple(input_details['shape'])]
+
+  def run(x):
+    if( x.shape != shape[0] ):
+      interpreter.resize_tensor_input(input_details['index'], x.shape)
+      interpreter.allocate_tensors()
+      shape[0] = x.shape
+    interpreter.set_tensor(input_details['index'], x)
+    interpreter.invoke()
+    return interpreter.get_tensor(output_index)
+  return run, tuple(input_details['shape'][1:]), input_details['dtype']
+
+# Seconds of every timed call, after the warmup calls
+def time_calls(run, x, repeats, warmup):
+  for _ in range(warmup):
+    run(x)
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    run(x)
+    times.append(time.perf_counter() - start)
+  return np.array(times)
+
+# Single sample latency percentiles (ms) and batch throughput (samples/s)
+# Throughput is None when the model has a fixed batch size
+def measure(run, input_shape, dtype, batch_size, repeats, warmup, rng):
+  latency = 1000 * time_calls(run, random_input((1,) + input_shape, dtype, rng), repeats, warmup)
+  result = {'mean_ms': float(np.mean(latency)),
+            'p50_ms': float(np.percentile(latency, 50)),
+            'p90_ms': float(np.percentile(latency, 90)),
+            'p99_ms': float(np.percentile(latency, 99)),
+            'batch_size': batch_size,
+            'throughput': None}
+  try:
+    batch_times = time_calls(run, random_input((batch_size,) + input_shape, dtype, rng), max(repeats // 10, 3), warmup)
+    result['throughput'] = float(batch_size / np.median(batch_times))
+  except (ValueError, RuntimeError) as error:
+    print(f"no batch throughput: {error}")
+  return result
+
+# Benchmark of all the models and backends with one thread count
+# Runs in its own process: TensorFlow threads can be set only before it starts
+def benchmark_threads(threads, names, tflite_files, backend_names, batch_size, repeats, warmup):
+  tf.config.threading.set_intra_op_parallelism_threads(threads)
+  tf.config.threading.set_inter_op_parallelism_threads(1)
+  rng = np.random.default_rng(0)
+  results = []
+
+  def add(name, backend, run, input_shape, dtype):
+    result = dict(model=name, backend=backend, threads=threads)
+    result.update(measure(run, input_shape, dtype, batch_size, repeats, warmup, rng))
+    print(f"{name:<28}{backend:<14}{threads:>3} threads  p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms  "
+          + ("" if result['throughput'] is None else f"{result['throughput']:10.1f} samples/s"))
+    results.append(result)
+
+  for name in names:
+    model = models_eembc.build_model(name)
+    input_shape = tuple(model.input_shape[1:])
+    if( 'keras' in backend_names ):
+      add(name, 'keras', keras_runner(model), input_shape, np.float32)
+    if( 'function' in backend_names ):
+      add(name, 'function', function_runner(model), input_shape, np.float32)
+    if( 'tflite' in backend_names ):
+      run, shape, dtype = tflite_runner(tf.lite.TFLiteConverter.from_keras_model(model).convert(), threads)
+      add(name, 'tflite', run, shape, dtype)
+    if( 'tflite_int8' in backend_names ):
+      samples = random_input((100,) + input_shape, np.float32, rng)
+      tflite_model = quantize_tflite_eembc.quantize_model(model, quantize_tflite_eembc.representative_dataset(samples))
+      run, shape, dtype = tflite_runner(tflite_model, threads)
+      add(name, 'tflite_int8', run, shape, dtype)
+
+  for name, file_path in tflite_files.items():
+    with open(file_path, 'rb') as stream:
+      run, shape, dtype = tflite_runner(stream.read(), threads)
+    add(name, 'tflite_file', run, shape, dtype)
+  return results
+
+# Benchmark with every thread count, each one in a new process
+def benchmark(names, tflite_files=shipped_models, backend_names=backends, threads=(1,), batch_size=32, repeats=200, warmup=20):
+  context = multiprocessing.get_context('spawn')
+  results = []
+  for num_threads in threads:
+    with context.Pool(1) as pool:
+      results += pool.apply(benchmark_threads, (num_threads, names, tflite_files, backend_names, batch_size, repeats, warmup))
+  return results
+
+def machine_info():
+  return {'platform': platform.platform(),
+          'processor': platform.processor(),
+          'cpu_count': os.cpu_count(),
+          'python': platform.python_version(),
+          'tensorflow': tf.__version__}
+
+def write_json(results, file_path):
+  with open(file_path, 'w') as stream:
+    json.dump({'machine': machine_info(), 'results': results}, stream, indent=1)
+
+def write_csv(results, file_path):
+  fields = ['model', 'backend', 'threads', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'batch_size', 'throughput']
+  with open(file_path, 'w', newline='') as stream:
+    writer = csv.DictWriter(stream, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(results)
+
+# Compare results with a previous JSON file, a regression is a median latency
+# higher or a throughput lower by more than tolerance (fraction)
+# returns the regressed (model, backend, threads)
+def compare_results(results, file_path, tolerance=0.1):
+  with open(file_path) as stream:
+    previous = {(r['model'], r['backend'], r['threads']): r for r in json.load(stream)['results']}
+  regressions = []
+  for result in results:
+    key = (result['model'], result['backend'], result['threads'])
+    if( key not in previous ):
+      continue
+    latency_change = result['p50_ms'] / previous[key]['p50_ms'] - 1
+    regressed = latency_change > tolerance
+    line = f"{key[0]:<28}{key[1]:<14}{key[2]:>3} threads  p50 {latency_change:+7.1%}"
+    if( result['throughput'] and previous[key]['throughput'] ):
+      throughput_change = result['throughput'] / previous[key]['throughput'] - 1
+      regressed = regressed or throughput_change < -tolerance
+      line += f"  throughput {throughput_change:+7.1%}"
+    print(line + ("  REGRESSION" if regressed else ""))
+    if( regressed ):
+      regressions.append(key)
+  return regressions
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-m', '--model', type=str, nargs='*', default=list(models_eembc.models), help="model names, default all of: " + ', '.join(models_eembc.models))
+  parser.add_argument('-f', '--tflite', type=str, nargs='*', default=None, help="TFLite files to benchmark as they are, default the shipped micro_speech model")
+  parser.add_argument('--backend', type=str, nargs='+', default=backends, choices=backends, help="backends for the registered models")
+  parser.add_argument('-t', '--threads', type=int, nargs='+', default=[1], help="thread counts to sweep")
+  parser.add_argument('-b', '--batch', type=int, default=32, help="batch size for the throughput")
+  parser.add_argument('-r', '--repeats', type=int, default=200, help="timed single sample runs (batches: a tenth of it)")
+  parser.add_argument('-w', '--warmup', type=int, default=20, help="untimed runs before timing")
+  parser.add_argument('--json', type=str, default=None, help="write the results and machine info to a JSON file")
+  parser.add_argument('--csv', type=str, default=None, help="write the results to a CSV file")
+  parser.add_argument('--compare', type=str, default=None, help="previous JSON results to check for regressions")
+  parser.add_argument('--tolerance', type=float, default=0.1, help="relative change counted as a regression")
+  args = parser.parse_args()
+
+  tflite_files = shipped_models if args.tflite is None else {os.path.splitext(os.path.basename(f))[0]: f for f in args.tflite}
+  results = benchmark(args.model, tflite_files, args.backend, args.threads, args.batch, args.repeats, args.warmup)
+  if( args.json ):
+    write_json(results, args.json)
+  if( args.csv ):
+    write_csv(results, args.csv)
+  if( args.compare and compare_results(results, args.compare, args.tolerance) ):
+    raise SystemExit("Benchmark regressions")
@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 # Classifier overall accuracy calculation
 # y_pred contains the outputs of the network for the validation data
@@ -17,91 +16,149 @@ def calculate_accuracy(y_pred, labels):
 # classes are the model's classes
 def calculate_all_accuracies(y_pred, labels, classes):
   n_classes = len(classes)
+  y_pred = np.asarray(y_pred)
+  labels = np.asarray(labels)
 
-  # Initialize array of accuracies
-  accuracies = np.zeros(n_classes)
+  # One column per class, True where the sample belongs to that class
+  is_class = labels[:, np.newaxis] == np.arange(n_classes)
+  # True where the predicted label is correct
+  y_pred_label = np.argmax(y_pred, axis=1)
+  is_correct = (labels == y_pred_label)[:, np.newaxis]
+
+  # Count true positives and samples for all classes at once
+  true_positives = np.sum(is_class & is_correct, axis=0)
+  accuracies = 100 * true_positives / np.sum(is_class, axis=0)
 
-  # Loop on classes
   for class_item in range(n_classes):
-    true_positives = 0
-    # Loop on all predictions
-    for i in range(len(y_pred)):
-      # Check if it matches the class that we are working on
-      if( labels[i] == class_item ):
-        # Get prediction label
-        y_pred_label = np.argmax(y_pred[i,:])
-        # Check if the prediction is correct
-        if( labels[i] == y_pred_label ):
-          true_positives += 1
-
-    accuracies[class_item] = 100 * true_positives / np.sum(labels == class_item)
     print(f"Accuracy = {accuracies[class_item]:2.1f} ({classes[class_item]})")
     
   return accuracies
 
-# Classifier ROC AUC calculation
+# Count how many scores are strictly above each threshold
+# scores is a 1D array with the outputs for one class
+# thresholds is the array of threshold values
+# Sorting once and binary searching every threshold replaces a full pass
+# over the data per threshold
+def count_above_thresholds(scores, thresholds):
+  sorted_scores = np.sort(np.asarray(scores, dtype=np.float64).ravel())
+  return len(sorted_scores) - np.searchsorted(sorted_scores, thresholds, side='right')
+
+# Simplified ROC curve on a fixed threshold grid
+# scores are the outputs of the network for one class
+# is_positive marks the samples that belong to that class
+# thresholds is the grid, its first point is forced to (1,1)
+def simplified_roc_curve(scores, is_positive, thresholds):
+  # true positives and false positives found at all thresholds
+  true_positives = count_above_thresholds(scores[is_positive], thresholds[1:])
+  false_positives = count_above_thresholds(scores[~is_positive], thresholds[1:])
+  return simplified_roc_from_counts(true_positives, false_positives,
+                                    np.sum(is_positive), np.sum(~is_positive))
+
+# Simplified ROC curve from counts above the threshold grid
+# true_positives and false_positives are counted above every threshold
+# but the first one, which is forced to (1,1)
+# all_positives and all_negatives are the number of samples of each kind
+def simplified_roc_from_counts(true_positives, false_positives, all_positives, all_negatives):
+  # false positive rate and true positive rate, boundary condition included
+  fpr = np.ones(len(true_positives)+1)
+  tpr = np.ones(len(true_positives)+1)
+  fpr[1:] = false_positives/float(all_negatives)
+  tpr[1:] = true_positives/float(all_positives)
+
+  # calculate area under curve, trapezoid integration
+  # cumulative sum keeps the same summation order as a sequential loop
+  trapezoids = .5*(tpr[:-1]+tpr[1:])*(fpr[:-1]-fpr[1:])
+  roc_auc = np.cumsum(trapezoids)[-1]
+  return fpr, tpr, roc_auc
+
+# Sort the scores once and count true and false positives at every
+# distinct score, used as threshold (score >= threshold is positive)
+# scores are the outputs of the network for one class
+# is_positive marks the samples that belong to that class
+def exact_positive_counts(scores, is_positive):
+  order = np.argsort(scores, kind='stable')[::-1]
+  sorted_scores = scores[order]
+  # Last index of every group of equal scores
+  last = np.append(np.flatnonzero(np.diff(sorted_scores)), len(sorted_scores)-1)
+  true_positives = np.cumsum(is_positive[order])[last]
+  false_positives = last + 1 - true_positives
+  return true_positives, false_positives
+
+# Exact ROC curve, sweeping every distinct score in O(n log n)
+# scores are the outputs of the network for one class
+# is_positive marks the samples that belong to that class
+def exact_roc_curve(scores, is_positive):
+  true_positives, false_positives = exact_positive_counts(scores, is_positive)
+
+  # Curve starts at (0,0), nothing above the highest score
+  fpr = np.append(0, false_positives)/float(np.sum(~is_positive))
+  tpr = np.append(0, true_positives)/float(np.sum(is_positive))
+
+  # calculate area under curve, trapezoid integration
+  roc_auc = np.sum(.5*(tpr[1:]+tpr[:-1])*(fpr[1:]-fpr[:-1]))
+  return fpr, tpr, roc_auc
+
+# Classifier ROC curves and AUC, no printing or plotting
 # y_pred contains the outputs of the network for the validation data
 # labels are the correct answers
 # classes are the model's classes
-# name is the model's name
-def calculate_auc(y_pred, labels, classes, name):
+# mode is 'simplified' (fixed threshold grid) or 'exact' (every distinct score)
+# returns a dict with the per class curves ('fpr', 'tpr') and 'roc_auc',
+# plus 'simplified_roc_auc' to measure the divergence of the exact mode
+def compute_auc(y_pred, labels, classes, mode='simplified'):
   n_classes = len(classes)
+  y_pred = np.asarray(y_pred, dtype=np.float64)
+  labels = np.asarray(labels)
   
   # thresholds, linear range, may need improvements for better precision 
   thresholds = np.arange(0.0, 1.01, .01)
-  # false positive rate
-  fpr = np.zeros([n_classes,len(thresholds)])
-  # true positive rate
-  tpr = np.zeros([n_classes,len(thresholds)])
+  # false positive rate and true positive rate per class
+  fpr = []
+  tpr = []
   # area under curve
   roc_auc = np.zeros(n_classes)
+  simplified_roc_auc = np.zeros(n_classes)
 
-  # get number of positive and negative examples in the dataset
   for class_item in range(n_classes):
-    # Sum of all true positive answers
-    all_positives = sum(labels == class_item)
-    # Sum of all true negative answers
-    all_negatives = len(labels) - all_positives
-
-    # iterate through all thresholds and determine fraction of true positives
-    # and false positives found at this threshold
-    for threshold_item in range(1,len(thresholds)):
-      threshold = thresholds[threshold_item]
-      false_positives = 0
-      true_positives = 0
-      for i in range(len(y_pred)):
-        # Check prediction for this threshold
-        if (y_pred[i, class_item] > threshold):
-          if labels[i] == class_item:
-            true_positives += 1
-          else:
-            false_positives += 1
-      fpr[class_item,threshold_item] = false_positives/float(all_negatives)
-      tpr[class_item,threshold_item] = true_positives/float(all_positives)
-
-    # Force boundary condition
-    fpr[class_item,0] = 1
-    tpr[class_item,0] = 1
-
-    # calculate area under curve, trapezoid integration
-    for threshold_item in range(len(thresholds)-1):
-      roc_auc[class_item] += .5*(tpr[class_item,threshold_item]+tpr[class_item,threshold_item+1])*(fpr[class_item,threshold_item]-fpr[class_item,threshold_item+1]);
+    is_positive = labels == class_item
+    scores = y_pred[:,class_item]
+    fpr_class, tpr_class, simplified_roc_auc[class_item] = simplified_roc_curve(scores, is_positive, thresholds)
+    if( mode == 'exact' ):
+      fpr_class, tpr_class, roc_auc[class_item] = exact_roc_curve(scores, is_positive)
+    else:
+      roc_auc[class_item] = simplified_roc_auc[class_item]
+    fpr.append(fpr_class)
+    tpr.append(tpr_class)
+
+  return {'mode': mode, 'classes': list(classes), 'fpr': fpr, 'tpr': tpr,
+          'roc_auc': roc_auc, 'simplified_roc_auc': simplified_roc_auc}
+
+# Classifier ROC AUC calculation
+# y_pred contains the outputs of the network for the validation data
+# labels are the correct answers
+# classes are the model's classes
+# name is the model's name
+# mode is 'simplified' (fixed threshold grid) or 'exact' (every distinct score),
+# the exact mode also reports its divergence from the simplified one
+# plot=False skips the figure, matplotlib is then never imported
+def calculate_auc(y_pred, labels, classes, name, mode='simplified', plot=True):
+  result = compute_auc(y_pred, labels, classes, mode)
+  roc_auc = result['roc_auc']
+  simplified_roc_auc = result['simplified_roc_auc']
 
   # results
   roc_auc_avg = np.mean(roc_auc)
-  print(f"Simplified average roc_auc = {roc_auc_avg:.3f}")               
-
-  plt.figure()
-  for class_item in range(n_classes):
-    plt.plot(fpr[class_item,:], tpr[class_item,:], label=f"auc: {roc_auc[class_item]:0.3f} ({classes[class_item]})")
-  plt.xlim([0.0, 0.1])
-  plt.ylim([0.5, 1.0])
-  plt.legend(loc="lower right")
-  plt.xlabel('False Positive Rate')
-  plt.ylabel('True Positive Rate')
-  plt.title('ROC: '+name)
-  plt.grid(which='major')
-  plt.show(block=False)
+  if( mode == 'exact' ):
+    simplified_roc_auc_avg = np.mean(simplified_roc_auc)
+    max_divergence = np.amax(np.abs(roc_auc-simplified_roc_auc))
+    print(f"Exact average roc_auc = {roc_auc_avg:.3f}")
+    print(f"Simplified average roc_auc = {simplified_roc_auc_avg:.3f} (difference {roc_auc_avg-simplified_roc_auc_avg:.2e}, max per class {max_divergence:.2e})")
+  else:
+    print(f"Simplified average roc_auc = {roc_auc_avg:.3f}")               
+
+  if( plot ):
+    import eval_reports_eembc
+    eval_reports_eembc.show(eval_reports_eembc.plot_auc, result, name)
   
   return roc_auc
 
@@ -122,127 +179,167 @@ def calculate_ae_accuracy(y_pred, y_true):
   print(f"Overall accuracy = {accuracy:2.1f}")
   return accuracy      
 
-# Classifier overall accuracy calculation
+# Anomaly mask for autoencoder results
+# y_true are the correct answers (0.0 for normal, 1.0 for anomaly)
+# normal samples are expected first, followed by the anomalies
+def ae_anomaly_mask(y_true):
+  n_normal = np.sum(np.asarray(y_true) == 0)
+  return np.arange(len(y_true)) >= n_normal
+
+# Simplified precision and recall on a fixed threshold grid
+# scores are the outputs of the network for the validation data
+# is_anomaly marks the anomalous samples
+# thresholds is the threshold grid
+def simplified_pr_curve(scores, is_anomaly, thresholds):
+  true_positive = count_above_thresholds(scores[is_anomaly], thresholds)
+  false_positive = count_above_thresholds(scores[~is_anomaly], thresholds)
+  return pr_from_counts(true_positive, false_positive, np.sum(is_anomaly))
+
+# Precision and recall from counts above each threshold
+# true_positive and false_positive are counted above every threshold
+# n_anomaly is the number of anomalous samples
+def pr_from_counts(true_positive, false_positive, n_anomaly):
+  with np.errstate(invalid='ignore'):
+    precision = true_positive / (true_positive+false_positive)
+  recall = true_positive / n_anomaly
+  return precision, recall
+
+# Exact precision and recall, sweeping every distinct score in O(n log n)
+# scores are the outputs of the network for the validation data
+# is_anomaly marks the anomalous samples
+def exact_pr_curve(scores, is_anomaly):
+  true_positive, false_positive = exact_positive_counts(scores, is_anomaly)
+  return pr_from_counts(true_positive, false_positive, np.sum(is_anomaly))
+
+# Best precision/recall accuracy along a curve
+# thresholds without any positive prediction have no precision and are skipped
+def best_pr_accuracy(precision, recall):
+  accuracies = 100 * (precision+recall) / 2
+  accuracies = accuracies[~np.isnan(accuracies)]
+  if( len(accuracies) == 0 ):
+    return 0
+  return max(0, np.amax(accuracies))
+
+# Autoencoder precision/recall curve and accuracy, no printing or plotting
 # y_pred contains the outputs of the network for the validation data
 # y_true are the correct answers (0.0 for normal, 1.0 for anomaly)
-# this is the function that should be used for accuracy calculations
-def calculate_ae_pr_accuracy(y_pred, y_true):
+# mode is 'simplified' (fixed threshold grid) or 'exact' (every distinct score)
+# returns a dict with 'precision', 'recall' and 'accuracy',
+# plus 'simplified_accuracy' to measure the divergence of the exact mode
+def compute_ae_pr_accuracy(y_pred, y_true, mode='simplified'):
   # initialize all arrays
+  # the grid is built in the dtype of the scores, as the original EEMBC code
+  y_pred = np.asarray(y_pred).ravel()
   thresholds = np.amin(y_pred) + np.arange(0.0, 1.0, .01)*(np.amax(y_pred)-np.amin(y_pred))
-  accuracy = 0
-  n_normal = np.sum(y_true == 0)
-  precision = np.zeros(len(thresholds))
-  recall = np.zeros(len(thresholds))
-
-  # Loop on all the threshold values
-  for threshold_item in range(len(thresholds)):
-    threshold = thresholds[threshold_item]
-    # Binarize the result
-    y_pred_binary = (y_pred > threshold).astype(int)
-    # Build matrix of TP, TN, FP and FN
-    true_negative = np.sum((y_pred_binary[0:n_normal] == 0))
-    false_positive = np.sum((y_pred_binary[0:n_normal] == 1))
-    true_positive = np.sum((y_pred_binary[n_normal:] == 1))
-    false_negative = np.sum((y_pred_binary[n_normal:] == 0))
-    # Calculate and store precision and recall
-    precision[threshold_item] = true_positive / (true_positive+false_positive)
-    recall[threshold_item] = true_positive / (true_positive+false_negative)
-    # See if the accuracy has improved
-    accuracy_tmp = 100 * (precision[threshold_item]+recall[threshold_item]) / 2
-    if accuracy_tmp > accuracy:
-      accuracy = accuracy_tmp
+  is_anomaly = ae_anomaly_mask(y_true)
+
+  # Precision and recall at all the threshold values
+  precision, recall = simplified_pr_curve(y_pred, is_anomaly, thresholds)
+  accuracy = simplified_accuracy = best_pr_accuracy(precision, recall)
+  if( mode == 'exact' ):
+    precision, recall = exact_pr_curve(y_pred.astype(np.float64), is_anomaly)
+    accuracy = best_pr_accuracy(precision, recall)
+
+  return {'mode': mode, 'precision': precision, 'recall': recall,
+          'accuracy': accuracy, 'simplified_accuracy': simplified_accuracy}
+
+# Classifier overall accuracy calculation
+# y_pred contains the outputs of the network for the validation data
+# y_true are the correct answers (0.0 for normal, 1.0 for anomaly)
+# this is the function that should be used for accuracy calculations
+# mode is 'simplified' (fixed threshold grid) or 'exact' (every distinct score),
+# the exact mode also reports its divergence from the simplified one
+# plot=False skips the figure, matplotlib is then never imported
+def calculate_ae_pr_accuracy(y_pred, y_true, mode='simplified', plot=True):
+  result = compute_ae_pr_accuracy(y_pred, y_true, mode)
+  accuracy = result['accuracy']
+  simplified_accuracy = result['simplified_accuracy']
 
   # Results
-  print(f"Precision/recall accuracy = {accuracy:2.1f}")      
-
-  plt.figure()
-  plt.plot(recall, precision)
-  plt.xlim([0.0, 1.0])
-  plt.ylim([0.0, 1.0])
-  plt.xlabel('Recall')
-  plt.ylabel('Precision')
-  plt.title('Precision vs Recall')
-  plt.grid(which='major')
-  plt.show(block=False)   
+  if( mode == 'exact' ):
+    print(f"Exact precision/recall accuracy = {accuracy:2.1f}")
+    print(f"Simplified precision/recall accuracy = {simplified_accuracy:2.1f} (difference {accuracy-simplified_accuracy:.2e})")
+  else:
+    print(f"Precision/recall accuracy = {accuracy:2.1f}")      
+
+  if( plot ):
+    import eval_reports_eembc
+    eval_reports_eembc.show(eval_reports_eembc.plot_ae_pr, result)
 
   return accuracy 
 
-# Autoencoder ROC AUC calculation
+# Autoencoder ROC curve and AUC, no printing or plotting
 # y_pred contains the outputs of the network for the validation data
 # y_true are the correct answers (0.0 for normal, 1.0 for anomaly)
-# name is the model's name
-def calculate_ae_auc(y_pred, y_true, name):
+# mode is 'simplified' (fixed threshold grid) or 'exact' (every distinct score)
+# returns a dict with 'fpr', 'tpr' and 'roc_auc',
+# plus 'simplified_roc_auc' to measure the divergence of the exact mode
+def compute_ae_auc(y_pred, y_true, mode='simplified'):
   # initialize all arrays
+  # the grid is built in the dtype of the scores, as the original EEMBC code
+  y_pred = np.asarray(y_pred).ravel()
   thresholds = np.amin(y_pred) + np.arange(0.0, 1.01, .01)*(np.amax(y_pred)-np.amin(y_pred))
-  roc_auc = 0
+  is_anomaly = ae_anomaly_mask(y_true)
 
-  n_normal = np.sum(y_true == 0)
-  tpr = np.zeros(len(thresholds))
-  fpr = np.zeros(len(thresholds))
-
-  # Loop on all the threshold values
-  for threshold_item in range(1,len(thresholds)):
-    threshold = thresholds[threshold_item]
-    # Binarize the result
-    y_pred_binary = (y_pred > threshold).astype(int)
-    # Build TP and FP
-    tpr[threshold_item] = np.sum((y_pred_binary[n_normal:] == 1))/float(len(y_true)-n_normal)
-    fpr[threshold_item] = np.sum((y_pred_binary[0:n_normal] == 1))/float(n_normal)
+  # Rates at all the threshold values and integration
+  fpr, tpr, roc_auc = simplified_roc_curve(y_pred, is_anomaly, thresholds)
+  simplified_roc_auc = roc_auc
+  if( mode == 'exact' ):
+    fpr, tpr, roc_auc = exact_roc_curve(y_pred.astype(np.float64), is_anomaly)
 
-  # Force boundary condition
-  fpr[0] = 1
-  tpr[0] = 1
+  return {'mode': mode, 'fpr': fpr, 'tpr': tpr,
+          'roc_auc': roc_auc, 'simplified_roc_auc': simplified_roc_auc}
 
-  # Integrate
-  for threshold_item in range(len(thresholds)-1):
-    roc_auc += .5*(tpr[threshold_item]+tpr[threshold_item+1])*(fpr[threshold_item]-fpr[threshold_item+1]);
+# Autoencoder ROC AUC calculation
+# y_pred contains the outputs of the network for the validation data
+# y_true are the correct answers (0.0 for normal, 1.0 for anomaly)
+# name is the model's name
+# mode is 'simplified' (fixed threshold grid) or 'exact' (every distinct score),
+# the exact mode also reports its divergence from the simplified one
+# plot=False skips the figure, matplotlib is then never imported
+def calculate_ae_auc(y_pred, y_true, name, mode='simplified', plot=True):
+  result = compute_ae_auc(y_pred, y_true, mode)
+  roc_auc = result['roc_auc']
+  simplified_roc_auc = result['simplified_roc_auc']
 
   # Results
-  print(f"Simplified roc_auc = {roc_auc:.3f}")               
-
-  plt.figure()
-  plt.plot(tpr, fpr, label=f"auc: {roc_auc:0.3f}")
-  plt.xlim([0.0, 1.0])
-  plt.ylim([0.0, 1.0])
-  plt.legend(loc="lower right")
-  plt.xlabel('False positive rate')
-  plt.ylabel('True positive rate')
-  plt.title('ROC: '+name)
-  plt.grid(which='major')
-  plt.show(block=False)   
+  if( mode == 'exact' ):
+    print(f"Exact roc_auc = {roc_auc:.3f}")
+    print(f"Simplified roc_auc = {simplified_roc_auc:.3f} (difference {roc_auc-simplified_roc_auc:.2e})")
+  else:
+    print(f"Simplified roc_auc = {roc_auc:.3f}")               
+
+  if( plot ):
+    import eval_reports_eembc
+    eval_reports_eembc.show(eval_reports_eembc.plot_ae_auc, result, name)
 
   return roc_auc
 
+# Confusion matrix calculation, no plotting
+# y_pred contains the outputs of the network for the validation data
+# y_true are the correct answers
+# rows are the actual class and columns the predicted one, for every label
+# found in y_true or in the predictions (same as sklearn's confusion_matrix)
+def compute_cm(y_pred, y_true):
+  y_true = np.asarray(y_true).ravel()
+  y_pred_label = np.argmax(y_pred, axis=1)
+  present = np.union1d(y_true, y_pred_label)
+  n_labels = len(present)
+  # Histogram of (actual, predicted) pairs in one pass
+  pairs = np.searchsorted(present, y_true)*n_labels + np.searchsorted(present, y_pred_label)
+  return np.bincount(pairs, minlength=n_labels**2).reshape(n_labels, n_labels)
+
 # Confusion matrix calculation and display
 # y_pred contains the outputs of the network for the validation data
 # y_true are the correct answers (0.0 for normal, 1.0 for anomaly)
 # classes are the class names to be displayed in CM
 # name is the model's name
-from sklearn.metrics import confusion_matrix
-
-def calculate_cm(y_pred, y_true, classes, name):
-  cm = confusion_matrix(y_true, np.argmax(y_pred,axis=1))
-  fig, ax = plt.subplots(figsize=(6,6))
-  im = ax.imshow(cm)
-
-  # We want to show all ticks
-  ax.set_xticks(np.arange(len(classes)))
-  ax.set_yticks(np.arange(len(classes)))
-  # ... and label them with the respective list entries
-  ax.set_xticklabels(classes)
-  ax.set_yticklabels(classes)
-
-  # Rotate the tick labels and set their alignment.
-  plt.setp(ax.get_xticklabels(), rotation=45, ha="right",
-              rotation_mode="anchor")
-
-  # Loop over data dimensions and create text annotations.
-  for i in range(len(classes)):
-      for j in range(len(classes)):
-          text = ax.text(j, i, cm[i, j],
-                          ha="center", va="center", color="w", backgroundcolor=(0.41, 0.41, 0.41, 0.25))
-
-  ax.set_ylabel('Actual class')
-  ax.set_xlabel('Predicted class')
-  plt.title('Confusion Matrix: ' + name)
-  plt.show(block=False)
+# plot=False skips the figure, matplotlib is then never imported
+def calculate_cm(y_pred, y_true, classes, name, plot=True):
+  cm = compute_cm(y_pred, y_true)
+
+  if( plot ):
+    import eval_reports_eembc
+    eval_reports_eembc.show(eval_reports_eembc.plot_cm, cm, classes, name)
+
+  return cm
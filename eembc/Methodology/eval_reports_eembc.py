@@ -0,0 +1,146 @@
+import os
+import html
+
+import numpy as np
+from matplotlib.figure import Figure
+
+# Rendering of the results from eval_functions_eembc.py
+# The metric functions only compute, this module is imported when a figure
+# is actually needed, either shown interactively (show) or written to disk
+# for many models at once (write_reports), e.g.
+#   results = {'resnet': {'auc': compute_auc(y_pred, labels, classes),
+#                         'cm': {'cm': compute_cm(y_pred, labels), 'classes': classes}}}
+#   write_reports(results, 'reports', formats=['png', 'svg'])
+
+# Classifier ROC curves, result comes from compute_auc
+def plot_auc(fig, result, name):
+  ax = fig.add_subplot()
+  for class_item, class_name in enumerate(result['classes']):
+    ax.plot(result['fpr'][class_item], result['tpr'][class_item],
+            label=f"auc: {result['roc_auc'][class_item]:0.3f} ({class_name})")
+  ax.set_xlim([0.0, 0.1])
+  ax.set_ylim([0.5, 1.0])
+  ax.legend(loc="lower right")
+  ax.set_xlabel('False Positive Rate')
+  ax.set_ylabel('True Positive Rate')
+  ax.set_title('ROC: '+name)
+  ax.grid(which='major')
+
+# Autoencoder precision vs recall curve, result comes from compute_ae_pr_accuracy
+def plot_ae_pr(fig, result, name=''):
+  ax = fig.add_subplot()
+  ax.plot(result['recall'], result['precision'])
+  ax.set_xlim([0.0, 1.0])
+  ax.set_ylim([0.0, 1.0])
+  ax.set_xlabel('Recall')
+  ax.set_ylabel('Precision')
+  ax.set_title('Precision vs Recall' + (': '+name if name else ''))
+  ax.grid(which='major')
+
+# Autoencoder ROC curve, result comes from compute_ae_auc
+def plot_ae_auc(fig, result, name):
+  ax = fig.add_subplot()
+  ax.plot(result['fpr'], result['tpr'], label=f"auc: {result['roc_auc']:0.3f}")
+  ax.set_xlim([0.0, 1.0])
+  ax.set_ylim([0.0, 1.0])
+  ax.legend(loc="lower right")
+  ax.set_xlabel('False positive rate')
+  ax.set_ylabel('True positive rate')
+  ax.set_title('ROC: '+name)
+  ax.grid(which='major')
+
+# Confusion matrix, cm comes from compute_cm
+def plot_cm(fig, cm, classes, name):
+  fig.set_size_inches(6, 6)
+  ax = fig.add_subplot()
+  ax.imshow(cm)
+
+  # We want to show all ticks
+  ax.set_xticks(np.arange(len(classes)))
+  ax.set_yticks(np.arange(len(classes)))
+  # ... and label them with the respective list entries
+  ax.set_xticklabels(classes)
+  ax.set_yticklabels(classes)
+
+  # Rotate the tick labels and set their alignment.
+  for label in ax.get_xticklabels():
+    label.set(rotation=45, ha="right", rotation_mode="anchor")
+
+  # Loop over data dimensions and create text annotations.
+  for i in range(len(classes)):
+    for j in range(len(classes)):
+      ax.text(j, i, cm[i, j],
+              ha="center", va="center", color="w", backgroundcolor=(0.41, 0.41, 0.41, 0.25))
+
+  ax.set_ylabel('Actual class')
+  ax.set_xlabel('Predicted class')
+  ax.set_title('Confusion Matrix: ' + name)
+
+# Draw one of the plot functions above in a new pyplot window
+def show(plot_function, *args):
+  import matplotlib.pyplot as plt
+  fig = plt.figure()
+  plot_function(fig, *args)
+  plt.show(block=False)
+  return fig
+
+# Draw a result of the given kind on a figure that is not managed by pyplot,
+# so it is released as soon as it has been written
+# kind is one of 'auc', 'ae_pr', 'ae_auc' or 'cm'
+def render(kind, result, name):
+  fig = Figure()
+  if( kind == 'auc' ):
+    plot_auc(fig, result, name)
+  elif( kind == 'ae_pr' ):
+    plot_ae_pr(fig, result, name)
+  elif( kind == 'ae_auc' ):
+    plot_ae_auc(fig, result, name)
+  elif( kind == 'cm' ):
+    plot_cm(fig, result['cm'], result['classes'], name)
+  else:
+    raise ValueError(f'Unknown result kind: {kind}')
+  return fig
+
+# One line summary of a result for the HTML report
+def summarize(kind, result):
+  if( kind == 'auc' ):
+    return f"{result['mode']} average roc_auc = {np.mean(result['roc_auc']):.3f}"
+  if( kind == 'ae_pr' ):
+    return f"{result['mode']} precision/recall accuracy = {result['accuracy']:2.1f}"
+  if( kind == 'ae_auc' ):
+    return f"{result['mode']} roc_auc = {result['roc_auc']:.3f}"
+  cm = np.asarray(result['cm'])
+  return f"accuracy = {100*np.trace(cm)/np.sum(cm):2.1f}"
+
+# Write figures for many models at once
+# results maps a model name to a dict of {kind: result}, see render for the kinds
+# output_dir receives <model>_<kind>.<format> for every format in formats
+# ('png', 'svg', ...), and index.html with all scores and figures if html_report is set
+# returns the list of written files
+def write_reports(results, output_dir, formats=('png',), html_report=True):
+  os.makedirs(output_dir, exist_ok=True)
+  written = []
+  sections = []
+  for model_name, model_results in results.items():
+    rows = []
+    for kind, result in model_results.items():
+      fig = render(kind, result, model_name)
+      file_names = []
+      for file_format in formats:
+        file_name = f'{model_name}_{kind}.{file_format}'
+        fig.savefig(os.path.join(output_dir, file_name), format=file_format, bbox_inches='tight')
+        file_names.append(file_name)
+        written.append(os.path.join(output_dir, file_name))
+      image = f'<img src="{html.escape(file_names[0])}">' if file_names else ''
+      rows.append(f'<tr><td>{html.escape(kind)}</td><td>{html.escape(summarize(kind, result))}</td><td>{image}</td></tr>')
+    sections.append(f'<h2>{html.escape(model_name)}</h2>\n<table>\n' + '\n'.join(rows) + '\n</table>')
+
+  if( html_report ):
+    index_file = os.path.join(output_dir, 'index.html')
+    with open(index_file, 'w') as stream:
+      stream.write('<html><head><title>EEMBC evaluation</title></head><body>\n')
+      stream.write('\n'.join(sections))
+      stream.write('\n</body></html>\n')
+    written.append(index_file)
+
+  return written
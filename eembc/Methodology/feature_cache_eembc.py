@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import functools
+import multiprocessing
+import numpy as np
+
+import audio_frontend_eembc
+
+# Feature cache of the Speech Commands clips for training the keyword spotting
+# models: the features of every clip are computed once (audio_frontend_eembc.py)
+# into <cache_dir>/<frontend>_<hash>, the hash covering the frontend config and
+# the storage dtype, so a cache is reused until the frontend changes:
+#   features.npy: [clips, frames, channels] as float16, or as int8 quantized like
+#                 the TFLite Micro feature generator of micro_speech (the int8
+#                 model input: (frontend output * 256 + 333) / 666 - 128)
+#   labels.npy: word of every clip, index into 'words' of meta.json
+#   splits.npy: 0 training, 1 validation, 2 testing (validation_list.txt and
+#               testing_list.txt of the dataset)
+#   noise.npy: features of the 1s segments of the _background_noise_ clips
+#   meta.json: hash, frontend config, dtype, words and clip files, written last
+#              (a cache without it is incomplete and built again)
+# The arrays are opened memory-mapped, batches read only their rows.
+# Augmentation works on the cached features:
+#   time shift: frames shifted by up to time_shift_frames, silence (0) shifted in
+#   background noise: mixed with a noise segment at a random volume, adding the
+#               energies the log features stand for (the noise reduction and
+#               gain control of the frontend make it an approximation)
+# Example, the int8 cache of the micro_speech features:
+#   python feature_cache_eembc.py --data speech_commands_v0.02 --cache kws_cache --frontend micro_speech_eembc --dtype int8
+
+# Words of the models, the other words are '_unknown_' and noise only clips '_silence_'
+model_words = {'micro_speech_eembc': ['yes', 'no'],
+               'dsconv_arm_eembc': ['yes', 'no', 'up', 'down', 'left', 'right', 'on', 'off', 'stop', 'go']}
+background_noise_dir = '_background_noise_'
+splits = {'training': 0, 'validation': 1, 'testing': 2}
+dtypes = ['float16', 'int8']
+cache_version = 1
+
+def cache_key(config, dtype):
+  description = json.dumps({'frontend': config, 'dtype': dtype, 'version': cache_version}, sort_keys=True)
+  return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+# Clip files (relative to data_dir), word names, word index and split of every clip
+def scan_dataset(data_dir):
+  words = sorted(entry for entry in os.listdir(data_dir)
+                 if os.path.isdir(os.path.join(data_dir, entry)) and not entry.startswith('_'))
+  files = []
+  labels = []
+  for index, word in enumerate(words):
+    names = sorted(name for name in os.listdir(os.path.join(data_dir, word)) if name.endswith('.wav'))
+    files += [word + '/' + name for name in names]
+    labels += [index] * len(names)
+
+  clip_splits = np.full(len(files), splits['training'], dtype=np.int8)
+  positions = {name: position for position, name in enumerate(files)}
+  for split in ['validation', 'testing']:
+    list_file = os.path.join(data_dir, split + '_list.txt')
+    if( os.path.exists(list_file) ):
+      with open(list_file) as stream:
+        listed = [positions[line.strip()] for line in stream if line.strip() in positions]
+      clip_splits[listed] = splits[split]
+  return files, words, np.array(labels, dtype=np.int16), clip_splits
+
+# Stored features of uint16 frontend output
+def encode(frontend_output, config, dtype):
+  if( dtype == 'int8' ):
+    return np.clip((frontend_output.astype(np.int32) * 256 + 333) // 666 - 128, -128, 127).astype(np.int8)
+  return (frontend_output.astype(np.float32) * np.float32(config['output_scale'])).astype(np.float16)
+
+# Model input features [clips, frames, channels, 1] of stored features
+def decode(features, config, dtype):
+  if( dtype == 'int8' ):
+    features = (features.astype(np.float32) + 128) * np.float32(666 / 256 * config['output_scale'])
+  return features.astype(np.float32)[..., np.newaxis]
+
+def frontend_of_files(file_names, config):
+  return audio_frontend_eembc.frontend(np.stack([audio_frontend_eembc.read_wav(f, config['clip_samples']) for f in file_names]), config)
+
+# Frontend output of the 1s segments of the background noise clips
+def noise_segments(data_dir, config):
+  noise_dir = os.path.join(data_dir, background_noise_dir)
+  if( not os.path.isdir(noise_dir) ):
+    return None
+  segments = []
+  for name in sorted(os.listdir(noise_dir)):
+    if( name.endswith('.wav') ):
+      audio = audio_frontend_eembc.read_wav(os.path.join(noise_dir, name), None)
+      count = len(audio) // config['clip_samples']
+      segments.append(audio[:count * config['clip_samples']].reshape(count, config['clip_samples']))
+  return audio_frontend_eembc.frontend(np.concatenate(segments), config) if segments else None
+
+# Build the cache of the dataset for a frontend (name or config) unless it
+# exists, returns its directory
+def build_cache(data_dir, cache_dir, frontend='micro_speech_eembc', dtype='float16', num_workers=os.cpu_count(), chunk_size=256):
+  config = audio_frontend_eembc.frontend_config(frontend)
+  key = cache_key(config, dtype)
+  path = os.path.join(cache_dir, '%s_%s' % (frontend if isinstance(frontend, str) else 'frontend', key))
+  meta_file = os.path.join(path, 'meta.json')
+  if( os.path.exists(meta_file) ):
+    with open(meta_file) as stream:
+      if( json.load(stream)['hash'] == key ):
+        print(f"Using the feature cache {path}")
+        return path
+
+  start = time.time()
+  os.makedirs(path, exist_ok=True)
+  files, words, labels, clip_splits = scan_dataset(data_dir)
+  size, step = audio_frontend_eembc.window_samples(config)
+  num_frames = config['num_frames'] or 1 + (config['clip_samples'] - size) // step
+  features = np.lib.format.open_memmap(os.path.join(path, 'features.npy'), mode='w+', dtype=dtype,
+                                       shape=(len(files), num_frames, config['num_channels']))
+
+  # chunks of clips computed by the workers, written in order
+  chunks = [[os.path.join(data_dir, f) for f in files[first:first+chunk_size]] for first in range(0, len(files), chunk_size)]
+  with multiprocessing.Pool(num_workers) as pool:
+    position = 0
+    for output in pool.imap(functools.partial(frontend_of_files, config=config), chunks):
+      features[position:position+len(output)] = encode(output, config, dtype)
+      position += len(output)
+      print(f"\r{position}/{len(files)} clips", end='', flush=True)
+  print()
+  features.flush()
+  del features
+
+  np.save(os.path.join(path, 'labels.npy'), labels)
+  np.save(os.path.join(path, 'splits.npy'), clip_splits)
+  noise = noise_segments(data_dir, config)
+  if( noise is not None ):
+    np.save(os.path.join(path, 'noise.npy'), encode(noise, config, dtype))
+  meta = {'hash': key, 'frontend': config, 'dtype': dtype, 'words': words, 'files': files}
+  with open(meta_file + '.tmp', 'w') as stream:
+    json.dump(meta, stream)
+  os.replace(meta_file + '.tmp', meta_file)
+  print(f"Feature cache {path}: {len(files)} clips in {time.time() - start:.0f} s")
+  return path
+
+# Frames of every clip shifted by a random number of frames in [-max_frames, max_frames]
+def time_shift(features, max_frames, rng):
+  num_frames = features.shape[1]
+  shifts = rng.integers(-max_frames, max_frames, len(features), endpoint=True)
+  source = np.arange(num_frames)[np.newaxis, :] - shifts[:, np.newaxis]
+  valid = (source >= 0) & (source < num_frames)
+  shifted = np.take_along_axis(features, np.clip(source, 0, num_frames - 1)[..., np.newaxis, np.newaxis], axis=1)
+  return np.where(valid[..., np.newaxis, np.newaxis], shifted, 0).astype(features.dtype)
+
+# Features of the clips mixed with noise at volumes (amplitude factors): the
+# log features are 2^scale_shift*output_scale*ln(amplitude), the energies add up
+def mix_noise(features, noise, volumes, config):
+  log_scale = 2 ** config['scale_shift'] * config['output_scale'] / 2
+  with np.errstate(divide='ignore'):
+    mixed = log_scale * np.logaddexp(features / log_scale, noise / log_scale + 2 * np.log(volumes)[:, np.newaxis, np.newaxis, np.newaxis])
+  return np.maximum(mixed, 0).astype(features.dtype)
+
+class FeatureCache:
+  # path of a cache built by build_cache, words the model classes besides
+  # silence and unknown (default of the frontend name)
+  def __init__(self, path, words=None):
+    self.path = path
+    with open(os.path.join(path, 'meta.json')) as stream:
+      self.meta = json.load(stream)
+    self.config = self.meta['frontend']
+    self.dtype = self.meta['dtype']
+    self.features = np.load(os.path.join(path, 'features.npy'), mmap_mode='r')
+    self.labels = np.load(os.path.join(path, 'labels.npy'))
+    self.splits = np.load(os.path.join(path, 'splits.npy'))
+    noise_file = os.path.join(path, 'noise.npy')
+    self.noise = decode(np.load(noise_file), self.config, self.dtype) if os.path.exists(noise_file) else None
+
+    if( words is None ):
+      words = model_words[os.path.basename(os.path.normpath(path)).rsplit('_', 1)[0]]
+    self.class_names = ['_silence_', '_unknown_'] + list(words)
+    # class of every word of the dataset
+    self.word_classes = np.array([self.class_names.index(word) if word in words else 1 for word in self.meta['words']])
+
+  # Cached clip indices and classes of a split: all the clips of the model
+  # words, unknown_percentage (of them) other clips and silence_percentage
+  # silent clips (index -1)
+  def sample(self, split, rng, silence_percentage=10.0, unknown_percentage=10.0):
+    in_split = np.flatnonzero(self.splits == splits[split])
+    classes = self.word_classes[self.labels[in_split]]
+    known = in_split[classes > 1]
+    unknown = in_split[classes == 1]
+    num_unknown = min(len(unknown), int(np.ceil(len(known) * unknown_percentage / 100)))
+    num_silence = int(np.ceil(len(known) * silence_percentage / 100))
+    indices = np.concatenate([known, rng.choice(unknown, num_unknown, replace=False), np.full(num_silence, -1)])
+    classes = np.concatenate([self.word_classes[self.labels[indices[:len(indices) - num_silence]]], np.zeros(num_silence, dtype=int)])
+    return indices, classes
+
+  # Model input features of cached clips (index -1 is silence)
+  def read(self, indices):
+    order = np.argsort(indices)
+    rows = indices[order]
+    silence = encode(np.zeros((), dtype=np.uint16), self.config, self.dtype)
+    features = np.full((len(indices),) + self.features.shape[1:], silence, dtype=self.features.dtype)
+    clips = rows >= 0
+    features[order[clips]] = self.features[rows[clips]]
+    return decode(features, self.config, self.dtype)
+
+  # Augmented batches (features, classes) of a split, one epoch
+  # Every clip is mixed with a background noise segment with probability
+  # noise_probability at a volume up to noise_volume, silence always is
+  def batches(self, split, batch_size=100, shuffle=True, seed=None, silence_percentage=10.0, unknown_percentage=10.0,
+              time_shift_frames=0, noise_probability=0.0, noise_volume=0.1):
+    rng = np.random.default_rng(seed)
+    indices, classes = self.sample(split, rng, silence_percentage, unknown_percentage)
+    if( shuffle ):
+      order = rng.permutation(len(indices))
+      indices, classes = indices[order], classes[order]
+    for start in range(0, len(indices), batch_size):
+      batch = indices[start:start+batch_size]
+      features = self.read(batch)
+      if( time_shift_frames ):
+        features = time_shift(features, time_shift_frames, rng)
+      if( self.noise is not None and (noise_probability > 0 or np.any(batch < 0)) ):
+        noisy = (rng.random(len(batch)) < noise_probability) | (batch < 0)
+        if( np.any(noisy) ):
+          volumes = rng.uniform(0, noise_volume, np.sum(noisy))
+          noise = self.noise[rng.integers(0, len(self.noise), np.sum(noisy))]
+          features[noisy] = mix_noise(features[noisy], noise, volumes, self.config)
+      yield features, classes[start:start+batch_size]
+
+  # tf.data dataset of the batches of a split, every iteration is an epoch
+  # (with new random choices unless seed is given)
+  def dataset(self, split, batch_size=100, **kwargs):
+    import tensorflow as tf
+    shape = (None,) + self.features.shape[1:] + (1,)
+    return tf.data.Dataset.from_generator(
+      lambda: self.batches(split, batch_size, **kwargs),
+      output_signature=(tf.TensorSpec(shape, tf.float32), tf.TensorSpec((None,), tf.int64))).prefetch(2)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-d', '--data', type=str, required=True, help="Speech Commands directory (one directory of wav files per word)")
+  parser.add_argument('-c', '--cache', type=str, default='kws_cache', help="cache directory")
+  parser.add_argument('-f', '--frontend', type=str, nargs='+', default=list(model_words), help="frontend configurations, default all of: " + ', '.join(model_words))
+  parser.add_argument('--dtype', type=str, default='float16', choices=dtypes, help="storage type of the features")
+  parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help="worker processes computing features")
+  args = parser.parse_args()
+
+  for frontend in args.frontend:
+    cache = FeatureCache(build_cache(args.data, args.cache, frontend, args.dtype, args.workers))
+    for split in splits:
+      indices, classes = cache.sample(split, np.random.default_rng(0))
+      print(f"{frontend} {split}: {len(indices)} examples, " + ', '.join(f"{name} {np.sum(classes == c)}" for c, name in enumerate(cache.class_names)))
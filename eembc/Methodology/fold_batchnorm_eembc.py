@@ -0,0 +1,189 @@
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+import models_eembc
+
+# BatchNormalization folding for the inference graphs of the EEMBC models
+# Every BatchNormalization directly after a Conv2D, DepthwiseConv2D or Dense
+# layer (without activation) is merged into the kernel and bias of that layer:
+#   scale = gamma / sqrt(moving_variance + epsilon)
+#   kernel' = kernel * scale (per output channel)
+#   bias' = (bias - moving_mean) * scale + beta
+# The folded model computes the same outputs in inference mode with one layer
+# and one elementwise pass less per BatchNormalization
+# Example, comparing outputs and latency of a trained model and its folded copy:
+#   python fold_batchnorm_eembc.py --model mobilenet_v1_eembc --weights trained_models/vww_96.h5
+
+foldable_layers = (tf.keras.layers.Conv2D, tf.keras.layers.DepthwiseConv2D, tf.keras.layers.Dense)
+
+# Per channel scale and offset of an inference mode BatchNormalization
+def batchnorm_scale_offset(layer):
+  mean, variance = [np.asarray(w, dtype=np.float64) for w in (layer.moving_mean, layer.moving_variance)]
+  gamma = np.ones_like(mean) if layer.gamma is None else np.asarray(layer.gamma, dtype=np.float64)
+  beta = np.zeros_like(mean) if layer.beta is None else np.asarray(layer.beta, dtype=np.float64)
+  scale = gamma / np.sqrt(variance + layer.epsilon)
+  return scale, beta - mean*scale
+
+# Folded kernel and bias of a Conv2D, DepthwiseConv2D or Dense layer followed by
+# a BatchNormalization layer
+def fold_weights(layer, batchnorm):
+  scale, offset = batchnorm_scale_offset(batchnorm)
+  weights = [np.asarray(w, dtype=np.float64) for w in layer.get_weights()]
+  kernel = weights[0]
+  bias = weights[1] if layer.use_bias else np.zeros_like(scale)
+  if( isinstance(layer, tf.keras.layers.DepthwiseConv2D) ):
+    # kernel [kh, kw, channels, multiplier], output channel c*multiplier+m
+    kernel = kernel * scale.reshape(kernel.shape[-2:])
+  else:
+    # kernel [..., outputs]
+    kernel = kernel * scale
+  return [kernel.astype(np.float32), (bias*scale + offset).astype(np.float32)]
+
+# Can a BatchNormalization layer be folded into the layer producing its input?
+# consumers counts the layers using every tensor of the model
+def can_fold(layer, consumers, outputs):
+  if( not isinstance(layer, tf.keras.layers.BatchNormalization) ):
+    return False
+  if( len(layer.inbound_nodes) != 1 ):
+    return False
+  producer = layer.inbound_nodes[0].inbound_layers
+  if( not isinstance(producer, foldable_layers) or len(producer.inbound_nodes) != 1 ):
+    return False
+  if( producer.get_config().get('activation', 'linear') != 'linear' ):
+    return False
+  # normalization over the channels (last axis), input used by the BatchNormalization only
+  axis = [a % len(layer.input_shape) for a in np.atleast_1d(layer.axis)]
+  if( axis != [len(layer.input_shape) - 1] ):
+    return False
+  return consumers[id(layer.input)] == 1 and id(layer.input) not in outputs
+
+# New layer of the same type and config, with a bias if it gets folded weights
+def copy_layer(layer, use_bias=False):
+  config = layer.get_config()
+  if( use_bias ):
+    config['use_bias'] = True
+  return layer.__class__.from_config(config)
+
+# Equivalent model with every foldable BatchNormalization merged into the
+# preceding Conv2D / DepthwiseConv2D / Dense layer
+# Works on functional and Sequential models where every layer is called once
+def fold_batchnorm(model):
+  layers = model.layers
+  outputs = set(id(tensor) for tensor in model.outputs)
+  consumers = {}
+  for layer in layers:
+    for tensor in tf.nest.flatten(layer.input):
+      consumers[id(tensor)] = consumers.get(id(tensor), 0) + 1
+  # BatchNormalization layer folded into every producer
+  folded = {id(layer.inbound_nodes[0].inbound_layers): layer for layer in layers if can_fold(layer, consumers, outputs)}
+
+  # Rebuild the graph, mapping every tensor of the model to its new tensor
+  inputs = [tf.keras.Input(batch_shape=tensor.shape, dtype=tensor.dtype) for tensor in model.inputs]
+  tensors = {id(old): new for old, new in zip(model.inputs, inputs)}
+  weights = []
+  for layer in layers:
+    if( isinstance(layer, tf.keras.layers.InputLayer) ):
+      continue
+    if( isinstance(layer, tf.keras.layers.BatchNormalization) and folded.get(id(layer.inbound_nodes[0].inbound_layers)) is layer ):
+      # the producer already computes the normalized output
+      tensors[id(layer.output)] = tensors[id(layer.input)]
+      continue
+    new_layer = copy_layer(layer, use_bias=id(layer) in folded)
+    tensors[id(layer.output)] = new_layer(tf.nest.map_structure(lambda tensor: tensors[id(tensor)], layer.input))
+    if( id(layer) in folded ):
+      weights.append((new_layer, fold_weights(layer, folded[id(layer)])))
+    else:
+      weights.append((new_layer, layer.get_weights()))
+
+  folded_model = tf.keras.Model(inputs, [tensors[id(tensor)] for tensor in model.outputs], name=model.name + '_folded')
+  for new_layer, layer_weights in weights:
+    new_layer.set_weights(layer_weights)
+  return folded_model
+
+# Random BatchNormalization statistics and affine parameters, so that folding
+# an untrained model is not trivially exact (moving mean 0 and variance 1)
+def randomize_batchnorm(model, seed=0):
+  rng = np.random.default_rng(seed)
+  for layer in model.layers:
+    if( isinstance(layer, tf.keras.layers.BatchNormalization) ):
+      shape = layer.moving_mean.shape
+      layer.moving_mean.assign(rng.normal(0, 0.5, shape))
+      layer.moving_variance.assign(rng.uniform(0.5, 2.0, shape))
+      if( layer.gamma is not None ):
+        layer.gamma.assign(rng.uniform(0.5, 1.5, shape))
+      if( layer.beta is not None ):
+        layer.beta.assign(rng.normal(0, 0.5, shape))
+
+# Largest absolute and relative difference between the outputs of two models
+def compare_outputs(model, folded_model, samples):
+  y = np.asarray(model(samples, training=False), dtype=np.float64)
+  y_folded = np.asarray(folded_model(samples, training=False), dtype=np.float64)
+  max_error = float(np.max(np.abs(y - y_folded)))
+  return max_error, max_error / max(float(np.max(np.abs(y))), 1e-12)
+
+# Median latency in milliseconds of one inference of a batch, after warmup
+def measure_latency(model, samples, repeats=100, warmup=10):
+  predict = tf.function(lambda x: model(x, training=False))
+  samples = tf.constant(samples)
+  for _ in range(warmup):
+    predict(samples)
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    np.asarray(predict(samples))
+    times.append(time.perf_counter() - start)
+  return 1000 * float(np.median(times))
+
+def count_layers(model, layer_type):
+  return sum(1 for layer in model.layers if isinstance(layer, layer_type))
+
+# Fold a model and report the numerical difference, parameters and latency
+def compare_models(model, samples, batch_sizes=(1, 32), repeats=100, tolerance=1e-4, name=None):
+  folded_model = fold_batchnorm(model)
+  max_error, relative_error = compare_outputs(model, folded_model, samples)
+  report = {'max_abs_error': max_error,
+            'max_rel_error': relative_error,
+            'equivalent': relative_error <= tolerance,
+            'params': model.count_params(),
+            'folded_params': folded_model.count_params(),
+            'batchnorm_layers': count_layers(model, tf.keras.layers.BatchNormalization),
+            'folded_batchnorm_layers': count_layers(folded_model, tf.keras.layers.BatchNormalization)}
+  print(f"{name or model.name}: max abs output difference = {max_error:.3g} (relative {relative_error:.3g}), {'equivalent' if report['equivalent'] else 'NOT equivalent'}")
+  print(f"BatchNormalization layers {report['batchnorm_layers']} -> {report['folded_batchnorm_layers']}, parameters {report['params']} -> {report['folded_params']}")
+  for batch_size in batch_sizes:
+    batch = np.resize(samples, (batch_size,) + samples.shape[1:]).astype(np.float32)
+    latency = measure_latency(model, batch, repeats)
+    folded_latency = measure_latency(folded_model, batch, repeats)
+    report[f'latency_ms_batch{batch_size}'] = (latency, folded_latency)
+    print(f"Batch {batch_size}: {latency:.3f} ms -> {folded_latency:.3f} ms ({latency/folded_latency:.2f}x)")
+  return folded_model, report
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-m', '--model', type=str, nargs='+', default=list(models_eembc.models), help="model names, default all of: " + ', '.join(models_eembc.models))
+  parser.add_argument('-w', '--weights', type=str, default=None, help="trained weights (.h5), random BatchNormalization statistics are used without")
+  parser.add_argument('-d', '--data', type=str, default=None, help="model inputs for the comparison (.npy), random inputs without")
+  parser.add_argument('-o', '--output', type=str, default=None, help="save the folded model (.h5), with a single model only")
+  parser.add_argument('-n', '--samples', type=int, default=64, help="number of samples for the comparison")
+  parser.add_argument('-r', '--repeats', type=int, default=100, help="number of timed inferences per batch size")
+  parser.add_argument('-b', '--batch', type=int, nargs='+', default=[1, 32], help="batch sizes for the latency comparison")
+  args = parser.parse_args()
+
+  failed = []
+  for name in args.model:
+    model = models_eembc.build_model(name, args.weights)
+    if( args.weights is None ):
+      randomize_batchnorm(model)
+    if( args.data ):
+      samples = np.asarray(np.load(args.data, mmap_mode='r')[:args.samples], dtype=np.float32)
+    else:
+      samples = np.random.default_rng(0).uniform(0, 1, (args.samples,) + tuple(model.input_shape[1:])).astype(np.float32)
+    folded_model, report = compare_models(model, samples, args.batch, args.repeats, name=name)
+    if( not report['equivalent'] ):
+      failed.append(name)
+    if( args.output ):
+      folded_model.save(args.output)
+  if( failed ):
+    raise SystemExit(f"Folded models differ: {', '.join(failed)}")
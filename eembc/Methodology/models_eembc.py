@@ -0,0 +1,33 @@
+import os
+import sys
+import importlib
+
+# Registry of the EEMBC reference model builders, shared by the tools in this
+# directory. Every entry gives the model directory, module and function name.
+eembc_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+models = {
+  'resnet_v1_eembc': ('CIFAR10_ResNetv1', 'resnet_v1_eembc', 'resnet_v1_eembc'),
+  'resnet_v1_eembc_tiny': ('CIFAR10_ResNetv1', 'resnet_v1_eembc', 'resnet_v1_eembc_tiny'),
+  'mobilenet_v1_eembc': ('Person_detection', 'mobilenet_v1_eembc', 'mobilenet_v1_eembc'),
+  'dsconv_arm_eembc': ('KWS10_ARM_DSConv', 'dsconv_arm_eembc', 'dsconv_arm_eembc'),
+  'micro_speech_eembc': ('TFLite_micro_speech', 'model', 'micro_speech_eembc'),
+  'toyadmos_autoencoder_eembc': ('ToyADMOS_FC_AE', 'toyadmos_autoencoder_eembc', 'toyadmos_autoencoder_eembc'),
+}
+
+# Builder function of a registered model
+def model_builder(name):
+  if( name not in models ):
+    raise ValueError(f"Unknown model {name}, choose from {', '.join(models)}")
+  model_dir, module_name, function_name = models[name]
+  path = os.path.join(eembc_dir, model_dir)
+  if( path not in sys.path ):
+    sys.path.append(path)
+  return getattr(importlib.import_module(module_name), function_name)
+
+# Build a registered model, optionally loading trained weights (.h5)
+def build_model(name, weights=None, **kwargs):
+  model = model_builder(name)(**kwargs)
+  if( weights ):
+    model.load_weights(weights)
+  return model
@@ -0,0 +1,325 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+
+# Pure NumPy inference of the EEMBC models, without importing TensorFlow
+#   export_model (needs TensorFlow): the layer graph and weights of a Keras
+#       model in one .npz file (graph as JSON, weights as arrays)
+#   load_model (NumPy only): a NumpyModel running batched forward passes
+# Supported layers: Conv2D (im2col and one matrix product), DepthwiseConv2D
+# (one multiply-accumulate per kernel tap), Dense, BatchNormalization
+# (folded to a scale and offset at load time), Activation, ReLU, Softmax, Add,
+# AveragePooling2D, GlobalAveragePooling2D, Flatten, Reshape and Dropout
+# (identity), on channels_last float32 tensors
+# Example, export all the registered models and check them against Keras:
+#   python numpy_inference_eembc.py --output numpy_models
+# then, in a process without TensorFlow:
+#   import numpy_inference_eembc
+#   model = numpy_inference_eembc.load_model('numpy_models/resnet_v1_eembc.npz')
+#   y = model.predict(x)
+
+graph_key = '__graph__'
+supported_layers = ['InputLayer', 'Conv2D', 'DepthwiseConv2D', 'Dense', 'BatchNormalization', 'Activation', 'ReLU',
+                    'Softmax', 'Add', 'AveragePooling2D', 'GlobalAveragePooling2D', 'Flatten', 'Reshape', 'Dropout']
+
+#
+# Export (TensorFlow)
+#
+
+# Layer graph of a Keras model: every layer with its class, config and input
+# layer names, in execution order, and the model input and output layer names
+def model_graph(model):
+  config = model.get_config()
+  layers = []
+  previous = None
+  for layer_config in config['layers']:
+    name = layer_config['config']['name']
+    if( 'inbound_nodes' in layer_config ):
+      inbound = layer_config['inbound_nodes']
+      if( len(inbound) > 1 ):
+        raise ValueError(f"Layer {name} is used more than once")
+      inputs = [node[0] for node in inbound[0]] if inbound else []
+    else:
+      # Sequential model, every layer takes the output of the one before
+      inputs = [previous] if previous is not None else []
+    if( layer_config['class_name'] not in supported_layers ):
+      raise ValueError(f"Layer {name} of type {layer_config['class_name']} is not supported")
+    layers.append({'name': name, 'class_name': layer_config['class_name'], 'config': layer_config['config'], 'inputs': inputs})
+    previous = name
+
+  if( 'input_layers' in config ):
+    input_names = [node[0] for node in config['input_layers']]
+    output_names = [node[0] for node in config['output_layers']]
+  else:
+    input_names = [layers[0]['name']] if layers[0]['class_name'] == 'InputLayer' else [None]
+    output_names = [previous]
+    if( input_names[0] is None ):
+      input_names = ['input']
+      layers[0]['inputs'] = ['input']
+      layers.insert(0, {'name': 'input', 'class_name': 'InputLayer', 'config': {}, 'inputs': []})
+  return {'name': model.name, 'layers': layers, 'inputs': input_names, 'outputs': output_names,
+          'input_shapes': [list(shape[1:]) for shape in ([model.input_shape] if not isinstance(model.input_shape, list) else model.input_shape)]}
+
+def export_model(model, file_path):
+  graph = model_graph(model)
+  arrays = {graph_key: np.array(json.dumps(graph))}
+  for layer in model.layers:
+    for index, weight in enumerate(layer.get_weights()):
+      arrays[f"{layer.name}/{index}"] = weight.astype(np.float32)
+  np.savez(file_path, **arrays)
+
+#
+# Layers (NumPy)
+#
+
+def activation(x, name):
+  if( name in ('linear', None) ):
+    return x
+  if( name == 'relu' ):
+    return np.maximum(x, 0)
+  if( name == 'softmax' ):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+  if( name == 'sigmoid' ):
+    return 1 / (1 + np.exp(-x))
+  if( name == 'tanh' ):
+    return np.tanh(x)
+  raise ValueError(f"Activation {name} is not supported")
+
+# Zero padding of NHWC inputs as TensorFlow does for padding='same' (the odd
+# extra row and column at the end)
+def pad_same(x, kernel_size, strides):
+  pads = []
+  for size, k, s in zip(x.shape[1:3], kernel_size, strides):
+    total = max((-(-size // s) - 1) * s + k - size, 0)
+    pads.append((total // 2, total - total // 2))
+  if( not any(before or after for before, after in pads) ):
+    return x
+  return np.pad(x, [(0, 0)] + pads + [(0, 0)])
+
+# Windows [N, H', W', C, kh, kw] of an NHWC input, a strided view without copies
+def windows(x, kernel_size, strides):
+  view = np.lib.stride_tricks.sliding_window_view(x, kernel_size, axis=(1, 2))
+  return view[:, ::strides[0], ::strides[1]]
+
+def check_config(config):
+  if( config.get('data_format', 'channels_last') != 'channels_last' ):
+    raise ValueError(f"Layer {config['name']} is not channels_last")
+  if( any(rate != 1 for rate in config.get('dilation_rate', [1])) or config.get('groups', 1) != 1 ):
+    raise ValueError(f"Layer {config['name']} uses dilation or groups")
+
+class Conv2D:
+  def __init__(self, config, weights):
+    check_config(config)
+    self.kernel = weights[0]
+    self.bias = weights[1] if config['use_bias'] else None
+    self.strides = tuple(config['strides'])
+    self.padding = config['padding']
+    self.activation = config['activation']
+
+  # im2col: the windows as rows, one matrix product with the kernel
+  def __call__(self, x):
+    kh, kw = self.kernel.shape[:2]
+    if( self.padding == 'same' ):
+      x = pad_same(x, (kh, kw), self.strides)
+    y = np.tensordot(windows(x, (kh, kw), self.strides), self.kernel, axes=([3, 4, 5], [2, 0, 1]))
+    if( self.bias is not None ):
+      y += self.bias
+    return activation(y, self.activation)
+
+class DepthwiseConv2D:
+  def __init__(self, config, weights):
+    check_config(config)
+    self.kernel = weights[0]
+    self.bias = weights[1] if config['use_bias'] else None
+    self.strides = tuple(config['strides'])
+    self.padding = config['padding']
+    self.activation = config['activation']
+
+  # One multiply-accumulate of a strided slice of the input per kernel tap
+  def __call__(self, x):
+    kh, kw, channels, multiplier = self.kernel.shape
+    if( self.padding == 'same' ):
+      x = pad_same(x, (kh, kw), self.strides)
+    sh, sw = self.strides
+    out_h = (x.shape[1] - kh) // sh + 1
+    out_w = (x.shape[2] - kw) // sw + 1
+    y = np.zeros((x.shape[0], out_h, out_w, channels, multiplier), dtype=np.float32)
+    for i in range(kh):
+      for j in range(kw):
+        y += x[:, i:i + sh*(out_h - 1) + 1:sh, j:j + sw*(out_w - 1) + 1:sw, :, np.newaxis] * self.kernel[i, j]
+    y = y.reshape(y.shape[:3] + (channels * multiplier,))
+    if( self.bias is not None ):
+      y += self.bias
+    return activation(y, self.activation)
+
+class Dense:
+  def __init__(self, config, weights):
+    self.kernel = weights[0]
+    self.bias = weights[1] if config['use_bias'] else None
+    self.activation = config['activation']
+
+  def __call__(self, x):
+    y = x @ self.kernel
+    if( self.bias is not None ):
+      y += self.bias
+    return activation(y, self.activation)
+
+class BatchNormalization:
+  def __init__(self, config, weights):
+    self.name = config['name']
+    self.axis = config['axis'][0] if isinstance(config['axis'], (list, tuple)) else config['axis']
+    weights = list(weights)
+    gamma = weights.pop(0) if config['scale'] else 1
+    beta = weights.pop(0) if config['center'] else 0
+    mean, variance = weights
+    self.scale = (gamma / np.sqrt(variance + np.float32(config['epsilon']))).astype(np.float32)
+    self.offset = (beta - mean * self.scale).astype(np.float32)
+
+  def __call__(self, x):
+    if( self.axis not in (-1, x.ndim - 1) ):
+      raise ValueError(f"Layer {self.name} does not normalize the last axis")
+    return x * self.scale + self.offset
+
+class AveragePooling2D:
+  def __init__(self, config, weights):
+    check_config(config)
+    self.pool_size = tuple(config['pool_size'])
+    self.strides = tuple(config['strides'] or config['pool_size'])
+    self.padding = config['padding']
+
+  # With padding='same' the windows average only their values inside the input
+  def __call__(self, x):
+    if( self.padding == 'valid' ):
+      return windows(x, self.pool_size, self.strides).mean(axis=(-2, -1))
+    ones = pad_same(np.ones((1,) + x.shape[1:3] + (1,), dtype=np.float32), self.pool_size, self.strides)
+    sums = windows(pad_same(x, self.pool_size, self.strides), self.pool_size, self.strides).sum(axis=(-2, -1))
+    return sums / windows(ones, self.pool_size, self.strides).sum(axis=(-2, -1))
+
+class Function:
+  def __init__(self, function):
+    self.function = function
+
+  def __call__(self, *inputs):
+    return self.function(*inputs)
+
+def relu_layer(config):
+  if( config.get('max_value') is not None or config.get('negative_slope', 0) or config.get('threshold', 0) ):
+    raise ValueError(f"Layer {config['name']} is not a plain ReLU")
+  return Function(lambda x: np.maximum(x, 0))
+
+def build_layer(layer, weights):
+  class_name, config = layer['class_name'], layer['config']
+  if( class_name in ('Conv2D', 'DepthwiseConv2D', 'Dense', 'BatchNormalization', 'AveragePooling2D') ):
+    return globals()[class_name](config, weights)
+  if( class_name == 'Activation' ):
+    return Function(lambda x: activation(x, config['activation']))
+  if( class_name == 'ReLU' ):
+    return relu_layer(config)
+  if( class_name == 'Softmax' ):
+    return Function(lambda x: activation(x, 'softmax'))
+  if( class_name == 'Add' ):
+    return Function(lambda *inputs: sum(inputs[1:], inputs[0]))
+  if( class_name == 'GlobalAveragePooling2D' ):
+    return Function(lambda x: x.mean(axis=(1, 2)))
+  if( class_name == 'Flatten' ):
+    return Function(lambda x: x.reshape(len(x), -1))
+  if( class_name == 'Reshape' ):
+    return Function(lambda x: x.reshape((len(x),) + tuple(config['target_shape'])))
+  if( class_name == 'Dropout' ):
+    return Function(lambda x: x)
+  raise ValueError(f"Layer {layer['name']} of type {class_name} is not supported")
+
+class NumpyModel:
+  def __init__(self, graph, weights):
+    self.name = graph['name']
+    self.inputs = graph['inputs']
+    self.outputs = graph['outputs']
+    self.input_shapes = [tuple(shape) for shape in graph['input_shapes']]
+    self.layers = [(layer['name'], layer['inputs'], build_layer(layer, weights.get(layer['name'], [])))
+                   for layer in graph['layers'] if layer['class_name'] != 'InputLayer']
+
+    # Last use of every tensor, so intermediate results are freed early
+    self.last_use = {}
+    for step, (_, inputs, _) in enumerate(self.layers):
+      for name in inputs:
+        self.last_use[name] = step
+
+  # Forward pass of one batch, inputs are arrays in the order of the model inputs
+  def __call__(self, *inputs):
+    tensors = {name: np.asarray(x, dtype=np.float32) for name, x in zip(self.inputs, inputs)}
+    for step, (name, inputs, layer) in enumerate(self.layers):
+      tensors[name] = layer(*[tensors[i] for i in inputs])
+      for i in inputs:
+        if( self.last_use[i] == step and i not in self.outputs ):
+          del tensors[i]
+    outputs = [tensors[name] for name in self.outputs]
+    return outputs[0] if len(outputs) == 1 else outputs
+
+  # Outputs of a single input model, batch_size samples per forward pass
+  def predict(self, x, batch_size=256):
+    return np.concatenate([self(x[start:start+batch_size]) for start in range(0, len(x), batch_size)])
+
+def load_model(file_path):
+  with np.load(file_path) as arrays:
+    graph = json.loads(str(arrays[graph_key]))
+    weights = {}
+    for key in arrays.files:
+      if( key != graph_key ):
+        layer, index = key.rsplit('/', 1)
+        weights.setdefault(layer, {})[int(index)] = arrays[key]
+  weights = {layer: [values[i] for i in sorted(values)] for layer, values in weights.items()}
+  return NumpyModel(graph, weights)
+
+#
+# Checks (TensorFlow)
+#
+
+# Seconds to import this module, load a model and run one batch in a new
+# process, and the peak memory (MB) of that process
+def startup_cost(file_path, batch_size=1):
+  script = ("import time, numpy as np; start = time.time(); import numpy_inference_eembc; "
+            f"model = numpy_inference_eembc.load_model({file_path!r}); "
+            f"model.predict(np.zeros(({batch_size},) + model.input_shapes[0], dtype=np.float32)); "
+            "print(time.time() - start, [int(line.split()[1]) / 1024 for line in open('/proc/self/status') if line.startswith('VmHWM')][0])")
+  start = time.time()
+  output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+  return float(output[0]), float(output[1]), time.time() - start
+
+# Largest output difference between a Keras model and its NumPy export on
+# random inputs (random BatchNormalization statistics unless the model is trained)
+def compare_outputs(model, numpy_model, num_samples=32, seed=0):
+  rng = np.random.default_rng(seed)
+  x = rng.uniform(0, 1, (num_samples,) + tuple(model.input_shape[1:])).astype(np.float32)
+  return float(np.max(np.abs(model.predict(x, verbose=0) - numpy_model.predict(x))))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-m', '--model', type=str, nargs='+', default=None, help="registered models to export, default all")
+  parser.add_argument('-w', '--weights', type=str, nargs='*', default=None, help="trained weights of every model")
+  parser.add_argument('-o', '--output', type=str, default='numpy_models', help="directory of the exported .npz files")
+  parser.add_argument('-t', '--tolerance', type=float, default=1e-4, help="largest output difference to Keras")
+  args = parser.parse_args()
+
+  import models_eembc
+  import fold_batchnorm_eembc
+  names = args.model or list(models_eembc.models)
+  os.makedirs(args.output, exist_ok=True)
+  failed = False
+  for index, name in enumerate(names):
+    model = models_eembc.build_model(name, args.weights[index] if args.weights else None)
+    if( not args.weights ):
+      fold_batchnorm_eembc.randomize_batchnorm(model)
+    file_path = os.path.join(args.output, name + '.npz')
+    export_model(model, file_path)
+    difference = compare_outputs(model, load_model(file_path))
+    seconds, memory, total = startup_cost(os.path.abspath(file_path))
+    print(f"{name:<28} max difference {difference:.2e}  import+load+predict {seconds:.2f} s ({total:.2f} s with the interpreter), peak memory {memory:.0f} MB")
+    failed = failed or difference > args.tolerance
+  if( failed ):
+    raise SystemExit("Outputs differ from Keras")
@@ -0,0 +1,159 @@
+import csv
+import json
+import argparse
+import numpy as np
+import tensorflow as tf
+
+import models_eembc
+
+# Analytical cost profile of the EEMBC models, per layer and in total:
+#   macs: multiply-accumulates of one inference (batch 1)
+#     Conv2D, DepthwiseConv2D, SeparableConv2D, Dense: one per kernel weight and output position
+#     BatchNormalization: one per element (scale and offset)
+#     AveragePooling2D, GlobalAveragePooling2D: one accumulation per input element of the windows
+#     Activation, Add, MaxPooling2D, Flatten, Reshape, Dropout: none
+#   params: weights of the layer (all of them, with BatchNormalization statistics)
+#   output_bytes: memory of the output tensor
+#   live_bytes: all the activation tensors alive while the layer runs, when the
+#               layers run one after the other in model order and every tensor
+#               is freed after its last use; the peak is the activation memory
+#               (SRAM) a sequential runtime needs
+# bytes_per_element is 4 for float32 models and 1 for int8 models
+# Example, with int8 sizes and a budget check for a 256KB SRAM / 1MB flash MCU:
+#   python profile_eembc.py --model mobilenet_v1_eembc --bytes 1 --sram 262144 --flash 1048576 --csv vww.csv
+
+def shape_size(shape):
+  return int(np.prod([dim for dim in shape[1:] if dim is not None]))
+
+# Multiply-accumulates of one layer for batch 1
+def layer_macs(layer):
+  input_shapes = layer.input_shape if isinstance(layer.input_shape, list) else [layer.input_shape]
+  output_size = shape_size(layer.output_shape)
+  if( isinstance(layer, tf.keras.layers.SeparableConv2D) ):
+    kh, kw = layer.kernel_size
+    in_channels = input_shapes[0][-1]
+    depthwise = shape_size(layer.output_shape[:-1]) * in_channels * layer.depth_multiplier * kh * kw
+    pointwise = output_size * in_channels * layer.depth_multiplier
+    return depthwise + pointwise
+  if( isinstance(layer, tf.keras.layers.DepthwiseConv2D) ):
+    kh, kw = layer.kernel_size
+    return output_size * kh * kw
+  if( isinstance(layer, tf.keras.layers.Conv2D) ):
+    kh, kw = layer.kernel_size
+    return output_size * kh * kw * input_shapes[0][-1] // layer.groups
+  if( isinstance(layer, tf.keras.layers.Dense) ):
+    return output_size * input_shapes[0][-1]
+  if( isinstance(layer, tf.keras.layers.BatchNormalization) ):
+    return output_size
+  if( isinstance(layer, tf.keras.layers.AveragePooling2D) ):
+    return output_size * int(np.prod(layer.pool_size))
+  if( isinstance(layer, tf.keras.layers.GlobalAveragePooling2D) ):
+    return shape_size(input_shapes[0])
+  return 0
+
+# Per layer profile of a model, one dict per layer in execution order
+def profile_layers(model, bytes_per_element=4):
+  layers = [layer for layer in model.layers if not isinstance(layer, tf.keras.layers.InputLayer)]
+
+  # Step producing and last step using every activation tensor (inputs are
+  # alive from the start, outputs until the end)
+  first = {id(tensor): 0 for tensor in model.inputs}
+  last = {id(tensor): 0 for tensor in model.inputs}
+  sizes = {id(tensor): shape_size(tensor.shape) * bytes_per_element for tensor in model.inputs}
+  for step, layer in enumerate(layers):
+    for tensor in tf.nest.flatten(layer.input):
+      last[id(tensor)] = step
+    first[id(layer.output)] = step
+    last[id(layer.output)] = step
+    sizes[id(layer.output)] = shape_size(layer.output_shape) * bytes_per_element
+  for tensor in model.outputs:
+    last[id(tensor)] = len(layers)
+
+  rows = []
+  for step, layer in enumerate(layers):
+    rows.append({'name': layer.name,
+                 'type': layer.__class__.__name__,
+                 'output_shape': 'x'.join(str(dim) for dim in layer.output_shape[1:]),
+                 'macs': int(layer_macs(layer)),
+                 'params': int(layer.count_params()),
+                 'output_bytes': sizes[id(layer.output)],
+                 'live_bytes': sum(size for index, size in sizes.items() if first[index] <= step <= last[index])})
+  return rows
+
+# Profile of a model, the layers and the totals
+# Parameter memory is params * bytes_per_element (flash), activation memory
+# the peak of live_bytes (SRAM)
+def profile_model(model, bytes_per_element=4):
+  rows = profile_layers(model, bytes_per_element)
+  input_bytes = sum(shape_size(tensor.shape) for tensor in model.inputs) * bytes_per_element
+  totals = {'macs': sum(row['macs'] for row in rows),
+            'params': sum(row['params'] for row in rows),
+            'param_bytes': sum(row['params'] for row in rows) * bytes_per_element,
+            'peak_activation_bytes': max([input_bytes] + [row['live_bytes'] for row in rows]),
+            'bytes_per_element': bytes_per_element}
+  return {'name': model.name, 'layers': rows, 'totals': totals}
+
+# Print the profile as a table and the totals
+def print_profile(profile):
+  print(f"{'layer':<32}{'type':<24}{'output':>14}{'MACs':>12}{'params':>10}{'live bytes':>12}")
+  for row in profile['layers']:
+    print(f"{row['name']:<32}{row['type']:<24}{row['output_shape']:>14}{row['macs']:>12}{row['params']:>10}{row['live_bytes']:>12}")
+  totals = profile['totals']
+  print(f"Total MACs: {totals['macs']} ({2*totals['macs']/1e6:.2f} MFLOPs)")
+  print(f"Total params: {totals['params']} ({totals['param_bytes']} bytes)")
+  print(f"Peak activation memory: {totals['peak_activation_bytes']} bytes")
+
+# Compare the totals with the memory budgets of a device (None is no budget)
+def check_budget(profile, sram=None, flash=None):
+  totals = profile['totals']
+  fits = True
+  for memory, used, budget in [('SRAM', totals['peak_activation_bytes'], sram), ('flash', totals['param_bytes'], flash)]:
+    if( budget is not None ):
+      print(f"{profile['name']} {memory}: {used} of {budget} bytes ({100*used/budget:.1f}%){'' if used <= budget else ' OVER BUDGET'}")
+      fits = fits and used <= budget
+  return fits
+
+# All the layers of several profiles in one CSV file, with a model column
+def write_csv(profiles, file_path):
+  fields = ['model', 'name', 'type', 'output_shape', 'macs', 'params', 'output_bytes', 'live_bytes']
+  with open(file_path, 'w', newline='') as stream:
+    writer = csv.DictWriter(stream, fieldnames=fields)
+    writer.writeheader()
+    for profile in profiles:
+      for row in profile['layers']:
+        writer.writerow(dict(row, model=profile['name']))
+
+def write_json(profiles, file_path):
+  with open(file_path, 'w') as stream:
+    json.dump({profile['name']: profile for profile in profiles}, stream, indent=1)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-m', '--model', type=str, nargs='+', default=list(models_eembc.models), help="model names, default all of: " + ', '.join(models_eembc.models))
+  parser.add_argument('-b', '--bytes', type=int, default=4, help="bytes per weight and activation element, 4 for float32 and 1 for int8")
+  parser.add_argument('--sram', type=int, default=None, help="activation memory budget in bytes")
+  parser.add_argument('--flash', type=int, default=None, help="parameter memory budget in bytes")
+  parser.add_argument('--csv', type=str, default=None, help="write the per layer profiles to a CSV file")
+  parser.add_argument('--json', type=str, default=None, help="write the profiles and totals to a JSON file")
+  parser.add_argument('-q', '--quiet', action='store_true', help="print the totals only")
+  args = parser.parse_args()
+
+  profiles = []
+  fits = True
+  for name in args.model:
+    profile = profile_model(models_eembc.build_model(name), args.bytes)
+    profile['name'] = name
+    print(f"# {name}")
+    if( args.quiet ):
+      print(json.dumps(profile['totals']))
+    else:
+      print_profile(profile)
+    fits = check_budget(profile, args.sram, args.flash) and fits
+    profiles.append(profile)
+
+  if( args.csv ):
+    write_csv(profiles, args.csv)
+  if( args.json ):
+    write_json(profiles, args.json)
+  if( not fits ):
+    raise SystemExit("Models over the memory budget")
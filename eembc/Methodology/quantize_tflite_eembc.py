@@ -0,0 +1,154 @@
+import argparse
+import numpy as np
+import tensorflow as tf
+
+import models_eembc
+
+# Full-integer post-training quantization and TFLite export for the EEMBC models
+# Example, from a trained ResNet and CIFAR10 test samples saved with np.save:
+#   python quantize_tflite_eembc.py --model resnet_v1_eembc --weights model_best.h5 \
+#     --data x_test.npy --labels y_test.npy --output resnet_v1_eembc
+# writes resnet_v1_eembc.tflite and resnet_v1_eembc.cc (same layout as
+# TFLite_micro_speech/trained_models/model.cc) and reports size, tensor memory
+# and the accuracy delta of the int8 model compared with the float one
+
+# Representative dataset generator for the converter, one sample per step
+# samples is an array of model inputs, the first num_samples are used
+def representative_dataset(samples, num_samples=100):
+  def generator():
+    for sample in samples[:num_samples]:
+      yield [np.asarray(sample, dtype=np.float32)[np.newaxis]]
+  return generator
+
+# Convert a Keras model to a full-integer (int8 weights, activations, input
+# and output) TFLite flatbuffer
+def quantize_model(model, representative_data):
+  converter = tf.lite.TFLiteConverter.from_keras_model(model)
+  converter.optimizations = [tf.lite.Optimize.DEFAULT]
+  converter.representative_dataset = representative_data
+  converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+  converter.inference_input_type = tf.int8
+  converter.inference_output_type = tf.int8
+  return converter.convert()
+
+# Write a TFLite flatbuffer as a C array, 12 bytes per line
+def write_c_array(tflite_model, file_path, variable_name='g_model'):
+  lines = []
+  for start in range(0, len(tflite_model), 12):
+    lines.append('    ' + ', '.join(f'0x{byte:02x}' for byte in tflite_model[start:start+12]))
+  with open(file_path, 'w') as stream:
+    stream.write(f'unsigned char {variable_name}[] = {{\n')
+    stream.write(',\n'.join(lines))
+    stream.write('};\n')
+    stream.write(f'unsigned int {variable_name}_len = {len(tflite_model)};\n')
+
+# Tensor memory of a TFLite model
+# Constant tensors (weights, biases) live in flash with the model. Activation
+# tensors need RAM: their total without reuse, and the peak of the tensors
+# alive at the same time when the ops run in order, which is what a memory
+# planner like the one of TFLite Micro achieves at best (the arena also holds
+# some bookkeeping on top of it)
+def tensor_memory(tflite_model):
+  interpreter = tf.lite.Interpreter(model_content=tflite_model)
+  interpreter.allocate_tensors()
+  sizes = {}
+  for tensor in interpreter.get_tensor_details():
+    sizes[tensor['index']] = int(np.prod(tensor['shape'])) * np.dtype(tensor['dtype']).itemsize
+
+  ops = interpreter._get_ops_details()
+  inputs = [tensor['index'] for tensor in interpreter.get_input_details()]
+  outputs = [tensor['index'] for tensor in interpreter.get_output_details()]
+
+  # First op producing and last op using every activation tensor
+  first = {index: 0 for index in inputs}
+  last = {index: 0 for index in inputs}
+  for op_index, op in enumerate(ops):
+    for index in op['outputs']:
+      first[index] = op_index
+      last[index] = op_index
+    for index in op['inputs']:
+      if( index in first ):
+        last[index] = op_index
+  for index in outputs:
+    last[index] = len(ops)
+
+  activations = {index: sizes[index] for index in first}
+  weights = sum(size for index, size in sizes.items() if index not in activations)
+  peak = max(sum(size for index, size in activations.items() if first[index] <= op_index <= last[index])
+             for op_index in range(len(ops)+1))
+
+  return {'weights': weights, 'activations': sum(activations.values()), 'peak_activations': peak}
+
+# Run a TFLite model on every sample (batch 1, as on a device)
+# Inputs are quantized and outputs dequantized with the model's parameters
+def run_tflite(tflite_model, samples):
+  interpreter = tf.lite.Interpreter(model_content=tflite_model)
+  interpreter.allocate_tensors()
+  input_details = interpreter.get_input_details()[0]
+  output_details = interpreter.get_output_details()[0]
+  input_scale, input_zero_point = input_details['quantization']
+  output_scale, output_zero_point = output_details['quantization']
+
+  outputs = []
+  for sample in samples:
+    x = np.asarray(sample, dtype=np.float32)[np.newaxis]
+    if( input_details['dtype'] != np.float32 ):
+      info = np.iinfo(input_details['dtype'])
+      x = np.clip(np.round(x/input_scale + input_zero_point), info.min, info.max).astype(input_details['dtype'])
+    interpreter.set_tensor(input_details['index'], x)
+    interpreter.invoke()
+    y = interpreter.get_tensor(output_details['index'])[0]
+    if( output_details['dtype'] != np.float32 ):
+      y = (y.astype(np.float32) - output_zero_point) * output_scale
+    outputs.append(y)
+  return np.array(outputs)
+
+# Quantize a model, write .tflite and .cc files and report size, memory and
+# accuracy compared with the float model
+# samples are model inputs, the first num_calibration for calibration and the
+# first num_eval for the comparison; labels are the class of every sample
+# (accuracy is compared), or None (output error is compared, e.g. autoencoders)
+def export_model(model, samples, output_name, labels=None, num_calibration=100, num_eval=1000):
+  tflite_model = quantize_model(model, representative_dataset(samples, num_calibration))
+  with open(output_name + '.tflite', 'wb') as stream:
+    stream.write(tflite_model)
+  write_c_array(tflite_model, output_name + '.cc')
+
+  memory = tensor_memory(tflite_model)
+  print(f"Model size = {len(tflite_model)} bytes ({output_name}.tflite)")
+  print(f"Weights = {memory['weights']} bytes")
+  print(f"Activations = {memory['activations']} bytes, peak live activations (arena estimate) = {memory['peak_activations']} bytes")
+
+  x_eval = np.asarray(samples[:num_eval], dtype=np.float32)
+  y_float = model.predict(x_eval)
+  y_int8 = run_tflite(tflite_model, x_eval)
+  report = dict(memory, size=len(tflite_model))
+  if( labels is not None ):
+    labels = np.asarray(labels[:num_eval]).ravel()
+    report['float_accuracy'] = 100 * np.mean(np.argmax(y_float, axis=1) == labels)
+    report['int8_accuracy'] = 100 * np.mean(np.argmax(y_int8, axis=1) == labels)
+    print(f"Float accuracy = {report['float_accuracy']:2.1f}, int8 accuracy = {report['int8_accuracy']:2.1f} (delta {report['int8_accuracy']-report['float_accuracy']:+.1f})")
+  else:
+    report['mean_abs_error'] = float(np.mean(np.abs(y_int8 - y_float)))
+    print(f"Mean absolute output error int8 vs float = {report['mean_abs_error']:.4f}")
+  return report
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-m', '--model', type=str, required=True, help="model name, one of: " + ', '.join(models_eembc.models))
+  parser.add_argument('-w', '--weights', type=str, default=None, help="trained weights (.h5)")
+  parser.add_argument('-d', '--data', type=str, required=True, help="model inputs for calibration and evaluation (.npy)")
+  parser.add_argument('-l', '--labels', type=str, default=None, help="class labels of the inputs (.npy), integer or one-hot")
+  parser.add_argument('-o', '--output', type=str, default=None, help="output file name without extension")
+  parser.add_argument('--calibration', type=int, default=100, help="number of samples for calibration")
+  parser.add_argument('--eval', type=int, default=1000, help="number of samples for the float/int8 comparison")
+  args = parser.parse_args()
+
+  model = models_eembc.build_model(args.model, args.weights)
+  samples = np.load(args.data, mmap_mode='r')
+  labels = None
+  if( args.labels ):
+    labels = np.load(args.labels)
+    if( labels.ndim > 1 and labels.shape[-1] > 1 ):
+      labels = np.argmax(labels, axis=-1)
+  export_model(model, samples, args.output or args.model, labels, args.calibration, args.eval)
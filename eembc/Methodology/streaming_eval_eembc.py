@@ -0,0 +1,158 @@
+import numpy as np
+
+from eval_functions_eembc import count_above_thresholds, simplified_roc_from_counts
+from eval_functions_eembc import pr_from_counts, best_pr_accuracy
+
+# Streaming versions of the functions in eval_functions_eembc.py
+# Every accumulator keeps only counts, so memory does not depend on the
+# dataset size. Feed it batch by batch, e.g. straight from model.predict:
+#   acc = AccuracyAccumulator()
+#   for x, labels in batches:
+#     acc.update(model.predict(x), labels)
+#   accuracy = acc.result()
+# Accumulators filled on separate workers are combined with merge()
+
+# Classifier overall accuracy, same result as calculate_accuracy
+class AccuracyAccumulator:
+  def __init__(self):
+    self.correct = 0
+    self.total = 0
+
+  # batch_pred contains the outputs of the network for a batch
+  # batch_labels are the correct answers
+  def update(self, batch_pred, batch_labels):
+    batch_pred_label = np.argmax(batch_pred, axis=1)
+    self.correct += int(np.sum(np.asarray(batch_labels) == batch_pred_label))
+    self.total += len(batch_pred)
+
+  def merge(self, other):
+    self.correct += other.correct
+    self.total += other.total
+
+  def result(self):
+    return 100 * self.correct / self.total
+
+# Classifier accuracy per class, same result as calculate_all_accuracies
+class ClassAccuracyAccumulator:
+  def __init__(self, n_classes):
+    self.n_classes = n_classes
+    self.true_positives = np.zeros(n_classes, dtype=np.int64)
+    self.counts = np.zeros(n_classes, dtype=np.int64)
+
+  def update(self, batch_pred, batch_labels):
+    batch_labels = np.asarray(batch_labels)
+    is_class = batch_labels[:, np.newaxis] == np.arange(self.n_classes)
+    is_correct = (batch_labels == np.argmax(batch_pred, axis=1))[:, np.newaxis]
+    self.true_positives += np.sum(is_class & is_correct, axis=0)
+    self.counts += np.sum(is_class, axis=0)
+
+  def merge(self, other):
+    self.true_positives += other.true_positives
+    self.counts += other.counts
+
+  def result(self):
+    return 100 * self.true_positives / self.counts
+
+# Confusion matrix, rows are the actual class and columns the predicted one
+# Same result as sklearn's confusion_matrix in calculate_cm when every
+# class in range(n_classes) appears in the data
+class ConfusionMatrixAccumulator:
+  def __init__(self, n_classes):
+    self.n_classes = n_classes
+    self.cm = np.zeros([n_classes, n_classes], dtype=np.int64)
+
+  def update(self, batch_pred, batch_labels):
+    batch_labels = np.asarray(batch_labels).astype(np.int64).ravel()
+    batch_pred_label = np.argmax(batch_pred, axis=1)
+    # Histogram of (actual, predicted) pairs in one pass
+    pairs = batch_labels*self.n_classes + batch_pred_label
+    self.cm += np.bincount(pairs, minlength=self.n_classes**2).reshape(self.n_classes, self.n_classes)
+
+  def merge(self, other):
+    self.cm += other.cm
+
+  def result(self):
+    return self.cm
+
+# Classifier ROC AUC on the simplified threshold grid, same result as calculate_auc
+# Keeps the number of positives and negatives above every threshold per class
+class RocAccumulator:
+  def __init__(self, n_classes):
+    self.n_classes = n_classes
+    self.thresholds = np.arange(0.0, 1.01, .01)
+    self.true_positives = np.zeros([n_classes, len(self.thresholds)-1], dtype=np.int64)
+    self.false_positives = np.zeros([n_classes, len(self.thresholds)-1], dtype=np.int64)
+    self.positives = np.zeros(n_classes, dtype=np.int64)
+    self.negatives = np.zeros(n_classes, dtype=np.int64)
+
+  def update(self, batch_pred, batch_labels):
+    batch_pred = np.asarray(batch_pred, dtype=np.float64)
+    batch_labels = np.asarray(batch_labels)
+    for class_item in range(self.n_classes):
+      is_positive = batch_labels == class_item
+      scores = batch_pred[:,class_item]
+      self.true_positives[class_item] += count_above_thresholds(scores[is_positive], self.thresholds[1:])
+      self.false_positives[class_item] += count_above_thresholds(scores[~is_positive], self.thresholds[1:])
+      self.positives[class_item] += np.sum(is_positive)
+      self.negatives[class_item] += np.sum(~is_positive)
+
+  def merge(self, other):
+    self.true_positives += other.true_positives
+    self.false_positives += other.false_positives
+    self.positives += other.positives
+    self.negatives += other.negatives
+
+  # Per class false positive rate, true positive rate and area under curve
+  def curves(self):
+    return [simplified_roc_from_counts(self.true_positives[class_item], self.false_positives[class_item],
+                                       self.positives[class_item], self.negatives[class_item])
+            for class_item in range(self.n_classes)]
+
+  def result(self):
+    return np.array([roc_auc for _, _, roc_auc in self.curves()])
+
+# Autoencoder ROC AUC and precision/recall accuracy on the simplified grid
+# The batch functions spread the thresholds between the minimum and maximum
+# score, which are unknown while streaming, so the range has to be given.
+# Results match calculate_ae_auc and calculate_ae_pr_accuracy when
+# score_min and score_max are the minimum and maximum of all the scores
+# (e.g. from a first pass that only keeps np.amin/np.amax of every batch),
+# kept in the dtype of the scores so that the grid is the same
+class AnomalyAccumulator:
+  def __init__(self, score_min, score_max):
+    # ROC uses the 101 point grid, precision/recall its first 100 points
+    self.thresholds = score_min + np.arange(0.0, 1.01, .01)*(score_max-score_min)
+    self.true_positives = np.zeros(len(self.thresholds), dtype=np.int64)
+    self.false_positives = np.zeros(len(self.thresholds), dtype=np.int64)
+    self.n_normal = 0
+    self.n_anomaly = 0
+
+  # batch_pred contains the anomaly scores for a batch
+  # batch_true are the correct answers (0.0 for normal, 1.0 for anomaly)
+  def update(self, batch_pred, batch_true):
+    batch_pred = np.asarray(batch_pred, dtype=np.float64).ravel()
+    is_anomaly = np.asarray(batch_true).ravel() != 0
+    self.true_positives += count_above_thresholds(batch_pred[is_anomaly], self.thresholds)
+    self.false_positives += count_above_thresholds(batch_pred[~is_anomaly], self.thresholds)
+    self.n_anomaly += int(np.sum(is_anomaly))
+    self.n_normal += int(np.sum(~is_anomaly))
+
+  def merge(self, other):
+    if( not np.array_equal(self.thresholds, other.thresholds) ):
+      raise ValueError('Cannot merge accumulators with different score ranges')
+    self.true_positives += other.true_positives
+    self.false_positives += other.false_positives
+    self.n_normal += other.n_normal
+    self.n_anomaly += other.n_anomaly
+
+  def roc_curve(self):
+    return simplified_roc_from_counts(self.true_positives[1:], self.false_positives[1:],
+                                      self.n_anomaly, self.n_normal)
+
+  def pr_curve(self):
+    return pr_from_counts(self.true_positives[:-1], self.false_positives[:-1], self.n_anomaly)
+
+  def result(self):
+    _, _, roc_auc = self.roc_curve()
+    precision, recall = self.pr_curve()
+    return {'roc_auc': roc_auc, 'pr_accuracy': best_pr_accuracy(precision, recall)}
@@ -0,0 +1,238 @@
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+import models_eembc
+import quantize_tflite_eembc
+import audio_frontend_eembc
+import feature_cache_eembc
+
+# Streaming keyword spotting on many audio channels at once
+# Every hop brings window_step ms of new samples on every channel:
+#   frontend: only the new feature frame of every channel, from the samples of
+#             its window, with the noise estimate carried over from the frame
+#             before (as the microfrontend does on a device, so the frames are
+#             the ones of the audio_microfrontend op on the whole stream)
+#   ring buffer: the last num_frames frames of every channel, every frame is
+#             written twice in a buffer of 2*num_frames frames, so the model
+#             window is a contiguous view without copies
+#   model: one batch with the window of every channel
+#   smoothing: mean of the posteriors of the last average_window_ms
+#   detection: the best smoothed class, not silence or unknown, above the
+#             threshold with at least min_count posteriors averaged, when it
+#             differs from the last detected class or suppression_ms after it
+#             (RecognizeCommands of the TFLite Micro micro_speech example)
+# The runner times every hop (frontend, model, smoothing), measures its CPU
+# time and reports the real-time factor, the CPU time of a hop divided by the
+# hop duration: one core sustains channels / real-time factor channels.
+# Example, 1, 16 and 64 channels of 30s synthetic streams with the int8 model:
+#   python streaming_kws_eembc.py --model micro_speech_eembc --backend tflite_int8 --channels 1 16 64 --seconds 30
+
+backends = ['keras', 'tflite', 'tflite_int8']
+
+# Incremental microfrontend of num_streams synchronized streams
+class StreamingFrontend:
+  def __init__(self, config, num_streams):
+    self.config = audio_frontend_eembc.frontend_config(config)
+    self.tables = audio_frontend_eembc.frontend_tables(tuple(sorted(self.config.items())))
+    self.pending = np.zeros((num_streams, 0), dtype=np.int16)
+    self.estimate = None
+
+  # New samples [streams, samples] (int16), returns the new frames [streams, frames, channels]
+  def process(self, samples):
+    size, step = self.tables['size'], self.tables['step']
+    self.pending = np.concatenate([self.pending, samples], axis=1)
+    num_frames = max(0, 1 + (self.pending.shape[1] - size) // step)
+    if( num_frames == 0 ):
+      return np.zeros((len(self.pending), 0, self.config['num_channels']), dtype=np.uint16)
+    windows = np.lib.stride_tricks.sliding_window_view(self.pending, size, axis=-1)[:, :num_frames * step:step]
+    frames, self.estimate = audio_frontend_eembc.frontend_output(
+      audio_frontend_eembc.filterbank_signal(windows, self.tables), self.config, self.tables, self.estimate)
+    self.pending = self.pending[:, num_frames * step:]
+    return frames
+
+# Model call on a batch of windows, returns the posteriors
+def keras_predictor(model):
+  predict = tf.function(lambda x: model(x, training=False))
+  return lambda x: np.asarray(predict(x))
+
+# TFLite interpreter for a fixed batch size, quantizing the input and
+# dequantizing the output of int8 models
+def tflite_predictor(tflite_model, batch_size):
+  interpreter = tf.lite.Interpreter(model_content=tflite_model)
+  input_details = interpreter.get_input_details()[0]
+  interpreter.resize_tensor_input(input_details['index'], [batch_size] + list(input_details['shape'][1:]))
+  interpreter.allocate_tensors()
+  output_details = interpreter.get_output_details()[0]
+  input_scale, input_zero_point = input_details['quantization']
+  output_scale, output_zero_point = output_details['quantization']
+
+  def predict(x):
+    if( input_details['dtype'] == np.int8 ):
+      x = np.clip(np.round(x / input_scale) + input_zero_point, -128, 127)
+    interpreter.set_tensor(input_details['index'], x.astype(input_details['dtype']))
+    interpreter.invoke()
+    output = interpreter.get_tensor(output_details['index'])
+    if( output_details['dtype'] == np.int8 ):
+      output = (output.astype(np.float32) - output_zero_point) * output_scale
+    return output
+  return predict
+
+def build_predictor(model, backend, batch_size, calibration=None):
+  if( backend == 'keras' ):
+    return keras_predictor(model)
+  if( backend == 'tflite' ):
+    return tflite_predictor(tf.lite.TFLiteConverter.from_keras_model(model).convert(), batch_size)
+  representative_data = quantize_tflite_eembc.representative_dataset(calibration)
+  return tflite_predictor(quantize_tflite_eembc.quantize_model(model, representative_data), batch_size)
+
+class StreamingKeywordSpotter:
+  # predict maps windows [streams, frames, channels, 1] to posteriors, classes
+  # are the class names (silence and unknown first)
+  def __init__(self, frontend_config, num_streams, predict, classes, average_window_ms=1000, threshold=0.8,
+               suppression_ms=1500, min_count=3):
+    self.frontend = StreamingFrontend(frontend_config, num_streams)
+    config = self.frontend.config
+    self.num_frames = config['num_frames']
+    self.hop_ms = config['window_step']
+    self.hop_samples = self.frontend.tables['step']
+    self.predict = predict
+    self.classes = classes
+    self.threshold = threshold
+    self.suppression_ms = suppression_ms
+    self.min_count = min_count
+
+    self.frames = np.zeros((num_streams, 2 * self.num_frames, config['num_channels'], 1), dtype=np.float32)
+    self.position = 0
+    self.num_posteriors = max(1, average_window_ms // self.hop_ms)
+    self.posteriors = np.zeros((num_streams, self.num_posteriors, len(classes)), dtype=np.float32)
+    self.count = 0
+    self.time_ms = 0
+    self.last_label = np.zeros(num_streams, dtype=int)
+    self.last_time_ms = np.full(num_streams, -np.inf)
+    self.output_scale = np.float32(config['output_scale'])
+    self.timings = {'frontend': [], 'model': [], 'smoothing': [], 'total': [], 'cpu': []}
+
+  # Add frames [streams, frames, channels] to the ring buffer
+  def push_frames(self, frames):
+    for frame in range(frames.shape[1]):
+      values = frames[:, frame, :, np.newaxis].astype(np.float32) * self.output_scale
+      self.frames[:, self.position] = values
+      self.frames[:, self.position + self.num_frames] = values
+      self.position = (self.position + 1) % self.num_frames
+
+  # The last num_frames frames of every stream, oldest first
+  def window(self):
+    return self.frames[:, self.position:self.position + self.num_frames]
+
+  # Smoothed posteriors, returns the detections (stream, class name, score) of this hop
+  def detect(self, posteriors):
+    self.posteriors[:, self.count % self.num_posteriors] = posteriors
+    self.count += 1
+    smoothed = self.posteriors[:, :min(self.count, self.num_posteriors)].mean(axis=1)
+    label = np.argmax(smoothed, axis=1)
+    score = smoothed[np.arange(len(label)), label]
+    new = ((label > 1) & (score > self.threshold) & (min(self.count, self.num_posteriors) >= self.min_count)
+           & ((label != self.last_label) | (self.time_ms - self.last_time_ms > self.suppression_ms)))
+    self.last_label[new] = label[new]
+    self.last_time_ms[new] = self.time_ms
+    return [(int(stream), self.classes[label[stream]], float(score[stream])) for stream in np.flatnonzero(new)]
+
+  # One hop of new samples [streams, hop samples], returns the detections
+  def process(self, samples):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    self.push_frames(self.frontend.process(samples))
+    frontend_end = time.perf_counter()
+    posteriors = self.predict(self.window())
+    model_end = time.perf_counter()
+    detections = self.detect(posteriors)
+    end = time.perf_counter()
+    self.time_ms += self.hop_ms
+
+    self.timings['frontend'].append(frontend_end - start)
+    self.timings['model'].append(model_end - frontend_end)
+    self.timings['smoothing'].append(end - model_end)
+    self.timings['total'].append(end - start)
+    self.timings['cpu'].append(time.process_time() - cpu_start)
+    return detections
+
+  # Latency percentiles (ms) of the hops after the first warmup ones, CPU
+  # time per hop and the real-time factor
+  def report(self, warmup=10):
+    timings = {key: 1000 * np.array(values[warmup:]) for key, values in self.timings.items()}
+    report = {'streams': len(self.frames), 'hops': len(timings['total']), 'hop_ms': self.hop_ms}
+    for key in ['frontend', 'model', 'smoothing', 'total']:
+      report[key + '_p50_ms'] = float(np.percentile(timings[key], 50))
+      report[key + '_p99_ms'] = float(np.percentile(timings[key], 99))
+    report['cpu_ms_per_hop'] = float(np.mean(timings['cpu']))
+    report['real_time_factor'] = report['cpu_ms_per_hop'] / self.hop_ms
+    report['streams_per_core'] = report['streams'] / report['real_time_factor']
+    return report
+
+# Synthetic int16 streams of seconds of audio, test clips one after the other
+def test_streams(num_streams, seconds, sample_rate=16000):
+  num_clips = int(np.ceil(seconds))
+  return np.stack([audio_frontend_eembc.test_clips(num_clips, sample_rate, sample_rate, seed=stream).reshape(-1)[:int(seconds * sample_rate)]
+                   for stream in range(num_streams)])
+
+# Run streams [streams, samples] hop by hop, returns the detections (hop time ms, stream, class, score)
+def run_streams(spotter, streams):
+  detections = []
+  for start in range(0, streams.shape[1] - spotter.hop_samples + 1, spotter.hop_samples):
+    for stream, label, score in spotter.process(streams[:, start:start + spotter.hop_samples]):
+      detections.append((spotter.time_ms, stream, label, score))
+  return detections
+
+# Number of frames of the streaming frontend differing from the frontend on the whole streams
+def check_frontend(config, streams, hop_samples):
+  config = dict(audio_frontend_eembc.frontend_config(config), num_frames=None)
+  frontend = StreamingFrontend(config, len(streams))
+  frames = np.concatenate([frontend.process(streams[:, start:start + hop_samples])
+                           for start in range(0, streams.shape[1], hop_samples)], axis=1)
+  reference = audio_frontend_eembc.frontend(streams, config)
+  return int(np.sum(np.any(frames != reference, axis=-1))), reference.shape[1]
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-m', '--model', type=str, default='micro_speech_eembc', choices=list(feature_cache_eembc.model_words), help="keyword spotting model")
+  parser.add_argument('-w', '--weights', type=str, default=None, help="trained weights (random weights without)")
+  parser.add_argument('-b', '--backend', type=str, default='tflite', choices=backends, help="model backend")
+  parser.add_argument('-c', '--channels', type=int, nargs='+', default=[1, 16], help="numbers of simultaneous audio streams to run")
+  parser.add_argument('-s', '--seconds', type=float, default=10, help="seconds of synthetic audio per stream")
+  parser.add_argument('--threshold', type=float, default=0.8, help="detection threshold of the smoothed posterior")
+  parser.add_argument('--average-window', type=int, default=1000, help="posterior smoothing window in ms")
+  parser.add_argument('--suppression', type=int, default=1500, help="ms after a detection before the same class is detected again")
+  parser.add_argument('--min-count', type=int, default=3, help="posteriors needed in the smoothing window")
+  parser.add_argument('--check', action='store_true', help="check the streaming frontend against the frontend on the whole streams")
+  parser.add_argument('--json', type=str, default=None, help="write the reports to a JSON file")
+  args = parser.parse_args()
+
+  config = audio_frontend_eembc.frontend_config(args.model)
+  classes = ['_silence_', '_unknown_'] + feature_cache_eembc.model_words[args.model]
+  model = models_eembc.build_model(args.model, args.weights)
+  calibration = audio_frontend_eembc.compute_features(audio_frontend_eembc.test_clips(100), config)
+  hop_samples = audio_frontend_eembc.window_samples(config)[1]
+
+  if( args.check ):
+    mismatches, total = check_frontend(config, test_streams(4, 5), hop_samples)
+    print(f"streaming frontend: {mismatches} of {total} frames differ from the frontend on the whole streams")
+    if( mismatches ):
+      raise SystemExit("Streaming frontend differs")
+
+  reports = []
+  for num_streams in args.channels:
+    spotter = StreamingKeywordSpotter(config, num_streams, build_predictor(model, args.backend, num_streams, calibration), classes,
+                                      args.average_window, args.threshold, args.suppression, args.min_count)
+    detections = run_streams(spotter, test_streams(num_streams, args.seconds))
+    report = dict(spotter.report(), model=args.model, backend=args.backend, detections=len(detections))
+    print(f"{num_streams:4d} streams: hop p50 {report['total_p50_ms']:.2f} ms p99 {report['total_p99_ms']:.2f} ms "
+          f"(frontend {report['frontend_p50_ms']:.2f}, model {report['model_p50_ms']:.2f}), "
+          f"CPU {report['cpu_ms_per_hop']:.2f} ms per {report['hop_ms']} ms hop, real-time factor {report['real_time_factor']:.3f}, "
+          f"{report['streams_per_core']:.0f} streams per core, {len(detections)} detections")
+    reports.append(report)
+  if( args.json ):
+    with open(args.json, 'w') as stream:
+      json.dump(reports, stream, indent=1)
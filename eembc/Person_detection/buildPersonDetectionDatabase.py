@@ -4,7 +4,11 @@ import skimage.io as io
 from skimage.color import gray2rgb
 from skimage.transform import resize
 import matplotlib.pyplot as plt
+from multiprocessing import Pool
 import os
+import time
+import functools
+import vw_shards
 
 # Parameters, change directories for a local run
 useLocalCoco=True
@@ -19,13 +23,203 @@ areaRatio=.025
 useBoundingBoxArea=True
 imgSize = 96
 
-# Generation function for each dataset portion
-def generateInstance(dataType, outputDataDir):
+# Processes used to read, resize and write the images
+numWorkers=os.cpu_count()
+# Images handed to a worker at once
+chunkSize=64
+# Output as 'images' (one file per image in person/ and non_person/) or as
+# 'shards' (packed uint8 arrays in shards/, see vw_shards.py)
+outputFormat='images'
+# Images per shard
+shardSize=4096
+# Resize with 'skimage' (anti-aliased float64 resize, the reference dataset) or
+# 'area' (float32 area interpolation of whole batches, several times faster)
+resizeMethod='skimage'
+# Before an 'area' build, the first parityImages images are also resized with
+# skimage and the build stops if the mean absolute pixel error is larger
+parityImages=32
+parityMaxError=3.0
+
+# Per image annotation index of a dataset portion, built once from the COCO json
+# Keeps the number of person annotations and the largest person to image area
+# ratio, so later builds (also with another areaRatio) never parse the json
+def indexFileName(dataType):
+    return '%s/%s_index_%s.npz'%(annDir,wakeword,dataType)
 
+def buildIndex(dataType):
     # initialize COCO api for instance annotations
     annFile='{}/instances_{}.json'.format(annDir,dataType)
-    print(dataType + ', starting processing');
     coco=COCO(annFile)
+    catIds = coco.getCatIds(catNms=wakeword);
+
+    numImages = len(coco.imgs)
+    imgIds = np.zeros(numImages, dtype=np.int64)
+    fileNames = []
+    cocoUrls = []
+    numAnns = np.zeros(numImages, dtype=np.int32)
+    maxBoxRatio = np.zeros(numImages)
+    maxAreaRatio = np.zeros(numImages)
+
+    for i, image in enumerate(coco.imgs):
+        img = coco.loadImgs(image)[0]
+        imgIds[i] = img['id']
+        fileNames.append(img['file_name'])
+        cocoUrls.append(img.get('coco_url', ''))
+
+        # Get annotation
+        annIds = coco.getAnnIds(imgIds=img['id'], catIds=catIds, iscrowd=False)
+        anns = coco.loadAnns(annIds)
+
+        # Area of image for ratio calculations
+        imageArea = img['height']*img['width']
+        numAnns[i] = len(anns)
+        for ann in anns:
+            maxBoxRatio[i] = max(maxBoxRatio[i], ann['bbox'][2]*ann['bbox'][3]/imageArea)
+            maxAreaRatio[i] = max(maxAreaRatio[i], ann['area']/imageArea)
+
+    # Written to a temporary file first, an interrupted build leaves no partial index
+    indexFile = indexFileName(dataType)
+    with open(indexFile + '.tmp', 'wb') as stream:
+        np.savez(stream, imgIds=imgIds, fileNames=np.array(fileNames), cocoUrls=np.array(cocoUrls),
+                 numAnns=numAnns, maxBoxRatio=maxBoxRatio, maxAreaRatio=maxAreaRatio)
+    os.replace(indexFile + '.tmp', indexFile)
+
+# Load the index, building it first if needed or if the json is newer
+def loadIndex(dataType):
+    annFile='{}/instances_{}.json'.format(annDir,dataType)
+    indexFile = indexFileName(dataType)
+    if( not os.path.exists(indexFile) or
+        (os.path.exists(annFile) and os.path.getmtime(annFile) > os.path.getmtime(indexFile)) ):
+        print(dataType + ', building annotation index');
+        buildIndex(dataType)
+    with np.load(indexFile) as index:
+        return {key: index[key] for key in index.files}
+
+# Output file for every image of the index, empty if the image is skipped
+def outputFileNames(index, outputDataDir):
+    # Check if annotation's area is large enough, if not skip image altogether
+    if( useBoundingBoxArea ):
+        annRatio = index['maxBoxRatio']
+    else:
+        annRatio = index['maxAreaRatio']
+
+    fullFileNames = []
+    for fileName, numAnns, ratio in zip(index['fileNames'], index['numAnns'], annRatio):
+        # Check if at least a person is present
+        if( numAnns == 0 ):
+            fullFileNames.append('%s/non_%s/%s'%(outputDataDir,wakeword,fileName))
+        elif( ratio > areaRatio ):
+            fullFileNames.append('%s/%s/%s'%(outputDataDir,wakeword,fileName))
+        else:
+            fullFileNames.append('')
+    return fullFileNames
+
+# Read one image as RGB
+def readImage(imageSource):
+    I = io.imread(imageSource)
+
+    # Convert to RGB if needed
+    if( I.ndim == 2 ):
+        I = gray2rgb(I)
+    return I
+
+# Read and resize one image with skimage
+def resizeImage(imageSource):
+    I = resize(readImage(imageSource), (imgSize, imgSize), anti_aliasing=True)
+    return (255*I).astype(np.uint8)
+
+# Area interpolation weights, each output pixel averages the input pixels it
+# covers, weighted by the covered fraction
+@functools.lru_cache(maxsize=None)
+def areaWeights(inSize, outSize):
+    scale = inSize/outSize
+    starts = np.arange(outSize)[:, np.newaxis]*scale
+    pixels = np.arange(inSize)[np.newaxis, :]
+    overlap = np.minimum(starts+scale, pixels+1) - np.maximum(starts, pixels)
+    return (np.clip(overlap, 0, None)/scale).astype(np.float32)
+
+# Area resize of a list of uint8 images into output [len(images), imgSize, imgSize, 3]
+# Images of the same shape are resized together, rows then columns, as two
+# float32 matrix products
+def areaResizeBatch(images, output):
+    shapes = {}
+    for i, I in enumerate(images):
+        shapes.setdefault(I.shape, []).append(i)
+
+    for (height, width, channels), items in shapes.items():
+        batch = np.stack([images[i] for i in items]).astype(np.float32)
+        rows = np.matmul(areaWeights(height, imgSize), batch.reshape(len(items), height, width*channels))
+        rows = rows.reshape(len(items), imgSize, width, channels)
+        resized = np.matmul(areaWeights(width, imgSize), rows)
+        output[items] = np.clip(resized, 0, 255)
+    return output
+
+# Output buffer of the worker process, reused for all its batches
+batchBuffer = None
+
+# Read and resize a batch of images, runs in the worker processes
+def resizeBatch(imageSources):
+    global batchBuffer
+    if( batchBuffer is None or len(batchBuffer) < len(imageSources) ):
+        batchBuffer = np.zeros([len(imageSources), imgSize, imgSize, 3], dtype=np.uint8)
+    output = batchBuffer[:len(imageSources)]
+
+    if( resizeMethod == 'area' ):
+        return areaResizeBatch([readImage(imageSource) for imageSource in imageSources], output)
+    for i, imageSource in enumerate(imageSources):
+        output[i] = resizeImage(imageSource)
+    return output
+
+# Read, resize and write a batch of images, runs in the worker processes
+def processBatch(jobs):
+    resized = resizeBatch([imageSource for imageSource, _ in jobs])
+    for I, (_, fullFileName) in zip(resized, jobs):
+        io.imsave(fullFileName, I, check_contrast=False)
+    return [fullFileName for _, fullFileName in jobs]
+
+# Read and resize a batch of images for a shard, runs in the worker processes
+def shardBatch(jobs):
+    resized = resizeBatch([imageSource for imageSource, _ in jobs])
+    return [fullFileName for _, fullFileName in jobs], resized.copy()
+
+# Compare the area resize against the skimage one on the first images
+def checkResizeParity(dataType, jobs):
+    imageSources = [imageSource for imageSource, _ in jobs[:parityImages]]
+    if( len(imageSources) == 0 ):
+        return
+    reference = np.stack([resizeImage(imageSource) for imageSource in imageSources])
+    resized = areaResizeBatch([readImage(imageSource) for imageSource in imageSources], np.zeros_like(reference))
+    error = np.abs(reference.astype(np.int16) - resized)
+    meanError = np.amax(np.mean(error, axis=(1,2,3)))
+    print(dataType + ', area resize vs skimage: mean pixel error %.2f (worst image), max pixel error %d'%(meanError, np.amax(error)))
+    if( meanError > parityMaxError ):
+        raise ValueError('Area resize differs from skimage by %.2f > %.2f, use resizeMethod=\'skimage\''%(meanError, parityMaxError))
+
+# Jobs in batches handed to the workers
+def jobBatches(jobs):
+    return [jobs[start:start+chunkSize] for start in range(0, len(jobs), chunkSize)]
+
+# Files already written by a previous run
+# The manifest lists every file whose write completed, so an interrupted run
+# resumes without rewriting them. Outputs built before manifests existed are
+# recognized by the files being present.
+def completedFiles(manifestFileName, jobs):
+    if( os.path.exists(manifestFileName) ):
+        with open(manifestFileName) as manifest:
+            return set(line.rstrip('\n') for line in manifest)
+    return set(fullFileName for _, fullFileName in jobs if os.path.exists(fullFileName))
+
+# Generation function for each dataset portion
+def generateInstance(dataType, outputDataDir):
+
+    print(dataType + ', starting processing');
+    index = loadIndex(dataType)
+
+    # COCO api is only needed for debugging
+    if( debugCats or debugPlot ):
+        annFile='{}/instances_{}.json'.format(annDir,dataType)
+        coco=COCO(annFile)
+        catIds = coco.getCatIds(catNms=wakeword);
 
     # display COCO categories and supercategories
     if( debugCats ):
@@ -36,9 +230,42 @@ def generateInstance(dataType, outputDataDir):
         nms = set([cat['supercategory'] for cat in cats])
         print('COCO supercategories: \n{}'.format(' '.join(nms)))
 
-    # Get all images containing given categories
-    catIds = coco.getCatIds(catNms=wakeword);
+    # Label all images, only the ones we didn't skip are written
+    jobs = []
+    fullFileNames = outputFileNames(index, outputDataDir)
+    for i, fullFileName in enumerate(fullFileNames):
+        if( useLocalCoco ):
+            imageSource = '%s/%s/%s'%(dataDir,dataType,index['fileNames'][i])
+        else:
+            imageSource = str(index['cocoUrls'][i])
+
+        # Debug plot
+        if( debugPlot ):
+            plt.imshow(io.imread(imageSource)); plt.axis('off')
+            coco.showAnns(coco.loadAnns(coco.getAnnIds(imgIds=int(index['imgIds'][i]), catIds=catIds, iscrowd=False)))
+            plt.show()
 
+        if( len(fullFileName) ):
+            jobs.append((imageSource, fullFileName))
+
+    if( resizeMethod == 'area' ):
+        checkResizeParity(dataType, jobs)
+
+    if( outputFormat == 'shards' ):
+        writeShards(dataType, outputDataDir, jobs)
+    else:
+        writeImages(dataType, outputDataDir, jobs)
+
+# Progress and throughput
+def showProgress(dataType, index, startTime):
+    print(dataType + ', index=' + str(index) + ', %.1f images/s'%(index/(time.time()-startTime)))
+
+def showThroughput(dataType, index, startTime):
+    elapsed = time.time() - startTime
+    print(dataType + ', wrote ' + str(index) + ' images in %.1f s (%.1f images/s)'%(elapsed, index/max(elapsed,1e-9)))
+
+# Write one image file per job in person/ and non_person/
+def writeImages(dataType, outputDataDir, jobs):
     # Create the output directories
     if not os.path.exists(outputDataDir):
         os.makedirs(outputDataDir)
@@ -47,68 +274,73 @@ def generateInstance(dataType, outputDataDir):
     if not os.path.exists('%s/non_%s'%(outputDataDir,wakeword)):
         os.makedirs('%s/non_%s'%(outputDataDir,wakeword))
 
-    # Loop over all images and process
-    print(dataType + ', wrinting ' + str(len(coco.imgs)) + ' images...');
+    # Skip what a previous run already wrote
+    manifestFileName = '%s/manifest_%s.txt'%(outputDataDir,dataType)
+    completed = completedFiles(manifestFileName, jobs)
+    jobs = [job for job in jobs if job[1] not in completed]
+
+    # Resize and write in parallel, recording every completed file
+    print(dataType + ', wrinting ' + str(len(jobs)) + ' images, ' + str(len(completed)) + ' already done...');
     index = 0
-    for image in coco.imgs:
-        # Read image
-        img = coco.loadImgs(image)[0]
-        if( useLocalCoco ):
-            I = io.imread('%s/%s/%s'%(dataDir,dataType,img['file_name']))
-        else:
-            I = io.imread(img['coco_url'])
-        
-        # Convert to RGB if needed
-        if( I.ndim == 2 ):
-            I = gray2rgb(I)
+    startTime = time.time()
+    with open(manifestFileName, 'a') as manifest, Pool(numWorkers) as pool:
+        if( len(completed) and manifest.tell() == 0 ):
+            manifest.writelines(fullFileName + '\n' for fullFileName in sorted(completed))
+        for fullFileNames in pool.imap_unordered(processBatch, jobBatches(jobs)):
+            manifest.writelines(fullFileName + '\n' for fullFileName in fullFileNames)
 
-        # Get annotation
-        annIds = coco.getAnnIds(imgIds=img['id'], catIds=catIds, iscrowd=False)
-        anns = coco.loadAnns(annIds)
+            # Show progress
+            if( (index % 1000) + len(fullFileNames) >= 1000 ):
+                manifest.flush()
+                showProgress(dataType, index + len(fullFileNames), startTime)
+            index += len(fullFileNames)
 
-        # Debug plot
-        if( debugPlot ):
-            plt.imshow(I); plt.axis('off')
-            coco.showAnns(anns)
-            plt.show()
+    showThroughput(dataType, index, startTime)
 
-        # Area of image for ratio calculations
-        imageArea = I.shape[0]*I.shape[1]
+# Write the jobs as packed shards of shardSize images
+# Labels follow the output directory the image would have in 'images' format
+def writeShards(dataType, outputDataDir, jobs):
+    # Skip what completed shards already hold
+    completed = vw_shards.completedNames(outputDataDir, dataType)
+    jobs = [job for job in jobs if job[1] not in completed]
 
-        # Check if at least a person is present
-        fullFileName = ''
-        if( len(anns) > 0 ):
-            for ann in anns:
-                # Check if annotation's area is large enough
-                # If not skip image altogether
-                if( useBoundingBoxArea ):
-                    annArea = ann['bbox'][2]*ann['bbox'][3]
-                else:
-                    annArea = ann['area']
-
-                if( annArea/imageArea > areaRatio ):
-                    fullFileName = '%s/%s/%s'%(outputDataDir,wakeword,img['file_name'])
-                    break
-        else:
-            fullFileName = '%s/non_%s/%s'%(outputDataDir,wakeword,img['file_name'])
+    print(dataType + ', packing ' + str(len(jobs)) + ' images, ' + str(len(completed)) + ' already done...');
+    images = np.zeros([min(shardSize, len(jobs)), imgSize, imgSize, 3], dtype=np.uint8)
+    labels = np.zeros(len(images), dtype=np.uint8)
+    names = []
+    index = 0
+    startTime = time.time()
+    with Pool(numWorkers) as pool:
+        for fullFileNames, resized in pool.imap_unordered(shardBatch, jobBatches(jobs)):
+            for fullFileName, I in zip(fullFileNames, resized):
+                images[len(names)] = I
+                labels[len(names)] = os.path.basename(os.path.dirname(fullFileName)) == wakeword
+                names.append(fullFileName)
 
-        # Resize and write only we didn't skip
-        if( len(fullFileName) ):
-            I = resize(I, (imgSize, imgSize), anti_aliasing=True)
-            io.imsave(fullFileName, (255*I).astype(np.uint8), check_contrast=False)
-        
-        # Show progress
-        index += 1
-        if( (index % 1000) == 0 ):
-            print(dataType + ', index=' + str(index))
-
-
-# Generate for training set, COCO2014
-outputDataDir = './vw_coco2014_96_2p5b'
-dataType='train2014'
-generateInstance(dataType, outputDataDir)
-
-# Then for validation set, COCO2014
-outputDataDir = './vw_coco2014_96_2p5b'
-dataType='val2014'
-generateInstance(dataType, outputDataDir)
\ No newline at end of file
+                # Flush full shards
+                if( len(names) == len(images) ):
+                    vw_shards.writeShard(outputDataDir, dataType, images, labels, names)
+                    names = []
+
+            # Show progress
+            if( (index % 1000) + len(fullFileNames) >= 1000 ):
+                showProgress(dataType, index + len(fullFileNames), startTime)
+            index += len(fullFileNames)
+
+    # Last partial shard
+    if( len(names) ):
+        vw_shards.writeShard(outputDataDir, dataType, images[:len(names)], labels[:len(names)], names)
+
+    showThroughput(dataType, index, startTime)
+
+
+if __name__ == '__main__':
+    # Generate for training set, COCO2014
+    outputDataDir = './vw_coco2014_96_2p5b'
+    dataType='train2014'
+    generateInstance(dataType, outputDataDir)
+
+    # Then for validation set, COCO2014
+    outputDataDir = './vw_coco2014_96_2p5b'
+    dataType='val2014'
+    generateInstance(dataType, outputDataDir)
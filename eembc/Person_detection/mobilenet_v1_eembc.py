@@ -5,269 +5,71 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Input, Dense, Activation, Flatten, BatchNormalization
 from tensorflow.keras.layers import Conv2D, DepthwiseConv2D, AveragePooling2D, MaxPooling2D
 from tensorflow.keras.regularizers import l2
-
-#define model
-def mobilenet_v1_eembc():
-    # Mobilenet parameters
-    input_shape = [96,96,3] # resized to 96x96 per EEMBC requirement
-    num_classes = 2 # person and non-person
-    num_filters = 8 # normally 32, but running with alpha=.25 per EEMBC requirement
-
-    inputs = Input(shape=input_shape)
-    x = inputs # Keras model uses ZeroPadding2D()
-
-    # 1st layer, pure conv
-    # Keras 2.2 model has padding='valid' and disables bias
+import yaml
+
+# MobileNetV1 block table, [pointwise filters at alpha=1, depthwise strides]
+# for the 13 depthwise separable layers (2nd to 14th layer) of the paper
+mobilenet_v1_blocks = [[64, 1],
+                       [128, 2],
+                       [128, 1],
+                       [256, 2],
+                       [256, 1],
+                       [512, 2],
+                       [512, 1],
+                       [512, 1],
+                       [512, 1],
+                       [512, 1],
+                       [512, 1],
+                       [1024, 2],
+                       [1024, 1]]
+
+# Number of filters for a width multiplier, as in the Keras MobileNet
+def scaled_filters(filters, alpha):
+    return max(1, int(filters * alpha))
+
+def conv_bn_relu(x, num_filters, kernel_size, strides, l2p):
     x = Conv2D(num_filters,
-                  kernel_size=3,
-                  strides=2,
+                  kernel_size=kernel_size,
+                  strides=strides,
                   padding='same',
                   kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
+                  kernel_regularizer=l2(l2p))(x)
     x = BatchNormalization()(x)
     x = Activation('relu')(x) # Keras uses ReLU6 instead of pure ReLU
+    return x
 
-    # 2nd layer, depthwise separable conv
-    # Filter size is always doubled before the pointwise conv
-    # Keras uses ZeroPadding2D() and padding='valid'
+# Depthwise separable conv
+# Keras uses ZeroPadding2D() and padding='valid'
+def depthwise_separable_block(x, num_filters, strides, l2p):
     x = DepthwiseConv2D(kernel_size=3,
-                  strides=1,
+                  strides=strides,
                   padding='same',
                   kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
+                  kernel_regularizer=l2(l2p))(x)
     x = BatchNormalization()(x)
     x = Activation('relu')(x)
 
-    num_filters = 2*num_filters
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 3rd layer, depthwise separable conv
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=2,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
+    return conv_bn_relu(x, num_filters, 1, 1, l2p)
 
-    num_filters = 2*num_filters
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 4th layer, depthwise separable conv
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 5th layer, depthwise separable conv
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=2,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    num_filters = 2*num_filters
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 6th layer, depthwise separable conv
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 7th layer, depthwise separable conv
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=2,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    num_filters = 2*num_filters
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 8th-12th layers, identical depthwise separable convs
-    # 8th
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 9th
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 10th
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 11th
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 12th
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    # 13th layer, depthwise separable conv
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=2,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
-
-    num_filters = 2*num_filters
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
+#define model
+# The defaults are the EEMBC configuration, MobileNet_v1_0.25_96:
+#   input_shape: resized to 96x96 per EEMBC requirement
+#   num_classes: person and non-person
+#   alpha: width multiplier, first layer has 32*alpha filters (normally 32,
+#          but running with alpha=.25 per EEMBC requirement)
+#   blocks: depthwise separable layers, see mobilenet_v1_blocks
+def mobilenet_v1_eembc(input_shape=[96,96,3], num_classes=2, alpha=0.25, first_filters=32,
+                       blocks=mobilenet_v1_blocks, l2p=1e-4):
+    inputs = Input(shape=input_shape)
+    x = inputs # Keras model uses ZeroPadding2D()
 
-    # 14th layer, depthwise separable conv
-    x = DepthwiseConv2D(kernel_size=3,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
+    # 1st layer, pure conv
+    # Keras 2.2 model has padding='valid' and disables bias
+    x = conv_bn_relu(x, scaled_filters(first_filters, alpha), 3, 2, l2p)
 
-    x = Conv2D(num_filters,
-                  kernel_size=1,
-                  strides=1,
-                  padding='same',
-                  kernel_initializer='he_normal',
-                  kernel_regularizer=l2(1e-4))(x)
-    x = BatchNormalization()(x)
-    x = Activation('relu')(x)
+    # 2nd-14th layers, depthwise separable convs
+    for filters, strides in blocks:
+        x = depthwise_separable_block(x, scaled_filters(filters, alpha), strides, l2p)
 
     # Average pooling, max polling may be used also
     # Keras employs GlobalAveragePooling2D 
@@ -284,3 +86,14 @@ def mobilenet_v1_eembc():
     # Instantiate model.
     model = Model(inputs=inputs, outputs=outputs)
     return model
+
+# Model from the 'model' section of a yaml config (see mobilenet_v1_eembc.yml),
+# missing entries keep the EEMBC defaults
+def mobilenet_v1_from_config(config):
+    config = dict(config)
+    config.pop('name', None)
+    return mobilenet_v1_eembc(**config)
+
+def mobilenet_v1_from_yaml(file_name):
+    with open(file_name) as stream:
+        return mobilenet_v1_from_config(yaml.safe_load(stream)['model'])
@@ -0,0 +1,76 @@
+import os
+import json
+import numpy as np
+
+# Packed shards of the visual wake words dataset
+# Every shard of a dataset portion is a set of .npy files in <outputDataDir>/shards:
+#   <dataType>_<n>_images.npy  uint8 [count, imgSize, imgSize, 3]
+#   <dataType>_<n>_labels.npy  uint8 [count], 1 for person and 0 for non_person
+#   <dataType>_<n>_names.npy   source file names, used to resume a build
+# <dataType>_index.json lists the completed shards and their sizes. Shards are
+# memory mapped when loaded, so training streams them without copies.
+
+def shardDir(outputDataDir):
+    return os.path.join(outputDataDir, 'shards')
+
+def indexFileName(outputDataDir, dataType):
+    return os.path.join(shardDir(outputDataDir), '%s_index.json'%dataType)
+
+# List of completed shards, each one a dict with the file names and count
+def readIndex(outputDataDir, dataType):
+    indexFile = indexFileName(outputDataDir, dataType)
+    if( not os.path.exists(indexFile) ):
+        return []
+    with open(indexFile) as stream:
+        return json.load(stream)
+
+# Write to a temporary file first so an interrupted build never leaves a partial file
+def saveArray(fileName, array):
+    with open(fileName + '.tmp', 'wb') as stream:
+        np.save(stream, array)
+    os.replace(fileName + '.tmp', fileName)
+
+# Write one shard and add it to the index
+def writeShard(outputDataDir, dataType, images, labels, names):
+    os.makedirs(shardDir(outputDataDir), exist_ok=True)
+    index = readIndex(outputDataDir, dataType)
+    prefix = '%s_%05d'%(dataType, len(index))
+    shard = {'images': prefix + '_images.npy',
+             'labels': prefix + '_labels.npy',
+             'names': prefix + '_names.npy',
+             'count': len(images)}
+    saveArray(os.path.join(shardDir(outputDataDir), shard['images']), np.asarray(images, dtype=np.uint8))
+    saveArray(os.path.join(shardDir(outputDataDir), shard['labels']), np.asarray(labels, dtype=np.uint8))
+    saveArray(os.path.join(shardDir(outputDataDir), shard['names']), np.asarray(names))
+
+    # The shard only counts as completed once it is in the index
+    index.append(shard)
+    indexFile = indexFileName(outputDataDir, dataType)
+    with open(indexFile + '.tmp', 'w') as stream:
+        json.dump(index, stream, indent=1)
+    os.replace(indexFile + '.tmp', indexFile)
+
+# Source file names of all the completed shards
+def completedNames(outputDataDir, dataType):
+    names = set()
+    for shard in readIndex(outputDataDir, dataType):
+        names.update(np.load(os.path.join(shardDir(outputDataDir), shard['names'])).tolist())
+    return names
+
+# Memory mapped images and labels of all the shards of a dataset portion
+# returns two lists with one array per shard
+def loadShards(outputDataDir, dataType, mmap_mode='r'):
+    images = []
+    labels = []
+    for shard in readIndex(outputDataDir, dataType):
+        images.append(np.load(os.path.join(shardDir(outputDataDir), shard['images']), mmap_mode=mmap_mode))
+        labels.append(np.load(os.path.join(shardDir(outputDataDir), shard['labels']), mmap_mode=mmap_mode))
+    return images, labels
+
+# Batches of (images, labels) over all the shards, e.g. for model.fit or
+# tf.data.Dataset.from_generator; only one batch is in memory at a time
+def shardBatches(outputDataDir, dataType, batchSize):
+    images, labels = loadShards(outputDataDir, dataType)
+    for shardImages, shardLabels in zip(images, labels):
+        for start in range(0, len(shardImages), batchSize):
+            yield shardImages[start:start+batchSize], shardLabels[start:start+batchSize]
@@ -0,0 +1,148 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import collections
+import multiprocessing
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Methodology'))
+import audio_frontend_eembc
+import eval_functions_eembc
+
+# Anomaly scores of ToyADMOS clips with toyadmos_autoencoder_eembc
+#   features: microfrontend spectrogram of every clip (window=64ms, stride=32ms,
+#             128 bins, upper limit just below 24KHz, see README.md)
+#   stacks: every 5 consecutive frames of a clip, [5,128,1] model inputs, as a
+#           strided view of the frames (stacks='center' keeps only the 5
+#           frames in the middle of the clip)
+#   scores: mean squared reconstruction error of every stack, averaged over
+#           the stacks of the clip
+# Clips are processed chunk_size at a time: workers compute the features of
+# the next chunks while the model runs on the current one, so memory does not
+# depend on the number of clips
+# Example, scoring the toy car test clips with trained weights:
+#   python toyadmos_pipeline.py --data ToyCar/test --weights trained_models/model_ToyCar.hdf5 --csv scores.csv
+
+frames_per_stack = 5
+
+# The microfrontend settings of README.md at the ToyADMOS sample rate; the upper
+# limit must stay below the Nyquist frequency (24KHz fails like the TF op)
+frontend_config = dict(sample_rate=48000, window_size=64, window_step=32, num_channels=128,
+                       upper_band_limit=23999.0, lower_band_limit=125.0, output_scale=10.0/256.0)
+
+# Wav files under the directories, normal clips first (the order
+# calculate_ae_auc expects), and their labels (1 for anomalous clips, the ones
+# with 'anomal' in their file name or in the name of their directory, the
+# rest of the path is left out so the data location does not matter)
+def is_anomalous(file_name):
+  return 'anomal' in os.path.basename(file_name).lower() or 'anomal' in os.path.basename(os.path.dirname(file_name)).lower()
+
+def list_clips(directories):
+  files = []
+  for directory in directories:
+    for root, _, names in os.walk(directory):
+      files += [os.path.join(root, name) for name in names if name.lower().endswith('.wav')]
+  labels = np.array([is_anomalous(f) for f in files], dtype=int)
+  order = np.lexsort((np.array(files), labels))
+  return [files[i] for i in order], labels[order]
+
+# Features [frames, channels, 1] of every file, clips of the same length computed together
+# Clips with fewer than 5 frames (about 190ms at 48KHz) have no stack to score
+# and are rejected
+def clip_features(file_names, config):
+  config = audio_frontend_eembc.frontend_config(config)
+  clips = [audio_frontend_eembc.read_wav(f, None, config['sample_rate']) for f in file_names]
+  tables = audio_frontend_eembc.frontend_tables(tuple(sorted(config.items())))
+  for file_name, clip in zip(file_names, clips):
+    num_frames = max(0, 1 + (len(clip) - tables['size']) // tables['step'])
+    if( num_frames < frames_per_stack ):
+      raise ValueError(f"{file_name} is too short: {num_frames} frames, at least {frames_per_stack} are needed")
+  features = [None] * len(clips)
+  for length in set(len(clip) for clip in clips):
+    same = [i for i, clip in enumerate(clips) if len(clip) == length]
+    output = audio_frontend_eembc.frontend(np.stack([clips[i] for i in same]), config)
+    for i, clip_output in zip(same, output):
+      features[i] = clip_output.astype(np.float32)[..., np.newaxis] * np.float32(config['output_scale'])
+  return features
+
+# Model inputs [stacks, 5, channels, 1] of frames [frames, channels, 1], the
+# overlapping stacks share the memory of the frames (no copies)
+def stack_frames(features):
+  return np.moveaxis(np.lib.stride_tricks.sliding_window_view(features, frames_per_stack, axis=0), -1, 1)
+
+# Mean squared reconstruction error of every stack of a batch
+def error_function(model):
+  import tensorflow as tf
+  input_shape = [None, frames_per_stack, frontend_config['num_channels'], 1]
+  return tf.function(lambda x: tf.reduce_mean(tf.square(x - model(x, training=False)), axis=[1, 2, 3]),
+                     input_signature=[tf.TensorSpec(input_shape, tf.float32)])
+
+# Anomaly score of every clip of a list of features [frames, channels, 1]
+# The frames of the clips are put one after the other and all the stacks of
+# them go through the model in batches of batch_size (only a batch is copied),
+# the few stacks across two clips are left out of the scores
+def clip_scores(errors, features, stacks='all', batch_size=4096):
+  lengths = np.array([len(f) for f in features])
+  if( np.any(lengths < frames_per_stack) ):
+    raise ValueError(f"Clips need at least {frames_per_stack} frames, the shortest has {np.min(lengths)}")
+  offsets = np.cumsum(lengths) - lengths
+  counts = lengths - frames_per_stack + 1
+  view = stack_frames(np.concatenate(features))
+  if( stacks == 'center' ):
+    return errors(view[offsets + counts // 2]).numpy()
+  stack_errors = np.concatenate([errors(view[start:start+batch_size]).numpy() for start in range(0, len(view), batch_size)])
+  return np.array([np.mean(stack_errors[offset:offset+count]) for offset, count in zip(offsets, counts)])
+
+# Scores of all the files, chunk_size clips at a time, num_workers processes
+# computing the features of the next chunks
+# At most num_workers + 1 chunks are in flight (a new chunk is submitted only
+# once the oldest one is taken), so finished features do not pile up when the
+# workers are faster than the model
+def score_files(model, file_names, stacks='all', batch_size=4096, chunk_size=32, num_workers=os.cpu_count()):
+  errors = error_function(model)
+  chunks = [file_names[start:start+chunk_size] for start in range(0, len(file_names), chunk_size)]
+  scores = []
+  pending = collections.deque()
+  with multiprocessing.get_context('spawn').Pool(num_workers) as pool:
+    for index in range(len(chunks) + num_workers + 1):
+      if( index > num_workers ):
+        scores.append(clip_scores(errors, pending.popleft().get(), stacks, batch_size))
+        print(f"\r{sum(len(s) for s in scores)}/{len(file_names)} clips", end='', flush=True)
+      if( index < len(chunks) ):
+        pending.append(pool.apply_async(clip_features, (chunks[index], frontend_config)))
+  print()
+  return np.concatenate(scores) if scores else np.zeros(0)
+
+def write_scores(file_name, clip_files, labels, scores):
+  with open(file_name, 'w', newline='') as stream:
+    writer = csv.writer(stream)
+    writer.writerow(['file', 'anomaly', 'score'])
+    writer.writerows(zip(clip_files, labels, scores))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-d', '--data', type=str, nargs='+', required=True, help="directories of wav clips (searched recursively)")
+  parser.add_argument('-w', '--weights', type=str, default=None, help="trained weights of the autoencoder")
+  parser.add_argument('-s', '--stacks', type=str, default='all', choices=['all', 'center'], help="stacks of 5 frames per clip")
+  parser.add_argument('-b', '--batch', type=int, default=4096, help="stacks per model call")
+  parser.add_argument('-c', '--chunk', type=int, default=32, help="clips per chunk")
+  parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="feature worker processes")
+  parser.add_argument('--csv', type=str, default=None, help="write the score of every clip to a CSV file")
+  args = parser.parse_args()
+
+  import toyadmos_autoencoder_eembc
+  model = toyadmos_autoencoder_eembc.toyadmos_autoencoder_eembc()
+  if( args.weights ):
+    model.load_weights(args.weights)
+
+  clip_files, labels = list_clips(args.data)
+  print(f"{len(clip_files)} clips, {np.sum(labels)} anomalous")
+  start = time.time()
+  scores = score_files(model, clip_files, args.stacks, args.batch, args.chunk, args.workers)
+  print(f"Scored {len(clip_files)} clips in {time.time() - start:.1f} s")
+  if( args.csv ):
+    write_scores(args.csv, clip_files, labels, scores)
+  if( 0 < np.sum(labels) < len(labels) ):
+    eval_functions_eembc.calculate_ae_auc(scores, labels, 'toyadmos_autoencoder_eembc', plot=False)